@@ -0,0 +1,150 @@
+# batch.py
+# Parse many program files on a process pool
+"""Batch driver for the parser.
+
+Files are given as paths, directories or glob patterns and are parsed on a
+pool of worker processes. Results are written to the output file as soon
+as they are ready, in the order the files were given, in the same format
+main() has always used for parser_output.txt."""
+import concurrent.futures
+import glob
+import itertools
+import os
+import re
+
+import prescan
+from parser import CursorParser, header, format_result, limit_errors
+from parallel import ParallelParser
+
+# files picked up from a directory: the numbered test programs
+DIRECTORY_PATTERN = '[0-9]*.txt'
+
+def natural_key(path):
+    """Sort key that puts 2.txt before 10.txt"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+def numbered_files(directory='.'):
+    """Return 1.txt, 2.txt, ... in directory, up to the first missing number"""
+    paths = []
+    i = 1
+    while os.path.isfile(os.path.join(directory, str(i)+'.txt')):
+        paths.append(os.path.normpath(os.path.join(directory, str(i)+'.txt')))
+        i += 1
+    return paths
+
+def expand_paths(specs, pattern=DIRECTORY_PATTERN):
+    """Turn a list of paths, directories and glob patterns into a list of
+    files. Directories contribute the files matching pattern and glob
+    patterns the files they match, both in natural order. Raise
+    FileNotFoundError for a path or pattern that matches nothing."""
+    paths = []
+    for spec in specs:
+        if os.path.isdir(spec):
+            found = [os.path.normpath(p) for p in glob.glob(os.path.join(spec, pattern))]
+        elif glob.has_magic(spec):
+            found = glob.glob(spec)
+        elif os.path.exists(spec):
+            found = [spec]
+        else:
+            found = []
+        found = sorted((p for p in found if os.path.isfile(p)), key=natural_key)
+        if not found:
+            raise FileNotFoundError("no program files match " + repr(spec))
+        paths += found
+    return paths
+
+def parse_file(path, jobs=1, cache=None, cache_size=None, mapped=False, max_errors=None, dedupe=False,
+               quick=False):
+    """Parse the program in the file at path, splitting it between jobs
+    worker processes if jobs is more than 1. cache is the path of a result
+    cache (see cache.py) to look the program up in first, or None. With
+    mapped, the file is memory-mapped and parsed as bytes (see mapped.py)
+    in this process. max_errors and dedupe are CursorParser's. With quick,
+    a program the pre-scan (see prescan.py) finds broken is not parsed and
+    its entry lists what the pre-scan found instead of the parser's errors.
+    Return its entry for the output file and whether it is valid"""
+    if mapped:
+        import mapped as mapped_input
+        with mapped_input.open_mapped(path) as buffer:
+            return parse_contents(path, buffer, jobs, cache, cache_size, max_errors, dedupe, quick)
+    with open(path, 'r') as f:
+        contents = f.read()
+    return parse_contents(path, contents, jobs, cache, cache_size, max_errors, dedupe, quick)
+
+def parse_contents(path, contents, jobs=1, cache=None, cache_size=None, max_errors=None, dedupe=False,
+                   quick=False):
+    """parse_file() for the program contents read from path, a str or the
+    mapped bytes of the file"""
+    results = key = None
+    if cache is not None:
+        import cache as result_cache
+        results = result_cache.open_cache(cache, cache_size or result_cache.DEFAULT_MAX_BYTES)
+        key = result_cache.content_key(contents)
+        if dedupe:
+            # deduplicated lists are kept apart from whole ones
+            key += '-dedupe'
+        errors = results.get(key)
+        if errors is not None:
+            return format_result(path, limit_errors(errors, max_errors)), not errors
+    clause_ends = None
+    if quick:
+        scan = prescan.scan(contents)
+        problems = scan.problems()
+        if problems:
+            return format_result(path, limit_errors(['Pre-scan: ' + problem for problem in problems],
+                                                    max_errors)), False
+        clause_ends = scan.clause_ends
+    if not isinstance(contents, str):
+        import mapped as mapped_input
+        errors = mapped_input.validate(contents, max_errors=max_errors, dedupe=dedupe)
+    elif jobs > 1:
+        errors = ParallelParser(contents, jobs, clause_ends, max_errors, dedupe).parse()
+    else:
+        errors = CursorParser(contents, max_errors=max_errors, dedupe=dedupe).parse()
+    # only whole error lists are cached
+    if results is not None and max_errors is None:
+        results.put(key, errors)
+    return format_result(path, errors), not errors
+
+def parse_files(paths, jobs=None, split=False, cache=None, cache_size=None, mapped=False,
+                max_errors=None, dedupe=False, quick=False):
+    """Yield (entry, valid) for each file in paths, in order, parsing them
+    on jobs worker processes (all CPUs by default; 1 parses in this process).
+    With split, the files are parsed one at a time and each file is split
+    between the workers instead. The other arguments are passed on to
+    parse_file()"""
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if split:
+        for path in paths:
+            yield parse_file(path, jobs, cache, cache_size, mapped, max_errors, dedupe, quick)
+        return
+    if jobs <= 1 or len(paths) <= 1:
+        for path in paths:
+            yield parse_file(path, 1, cache, cache_size, mapped, max_errors, dedupe, quick)
+        return
+    # big enough chunks to keep the workers busy, small enough that results
+    # keep arriving while the rest are parsed
+    chunksize = max(1, min(64, len(paths) // (jobs * 4)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from executor.map(parse_file, paths, itertools.repeat(1), itertools.repeat(cache),
+                                itertools.repeat(cache_size), itertools.repeat(mapped),
+                                itertools.repeat(max_errors), itertools.repeat(dedupe), itertools.repeat(quick),
+                                chunksize=chunksize)
+
+def run_batch(paths, ofilename='parser_output.txt', jobs=None, split=False, cache=None, cache_size=None,
+              mapped=False, max_errors=None, dedupe=False, quick=False):
+    """Parse the files in paths and write the results to ofilename.
+    Return the number of invalid programs"""
+    invalid = 0
+    with open(ofilename, 'w') as out:
+        out.write(ofilename + header)
+        for i, (entry, valid) in enumerate(parse_files(paths, jobs, split, cache, cache_size, mapped,
+                                                             max_errors, dedupe, quick)):
+            if i > 0:
+                out.write('\n')
+            out.write(entry)
+            out.flush()
+            if not valid:
+                invalid += 1
+    return invalid
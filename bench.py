@@ -0,0 +1,396 @@
+# bench.py
+# Scaling benchmarks for the parsers on generated programs
+"""Benchmark suite.
+
+generate() makes a random program under the grammar in grammar.txt from a
+seed, with separate knobs for the number of clauses, how deeply structures
+nest, how many terms a term list has, how long quoted atoms are and how
+many clauses have an error in them. Each sweep varies one knob, parses the
+program at every size and records the wall time (the best of as many runs
+as fit in MIN_TIME seconds, and at least a few), the throughput in bytes
+and clauses per second and the peak memory. The exponent k of time ~
+size**k is fitted over the sweep: linear parsing gives k close to 1, and
+backtracking that copies or rescans the input shows up as k near 2.
+
+Throughput depends on the machine, so the largest program of each sweep
+is parsed again in turns with a fixed piece of pure-Python work, and the
+throughput is stored and compared relative to that work, as bytes parsed
+per run of it (see relative_speed()). Results are written to bench_output.txt and compared with
+bench_baseline.json and the run fails if a sweep's exponent or its
+relative throughput got worse by more than the tolerances;
+--update-baseline stores the results as the new baseline."""
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+from parser import Parser, CursorParser
+from packrat import PackratParser
+
+BASELINE_FILE = 'bench_baseline.json'
+OUTPUT_FILE = 'bench_output.txt'
+
+ENGINES = {
+    'cursor': CursorParser,
+    'packrat': PackratParser,
+    'reference': Parser,
+}
+
+# knob defaults for generate()
+DEFAULTS = {
+    'clauses': 200,
+    'depth': 2,
+    'width': 3,
+    'string_length': 6,
+    'error_rate': 0.0,
+}
+
+# (name, knob, values); the other knobs keep their defaults. The errors
+# sweep keeps the size of the program about the same, so no exponent is
+# fitted for it
+SWEEPS = [
+    ('clauses', 'clauses', [250, 500, 1000, 2000, 4000]),
+    ('depth', 'depth', [2, 4, 8, 16, 32]),
+    ('width', 'width', [2, 4, 8, 16, 32]),
+    ('strings', 'string_length', [64, 128, 256, 512, 1024]),
+    ('errors', 'error_rate', [0.0, 0.1, 0.2, 0.4, 0.8]),
+]
+UNSIZED_SWEEPS = ('errors',)
+# a quoted atom is lexed in one match, so time hardly grows with string
+# length and the exponent fitted for the strings sweep is near 0 and mostly
+# noise; it is reported but not checked, and slow long strings show in the
+# throughput at the largest size instead
+UNCHECKED_EXPONENTS = ('strings',)
+
+# the reference Parser is quadratic, so it gets smaller programs
+REFERENCE_SCALE = 0.1
+
+# each size is parsed again until this many seconds were spent on it, so
+# that the best time of small programs is not one run's noise
+MIN_TIME = 0.5
+
+_LOWER = 'abcdefghijklmnopqrstuvwxyz'
+_UPPER = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ_'
+_ALPHANUMERIC = _LOWER + _UPPER + '0123456789'
+# <character>s, without the space so that strings are easy to read
+_CHARACTERS = _ALPHANUMERIC + '+-*/\\^~:.?#$&'
+# characters that are not in any token
+_UNRECOGNIZED = '[]|=<>%!;"{}'
+
+class Generator():
+    """Random program generator; see generate()"""
+
+    def __init__(self, seed, clauses, depth, width, string_length, error_rate):
+        self.rng = random.Random(seed)
+        self.clauses = clauses
+        self.depth = depth
+        self.width = width
+        self.string_length = string_length
+        self.error_rate = error_rate
+
+    def name(self, first):
+        rng = self.rng
+        return rng.choice(first) + ''.join(rng.choice(_ALPHANUMERIC) for _ in range(rng.randint(0, 7)))
+
+    def atom(self):
+        if self.rng.random() < 0.2:
+            return "'" + ''.join(self.rng.choice(_CHARACTERS) for _ in range(self.string_length)) + "'"
+        return self.name(_LOWER)
+
+    def leaf(self):
+        r = self.rng.random()
+        if r < 0.4:
+            return self.atom()
+        if r < 0.8:
+            return self.name(_UPPER)
+        return str(self.rng.randint(0, 10**self.rng.randint(1, 6)))
+
+    def term_list(self, depth):
+        """width terms, the first of which nests depth structures deep"""
+        terms = [self.leaf() for _ in range(self.width)]
+        text = ', '.join(terms[1:])
+        first = terms[0]
+        for _ in range(depth):
+            first = self.atom() + '(' + first + (', ' + text if text else '') + ')'
+        return first + (', ' + text if text else '')
+
+    def predicate(self):
+        return self.atom() + '(' + self.term_list(self.depth) + ')'
+
+    def clause(self):
+        rng = self.rng
+        text = self.predicate()
+        if rng.random() < 0.5:
+            text += ' :- ' + ', '.join(self.predicate() for _ in range(rng.randint(1, 3)))
+        text += '.'
+        if rng.random() < self.error_rate:
+            text = self.corrupt(text)
+        return text
+
+    def corrupt(self, text):
+        """Put an error at the start of a clause. The parser reports it as an
+        invalid <predicate> and goes on with the rest of the clause"""
+        rng = self.rng
+        if rng.random() < 0.5:
+            # unrecognized character
+            return rng.choice(_UNRECOGNIZED) + text
+        # a <variable> where the <atom> should be
+        return self.name(_UPPER) + ' ' + text
+
+    def program(self):
+        lines = [self.clause() for _ in range(self.clauses)]
+        lines.append('?- ' + self.predicate() + '.')
+        return '\n'.join(lines) + '\n'
+
+def generate(seed=0, clauses=DEFAULTS['clauses'], depth=DEFAULTS['depth'], width=DEFAULTS['width'],
+             string_length=DEFAULTS['string_length'], error_rate=DEFAULTS['error_rate']):
+    """Return a random program. The program is valid when error_rate is 0;
+    otherwise each clause has an error in it with probability error_rate.
+    The same arguments always give the same program."""
+    return Generator(seed, clauses, depth, width, string_length, error_rate).program()
+
+def _best_time(work, repeat, min_time=MIN_TIME):
+    """Return the best wall time of calls of work, made at least repeat
+    times and until min_time seconds were spent, with the garbage
+    collector run between the calls rather than in some of them"""
+    best = math.inf
+    spent = 0.0
+    runs = 0
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while runs < repeat or spent < min_time:
+            # collect the last run's cycles outside the timed part
+            gc.collect()
+            start = time.perf_counter()
+            work()
+            elapsed = time.perf_counter() - start
+            best = min(best, elapsed)
+            spent += elapsed
+            runs += 1
+    finally:
+        if enabled:
+            gc.enable()
+    return best
+
+# text the calibration work goes through
+_CALIBRATION_TEXT = ''.join(_CHARACTERS[(i * 7919) % len(_CHARACTERS)] for i in range(1 << 16))
+
+def _calibration_work():
+    """Fixed work like a parser's: a pass over a text, a character at a
+    time, with dict lookups, slices and method calls"""
+    text = _CALIBRATION_TEXT
+    counts = {}
+    words = []
+    start = 0
+    for i, c in enumerate(text):
+        counts[c] = counts.get(c, 0) + 1
+        if c in '.:?#':
+            words.append(text[start:i].lower())
+            start = i + 1
+    return len(words)
+
+def relative_speed(engine, text, repeat=3, min_time=4 * MIN_TIME):
+    """Return (bytes of text engine parses per run of _calibration_work(),
+    runs of _calibration_work() per second). The two are timed in turns,
+    at least repeat times and until min_time seconds were spent, so that
+    both see the machine over the same stretch of time, and the best time
+    of each is used"""
+    calibration = math.inf
+    best = math.inf
+    spent = 0.0
+    runs = 0
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        while runs < repeat or spent < min_time:
+            gc.collect()
+            start = time.perf_counter()
+            _calibration_work()
+            middle = time.perf_counter()
+            engine(text).parse()
+            end = time.perf_counter()
+            calibration = min(calibration, middle - start)
+            best = min(best, end - middle)
+            spent += end - start
+            runs += 1
+    finally:
+        if enabled:
+            gc.enable()
+    return len(text) * calibration / best, 1 / calibration
+
+def measure(engine, text, repeat=3):
+    """Parse text with engine (a parser class).
+    Return (best wall time in seconds, peak memory in bytes, number of errors)"""
+    errors = engine(text).parse()
+    best = _best_time(lambda: engine(text).parse(), repeat)
+    # memory is measured on a separate run, since tracing slows parsing down
+    tracemalloc.start()
+    try:
+        engine(text).parse()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak, len(errors)
+
+def fit_exponent(sizes, times):
+    """Least squares fit of log(time) = k*log(size) + c. Return k"""
+    xs = [math.log(s) for s in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in times]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    sxx = sum((x - mx) ** 2 for x in xs)
+    if sxx == 0:
+        return 0.0
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx
+
+def run_sweep(engine, name, knob, values, seed=0, repeat=3, scale=1.0):
+    """Run the sweep called name. Return a dict with a row per value and
+    the fitted exponent"""
+    rows = []
+    for value in values:
+        knobs = dict(DEFAULTS)
+        knobs[knob] = value
+        # scale makes the programs smaller: fewer clauses, and shorter
+        # strings in the sweep over their length
+        knobs['clauses'] = max(1, int(knobs['clauses'] * scale))
+        if knob == 'string_length':
+            knobs[knob] = max(1, int(value * scale))
+        value = knobs[knob]
+        text = generate(seed, **knobs)
+        seconds, peak, nerrors = measure(engine, text, repeat)
+        largest = text
+        rows.append({
+            knob: value,
+            'bytes': len(text),
+            'clauses': knobs['clauses'],
+            'seconds': seconds,
+            'bytes_per_second': len(text) / seconds,
+            'clauses_per_second': knobs['clauses'] / seconds,
+            'peak_memory': peak,
+            'errors': nerrors,
+        })
+    exponent = None
+    if name not in UNSIZED_SWEEPS:
+        exponent = fit_exponent([row['bytes'] for row in rows], [row['seconds'] for row in rows])
+    speed, calibration = relative_speed(engine, largest, repeat)
+    return {'knob': knob, 'rows': rows, 'exponent': exponent, 'calibration': calibration,
+            'relative_speed': speed}
+
+def median_sweep(runs):
+    """Return the first of several results of the same sweep, with the
+    median exponent, calibration and relative speed of all of them"""
+    sweep = dict(runs[0])
+    for key in ('exponent', 'calibration', 'relative_speed'):
+        if sweep[key] is not None:
+            sweep[key] = statistics.median(run[key] for run in runs)
+    sweep['runs'] = len(runs)
+    return sweep
+
+def format_sweep(name, sweep):
+    """Return the table for a sweep as text"""
+    knob = sweep['knob']
+    lines = [name + ' (' + knob + ')']
+    if sweep['exponent'] is not None:
+        lines[0] += ', time ~ size**' + format(sweep['exponent'], '.2f')
+    lines[0] += ', calibration %.1f/s, %.0f bytes per unit' % (sweep['calibration'], sweep['relative_speed'])
+    if sweep.get('runs', 1) > 1:
+        lines[0] += ' (medians of ' + str(sweep['runs']) + ' runs)'
+    lines.append('%14s %10s %9s %10s %12s %12s %10s %7s' % (
+        knob, 'bytes', 'clauses', 'seconds', 'bytes/s', 'clauses/s', 'peak KiB', 'errors'))
+    for row in sweep['rows']:
+        lines.append('%14s %10d %9d %10.4f %12.0f %12.0f %10d %7d' % (
+            row[knob], row['bytes'], row['clauses'], row['seconds'], row['bytes_per_second'],
+            row['clauses_per_second'], row['peak_memory'] // 1024, row['errors']))
+    return '\n'.join(lines) + '\n'
+
+def check(engine_name, results, baseline, exponent_slack, tolerance):
+    """Compare results with the baseline of engine_name.
+    Return a list of regressions"""
+    problems = []
+    stored = baseline.get(engine_name, {})
+    for name, sweep in results.items():
+        base = stored.get(name)
+        if base is None:
+            continue
+        if (sweep['exponent'] is not None and name not in UNCHECKED_EXPONENTS
+                and sweep['exponent'] > base['exponent'] + exponent_slack):
+            problems.append('%s: time ~ size**%.2f, baseline %.2f' % (name, sweep['exponent'], base['exponent']))
+        speed = sweep['relative_speed']
+        if speed * tolerance < base['relative_speed']:
+            problems.append('%s: %.0f bytes per calibration unit at the largest size, baseline %.0f'
+                            % (name, speed, base['relative_speed']))
+    return problems
+
+def main(argv=None) -> int:
+    argparser = argparse.ArgumentParser(description="Scaling benchmarks for the parser")
+    argparser.add_argument('--engine', choices=sorted(ENGINES), default='cursor',
+                           help='parser to benchmark (default: cursor)')
+    argparser.add_argument('--sweep', action='append', choices=[name for name, knob, values in SWEEPS],
+                           help='run only this sweep (may be repeated)')
+    argparser.add_argument('--seed', type=int, default=0)
+    argparser.add_argument('--repeat', type=int, default=3,
+                           help='least runs per size; the best time is kept (default: 3)')
+    argparser.add_argument('--runs', type=int, default=1,
+                           help='run each sweep this many times and keep the median exponent and '
+                                'throughput, for recording a baseline on a noisy machine (default: 1)')
+    argparser.add_argument('--scale', type=float, default=None,
+                           help='multiply the number of clauses and the string length by this '
+                                '(default: 1, or 0.1 for the reference parser)')
+    argparser.add_argument('--baseline', default=BASELINE_FILE,
+                           help='baseline file (default: bench_baseline.json)')
+    argparser.add_argument('--update-baseline', action='store_true',
+                           help='store the results as the baseline instead of checking them')
+    argparser.add_argument('--exponent-slack', type=float, default=0.25,
+                           help='how much a fitted exponent may grow (default: 0.25)')
+    argparser.add_argument('--tolerance', type=float, default=2.0,
+                           help='how many times slower than the baseline, relative to the calibration, '
+                                'is allowed (default: 2)')
+    argparser.add_argument('-o', '--output', default=OUTPUT_FILE,
+                           help='output file (default: bench_output.txt)')
+    args = argparser.parse_args(argv)
+    engine = ENGINES[args.engine]
+    scale = args.scale if args.scale is not None else (REFERENCE_SCALE if args.engine == 'reference' else 1.0)
+    # the reference parser recurses once per character of a clause
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+
+    results = {}
+    with open(args.output, 'w') as out:
+        out.write('engine: ' + args.engine + ', seed: ' + str(args.seed) + ', scale: ' + str(scale) + '\n')
+        for name, knob, values in SWEEPS:
+            if args.sweep and name not in args.sweep:
+                continue
+            runs = [run_sweep(engine, name, knob, values, args.seed, args.repeat, scale)
+                    for _ in range(args.runs)]
+            results[name] = median_sweep(runs)
+            table = format_sweep(name, results[name])
+            out.write('\n' + table)
+            out.flush()
+            print(table, flush=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.update_baseline:
+        stored = baseline.setdefault(args.engine, {})
+        for name, sweep in results.items():
+            stored[name] = {'relative_speed': round(sweep['relative_speed'])}
+            if sweep['exponent'] is not None:
+                stored[name]['exponent'] = round(sweep['exponent'], 3)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return 0
+    problems = check(args.engine, results, baseline, args.exponent_slack, args.tolerance)
+    for problem in problems:
+        print('REGRESSION ' + problem)
+    return 1 if problems else 0
+
+if __name__=="__main__": exit(main())
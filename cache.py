@@ -0,0 +1,114 @@
+# cache.py
+# On-disk cache of parse results, keyed by program contents
+"""Persistent result cache for the batch runner.
+
+The error list of a program is stored under a hash of its contents and of
+the parser version: the source of the modules that decide what the errors
+are and the grammar they implement. Changing any of them starts over with
+an empty cache.
+
+The cache is an SQLite database, so that worker processes can read and
+write it at the same time. Every hit records when the entry was used, and
+when the entries take more than max_bytes the least recently used ones are
+deleted."""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_PATH = '.parser_cache.db'
+DEFAULT_MAX_BYTES = 64 << 20
+
+# files whose contents decide the error list of a program
+_VERSION_FILES = ('parser.py', 'lexer.py', 'grammar.py', 'grammar.txt', 'tokens.txt')
+
+_version = None
+
+def parser_version():
+    """Return a hash of the parser source and grammar"""
+    global _version
+    if _version is None:
+        h = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in _VERSION_FILES:
+            h.update(name.encode('utf-8') + b'\0')
+            try:
+                with open(os.path.join(here, name), 'rb') as f:
+                    h.update(f.read())
+            except FileNotFoundError:
+                pass
+            h.update(b'\0')
+        _version = h.hexdigest()
+    return _version
+
+def content_key(contents):
+    """Return the cache key for the program contents, a str or its UTF-8
+    bytes (which give the same key)"""
+    h = hashlib.sha256(parser_version().encode('ascii'))
+    if isinstance(contents, str):
+        contents = contents.encode('utf-8', 'surrogatepass')
+    h.update(contents)
+    return h.hexdigest()
+
+class ResultCache():
+    """Cache of error lists in the SQLite database at path.
+    Usage:
+        cache = ResultCache(path)
+        errors = cache.get(key)     # None on a miss
+        cache.put(key, errors)"""
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        # autocommit; writes take the lock with BEGIN IMMEDIATE, and other
+        # processes wait for it instead of failing
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS results ('
+                        'key TEXT PRIMARY KEY, errors TEXT NOT NULL, '
+                        'size INTEGER NOT NULL, used INTEGER NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+
+    def get(self, key):
+        """Return the error list stored under key, or None"""
+        row = self.db.execute('SELECT errors FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute('UPDATE results SET used = ? WHERE key = ?', (time.time_ns(), key))
+        return json.loads(row[0])
+
+    def put(self, key, errors):
+        """Store the error list under key, then evict the least recently
+        used entries until the cache fits in max_bytes"""
+        data = json.dumps(errors)
+        size = len(key) + len(data)
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+                            (key, data, size, time.time_ns()))
+            total = self.db.execute('SELECT SUM(size) FROM results').fetchone()[0]
+            if total > self.max_bytes:
+                # keep the most recently used entries that fit
+                self.db.execute('DELETE FROM results WHERE used <= ('
+                                'SELECT used FROM ('
+                                'SELECT used, SUM(size) OVER (ORDER BY used DESC) AS kept FROM results'
+                                ') WHERE kept > ? ORDER BY used DESC LIMIT 1)', (self.max_bytes,))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        self.db.close()
+
+# caches opened by this process, by path
+_open = {}
+
+def open_cache(path, max_bytes=DEFAULT_MAX_BYTES):
+    """Return this process's ResultCache for path, opening it on first use"""
+    cache = _open.get(path)
+    if cache is None:
+        cache = _open[path] = ResultCache(path, max_bytes)
+    return cache
@@ -0,0 +1,472 @@
+# compiled.py
+# Compiled binary form of a validated program
+"""Save the tree of a valid program so that it can be loaded without parsing.
+
+compile_program() turns a tree.Program into bytes and compile_file()
+parses a program file and writes them to FILE.plc. CompiledProgram
+memory-maps such a file and has the clauses, query and symbols of a
+tree.Program, so it can stand in for one (for solve.Solver or
+index.build_index); a clause's nodes are only built the first time it is
+used. CompiledProgram.procedure() finds the clauses of a name/arity and
+indexes them by first argument without building any, so solve.Solver only
+builds the clauses that its goals try. load_program() gives the program
+of a source file from its compiled file when that is up to date and
+parses the source otherwise.
+
+A compiled file records the version of its layout and the parser version
+(cache.parser_version(), a hash of the parser source and grammar) it was
+made with, and the size and modification time of the source file. A file
+made by another parser or grammar, or for an older source, is not used.
+
+File layout, little-endian 32-bit words after the header:
+    header      magic, layout version, parser version, source size and
+                mtime, the counts of the tables below and the query's
+                first cell, goal count and line
+    symbols     (kind, text, text length) for each atom, variable name and
+                numeral; leaves with the same kind and text share a symbol
+    clauses     (first cell, goal count, line, offset) in program order;
+                offset takes two words
+    predicates  (name symbol, arity, first posting, clause count, first
+                key, key count, variable count) for each name/arity of a
+                clause head, sorted by name text and arity
+    keys        (key cell, arity, first posting, count) for each first
+                argument of the clauses of a predicate, sorted by tag, text
+                and arity within the predicate; the key cell is the atom,
+                numeral or functor cell of the argument and arity is that
+                of a structure
+    order       postings: the clause numbers of each predicate in program
+                order, the predicates one after another
+    keyed       the same clause numbers, each predicate's grouped by key
+                in the order of its keys and then the clauses whose first
+                argument is a variable
+    cells       the terms, in prefix order: a cell holds a tag in its low
+                two bits and a symbol number above them, and the cell of a
+                structure or predicate is followed by a cell with its arity
+                and then its arguments; a clause is its head followed by its
+                body goals
+    strings     symbol texts, UTF-8"""
+import argparse
+import array
+import mmap
+import os
+import struct
+import sys
+
+import cache
+from parser import CursorParser
+from tree import Atom, Variable, Numeral, Structure, Predicate, Clause, Query, SymbolTable
+
+MAGIC = b'PLCO'
+VERSION = 2
+SUFFIX = '.plc'
+
+# cell tags
+ATOM = 0
+VARIABLE = 1
+NUMERAL = 2
+STRUCTURE = 3
+
+_HEADER = struct.Struct('<4sI32sQQIIIIIIIII')
+_SYMBOL = struct.Struct('<III')
+_CLAUSE = struct.Struct('<IIIQ')
+_PREDICATE = struct.Struct('<IIIIIII')
+_KEY = struct.Struct('<IIII')
+
+class StaleProgram(Exception):
+    """A compiled file that cannot be used: not one, of another layout or
+    parser version, or older than its source"""
+
+def _source_stamp(path):
+    """Return (size, mtime in ns) of the source file at path"""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+class _Writer():
+    """Collects the symbols and cells of a program"""
+
+    def __init__(self):
+        # (kind, text) -> symbol number
+        self.numbers = {}
+        self.symbols = []
+        self.strings = bytearray()
+        self.cells = []
+
+    def symbol(self, kind, text):
+        key = (kind, text)
+        number = self.numbers.get(key)
+        if number is None:
+            data = text.encode('utf-8')
+            number = self.numbers[key] = len(self.symbols)
+            self.symbols.append((kind, len(self.strings), len(data)))
+            self.strings += data
+        return number
+
+    def term(self, node):
+        """Append the cells of a term. Nested structures are kept on a stack
+            instead of recursing"""
+        cells = self.cells
+        # terms still to write, last first
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Structure):
+                cells.append(self.symbol(ATOM, node.functor.name) << 2 | STRUCTURE)
+                cells.append(len(node.args))
+                stack.extend(reversed(node.args))
+            elif isinstance(node, Atom):
+                cells.append(self.symbol(ATOM, node.name) << 2 | ATOM)
+            elif isinstance(node, Variable):
+                cells.append(self.symbol(VARIABLE, node.name) << 2 | VARIABLE)
+            elif isinstance(node, Numeral):
+                cells.append(self.symbol(NUMERAL, str(node.value)) << 2 | NUMERAL)
+            else:
+                raise TypeError('not a term: ' + repr(node))
+
+    def predicate(self, node):
+        self.cells.append(self.symbol(ATOM, node.functor.name) << 2 | STRUCTURE)
+        self.cells.append(len(node.args))
+        for arg in node.args:
+            self.term(arg)
+
+    def key(self, node):
+        """Return (tag, text, arity, cell) for a first argument, sorted as
+            the key table is, or None for a variable"""
+        if isinstance(node, Structure):
+            return STRUCTURE, node.functor.name.encode('utf-8'), len(node.args), \
+                self.symbol(ATOM, node.functor.name) << 2 | STRUCTURE
+        if isinstance(node, Atom):
+            return ATOM, node.name.encode('utf-8'), 0, self.symbol(ATOM, node.name) << 2 | ATOM
+        if isinstance(node, Numeral):
+            text = str(node.value)
+            return NUMERAL, text.encode('utf-8'), 0, self.symbol(NUMERAL, text) << 2 | NUMERAL
+        return None
+
+def _key_of(key):
+    """Return (tag, text, arity) of a first-argument key as
+    CompiledProcedure.keyed() takes it"""
+    if type(key) is tuple:
+        return STRUCTURE, key[0].encode('utf-8'), key[1]
+    if type(key) is int:
+        return NUMERAL, str(key).encode('utf-8'), 0
+    return ATOM, key.encode('utf-8'), 0
+
+def compile_program(program, stamp=(0, 0)):
+    """Return the compiled form of a tree.Program as bytes. stamp is the
+    (size, mtime in ns) of its source file"""
+    writer = _Writer()
+    clauses = []
+    # (name, arity) -> numbers of its clauses, in program order
+    procedures = {}
+    # clause number -> key of its first argument
+    keys = []
+    for number, clause in enumerate(program.clauses):
+        start = len(writer.cells)
+        writer.predicate(clause.head)
+        for goal in clause.body:
+            writer.predicate(goal)
+        clauses.append((start, 1 + len(clause.body), clause.line, clause.offset or 0))
+        head = clause.head
+        procedures.setdefault((head.functor.name.encode('utf-8'), len(head.args)), []).append(number)
+        keys.append(writer.key(head.args[0]) if head.args else None)
+    query_start = len(writer.cells)
+    for goal in program.query.body:
+        writer.predicate(goal)
+    predicates = []
+    key_rows = []
+    order = []
+    keyed = []
+    for name, arity in sorted(procedures):
+        numbers = procedures[(name, arity)]
+        # key -> numbers of the clauses with it
+        groups = {}
+        variables = []
+        for number in numbers:
+            if keys[number] is None:
+                variables.append(number)
+            else:
+                groups.setdefault(keys[number], []).append(number)
+        predicates.append((writer.symbol(ATOM, name.decode('utf-8')), arity, len(order), len(numbers),
+                           len(key_rows), len(groups), len(variables)))
+        for key in sorted(groups):
+            key_rows.append((key[3], key[2], len(keyed), len(groups[key])))
+            keyed += groups[key]
+        keyed += variables
+        order += numbers
+    header = _HEADER.pack(MAGIC, VERSION, bytes.fromhex(cache.parser_version()), stamp[0], stamp[1],
+                          len(writer.symbols), len(clauses), len(writer.cells), len(writer.strings),
+                          len(predicates), len(key_rows), query_start, len(program.query.body),
+                          program.query.line)
+    out = bytearray(header)
+    for row in writer.symbols:
+        out += _SYMBOL.pack(*row)
+    for row in clauses:
+        out += _CLAUSE.pack(*row)
+    for row in predicates:
+        out += _PREDICATE.pack(*row)
+    for row in key_rows:
+        out += _KEY.pack(*row)
+    out += struct.pack('<' + str(len(order)) + 'I', *order)
+    out += struct.pack('<' + str(len(keyed)) + 'I', *keyed)
+    out += struct.pack('<' + str(len(writer.cells)) + 'I', *writer.cells)
+    out += writer.strings
+    return bytes(out)
+
+def compile_file(path, out_path=None):
+    """Parse the program file at path and write its compiled form to
+    out_path (path + '.plc' by default). Return the list of errors, empty
+    if the file was written"""
+    stamp = _source_stamp(path)
+    with open(path, 'r') as f:
+        contents = f.read()
+    errors, program = CursorParser(contents).parse(tree=True)
+    if errors:
+        return errors
+    if out_path is None:
+        out_path = path + SUFFIX
+    # written under another name and renamed, so that a loader never maps
+    # half a file
+    temp_path = out_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(compile_program(program, stamp))
+    os.replace(temp_path, out_path)
+    return []
+
+class _Clauses():
+    """The clauses of a CompiledProgram, built when they are first used"""
+
+    def __init__(self, program):
+        self.program = program
+        self.built = [None] * program.clause_count
+
+    def __len__(self):
+        return len(self.built)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        clause = self.built[i]
+        if clause is None:
+            clause = self.built[i] = self.program.clause(i if i >= 0 else i + len(self))
+        return clause
+
+    def __iter__(self):
+        for i in range(len(self.built)):
+            yield self[i]
+
+class CompiledProgram():
+    """A compiled program file, memory-mapped; has the clauses, query and
+    symbols of a tree.Program.
+    Usage: program = CompiledProgram(path, source_path)"""
+
+    def __init__(self, path, source_path=None):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size:
+                raise StaleProgram(path + ' is not a compiled program')
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = _HEADER.unpack_from(self.map)
+        magic, version, parser_version, size, mtime = fields[:5]
+        if magic != MAGIC or version != VERSION:
+            raise StaleProgram(path + ' is not a compiled program of version ' + str(VERSION))
+        if parser_version.hex() != cache.parser_version():
+            raise StaleProgram(path + ' was compiled by another parser or grammar')
+        if source_path is not None and _source_stamp(source_path) != (size, mtime):
+            raise StaleProgram(path + ' is older than ' + source_path)
+        symbol_count, self.clause_count, cell_count, _, self.predicate_count, key_count, self.query_start, \
+            self.query_goals, self.query_line = fields[5:]
+        self.symbols_at = _HEADER.size
+        self.clauses_at = self.symbols_at + symbol_count * _SYMBOL.size
+        self.predicates_at = self.clauses_at + self.clause_count * _CLAUSE.size
+        self.keys_at = self.predicates_at + self.predicate_count * _PREDICATE.size
+        self.order_at = self.keys_at + key_count * _KEY.size
+        self.keyed_at = self.order_at + self.clause_count * 4
+        self.cells_at = self.keyed_at + self.clause_count * 4
+        self.strings_at = self.cells_at + cell_count * 4
+        self.order = self.words(self.order_at, self.keyed_at)
+        self.keyed = self.words(self.keyed_at, self.cells_at)
+        self.cells = self.words(self.cells_at, self.strings_at)
+        self.nodes = [None] * symbol_count
+        self.symbols = SymbolTable()
+        self.clauses = _Clauses(self)
+        self._query = None
+
+    def words(self, start, end):
+        """Return the 32-bit words of the file from offset start to end,
+            as a view of the map where that is possible"""
+        if sys.byteorder == 'little' and array.array('I').itemsize == 4:
+            return memoryview(self.map)[start:end].cast('I')
+        words = array.array('I', self.map[start:end])
+        if sys.byteorder != 'little':
+            words.byteswap()
+        return words
+
+    def close(self):
+        for words in (self.order, self.keyed, self.cells):
+            if isinstance(words, memoryview):
+                words.release()
+        self.map.close()
+
+    @property
+    def query(self):
+        if self._query is None:
+            self._query = Query(tuple(self.goals(self.query_start, self.query_goals)), self.query_line)
+        return self._query
+
+    def text(self, number):
+        """Return the text of a symbol as UTF-8 bytes"""
+        kind, at, length = _SYMBOL.unpack_from(self.map, self.symbols_at + number * _SYMBOL.size)
+        start = self.strings_at + at
+        return self.map[start:start+length]
+
+    def search(self, row, at, count, target, row_key):
+        """Binary search the count rows of the struct row at offset at,
+            sorted by row_key(fields), for target; return the fields of the
+            row whose row_key is target, or None"""
+        low = 0
+        high = count
+        while low < high:
+            middle = (low + high) // 2
+            fields = row.unpack_from(self.map, at + middle * row.size)
+            found = row_key(fields)
+            if found < target:
+                low = middle + 1
+            elif found > target:
+                high = middle
+            else:
+                return fields
+        return None
+
+    def procedure(self, name, arity):
+        """Return the CompiledProcedure of the clauses whose head is
+        name/arity, or None if there are none"""
+        fields = self.search(_PREDICATE, self.predicates_at, self.predicate_count, (name.encode('utf-8'), arity),
+                             lambda fields: (self.text(fields[0]), fields[1]))
+        return None if fields is None else CompiledProcedure(self, fields)
+
+    def node(self, number):
+        """Return the leaf node of a symbol, shared through self.symbols"""
+        node = self.nodes[number]
+        if node is None:
+            kind, at, length = _SYMBOL.unpack_from(self.map, self.symbols_at + number * _SYMBOL.size)
+            start = self.strings_at + at
+            text = str(self.map[start:start+length], 'utf-8')
+            if kind == VARIABLE:
+                node = self.symbols.variable(text)
+            elif kind == NUMERAL:
+                node = self.symbols.numeral(text)
+            else:
+                node = self.symbols.atom(text)
+            self.nodes[number] = node
+        return node
+
+    def clause(self, i):
+        """Build clause i"""
+        if not 0 <= i < self.clause_count:
+            raise IndexError('clause index out of range')
+        start, goals, line, offset = _CLAUSE.unpack_from(self.map, self.clauses_at + i * _CLAUSE.size)
+        predicates = self.goals(start, goals)
+        return Clause(predicates[0], tuple(predicates[1:]), line, offset)
+
+    def goals(self, start, count):
+        """Build count predicates from the cells at start"""
+        cells = self.cells
+        at = start
+        predicates = []
+        for _ in range(count):
+            functor = cells[at]
+            arity = cells[at+1]
+            at += 2
+            args = []
+            for _ in range(arity):
+                term, at = self.term(at)
+                args.append(term)
+            predicates.append(Predicate(self.node(functor >> 2), tuple(args)))
+        return predicates
+
+    def term(self, at):
+        """Build the term whose cells start at cell at; return it and the
+            cell after it. Nested structures are kept on a stack instead of
+            recursing"""
+        cells = self.cells
+        nodes = self.nodes
+        # (functor, arity, args built so far) of the open structures
+        stack = []
+        while True:
+            cell = cells[at]
+            at += 1
+            if cell & 3 == STRUCTURE:
+                stack.append((self.node(cell >> 2), cells[at], []))
+                at += 1
+                continue
+            term = nodes[cell >> 2] or self.node(cell >> 2)
+            while stack:
+                functor, arity, args = stack[-1]
+                args.append(term)
+                if len(args) < arity:
+                    break
+                stack.pop()
+                term = Structure(functor, tuple(args))
+            else:
+                return term, at
+
+class CompiledProcedure():
+    """The clauses of one name/arity of a CompiledProgram, as clause numbers
+    (indexes into program.clauses) in program order, with their
+    first-argument index. A key is an atom's name, a numeral's int value or
+    (name, arity) of a structure"""
+
+    def __init__(self, program, fields):
+        self.program = program
+        _, _, self.first, self.count, self.keys_start, self.key_count, self.variable_count = fields
+
+    def numbers(self):
+        """Return the numbers of all the clauses"""
+        return self.program.order[self.first:self.first+self.count].tolist()
+
+    def variables(self):
+        """Return the numbers of the clauses whose first argument is a
+        variable, or that have no arguments"""
+        end = self.first + self.count
+        return self.program.keyed[end-self.variable_count:end].tolist()
+
+    def keyed(self, key):
+        """Return the numbers of the clauses whose first argument has key,
+        or None if there are none"""
+        program = self.program
+        tag, text, arity = _key_of(key)
+        fields = program.search(_KEY, program.keys_at + self.keys_start * _KEY.size, self.key_count,
+                                (tag, text, arity),
+                                lambda fields: (fields[0] & 3, program.text(fields[0] >> 2), fields[1]))
+        if fields is None:
+            return None
+        return program.keyed[fields[2]:fields[2]+fields[3]].tolist()
+
+def load_program(path, compiled_path=None):
+    """Return (errors, program) for the program file at path like
+    CursorParser(contents).parse(tree=True), from its compiled file
+    (path + '.plc' by default) when that is up to date"""
+    if compiled_path is None:
+        compiled_path = path + SUFFIX
+    try:
+        return [], CompiledProgram(compiled_path, path)
+    except (FileNotFoundError, StaleProgram):
+        pass
+    with open(path, 'r') as f:
+        contents = f.read()
+    return CursorParser(contents).parse(tree=True)
+
+def main(argv=None) -> int:
+    argparser = argparse.ArgumentParser(description="Compile valid programs for loading without parsing")
+    argparser.add_argument('programs', nargs='+', metavar='FILE', help='program files; each is written to FILE'
+                           + SUFFIX)
+    args = argparser.parse_args(argv)
+    status = 0
+    for path in args.programs:
+        errors = compile_file(path)
+        if errors:
+            print(path + ': not compiled, the program has errors:', file=sys.stderr)
+            for error in errors:
+                print('    ' + error, file=sys.stderr)
+            status = 1
+    return status
+
+if __name__=="__main__": exit(main())
@@ -0,0 +1,129 @@
+# grammar.py
+# Prediction tables computed from grammar.txt and tokens.txt
+"""LL(1) prediction tables for the parser.
+
+grammar.txt is read as BNF and tokens.txt as the list of token classes;
+the token classes (like <lowercase-char>) are terminals, and each terminal
+is mapped to the kind of the lexer token that starts with it. From the
+FIRST sets of the alternatives, a table says for each kind of token which
+routine to call. Alternatives that start with the same symbol are left
+factored: the table gives the routine for the common symbol and the kind
+of token that, after it, selects the longer alternative. For instance
+<term> -> <atom> | <structure> with <structure> -> <atom> ( <term-list> )
+gives ("atom", LPAREN) for ATOM tokens.
+
+The tables are computed in memory when parser.py is imported, which takes
+well under a millisecond, so nothing is written to disk."""
+import os
+
+import lexer
+
+GRAMMAR_FILE = 'grammar.txt'
+TOKENS_FILE = 'tokens.txt'
+
+# nonterminals the parser dispatches on
+PREDICTED = ('predicate', 'term')
+
+# the lexer token that starts with each terminal
+TERMINAL_KINDS = {
+    'lowercase-char': lexer.ATOM,
+    'uppercase-char': lexer.VARIABLE,
+    'digit': lexer.NUMERAL,
+    'special': lexer.SPECIAL,
+    "'": lexer.STRING,
+    '(': lexer.LPAREN,
+    ')': lexer.RPAREN,
+    ',': lexer.COMMA,
+    '.': lexer.PERIOD,
+    '?-': lexer.QUERY,
+    ':-': lexer.NECK,
+}
+
+class GrammarError(Exception):
+    """The grammar cannot be parsed with one token of lookahead"""
+
+def read_grammar(text, token_classes):
+    """Return {nonterminal: [alternative, ...]} for the productions in text,
+    where an alternative is a tuple of symbols and nonterminals are written
+    without their angle brackets. The productions of token classes are
+    skipped; the lexer reads those"""
+    productions = {}
+    for line in text.splitlines():
+        if '->' not in line:
+            continue
+        lhs, rhs = line.split('->', 1)
+        name = lhs.strip().strip('<>')
+        if name in token_classes:
+            continue
+        productions[name] = [tuple(symbol.strip('<>') if symbol.startswith('<') else symbol
+                                   for symbol in alternative.split())
+                             for alternative in rhs.split('|')]
+    return productions
+
+def first_sets(productions):
+    """Return {nonterminal: set of token kinds} by iterating to a fixed point"""
+    first = {name: set() for name in productions}
+    changed = True
+    while changed:
+        changed = False
+        for name, alternatives in productions.items():
+            for alternative in alternatives:
+                kinds = first_of(alternative, first)
+                if not kinds <= first[name]:
+                    first[name] |= kinds
+                    changed = True
+    return first
+
+def first_of(symbols, first):
+    """Return the token kinds a sequence of symbols can start with (no
+    production of this grammar derives the empty string)"""
+    symbol = symbols[0]
+    if symbol in first:
+        return first[symbol]
+    if symbol not in TERMINAL_KINDS:
+        raise GrammarError('no token for terminal ' + repr(symbol))
+    return {TERMINAL_KINDS[symbol]}
+
+def expand(alternative, productions):
+    """Replace the first symbol of alternative by its production while it is
+    a nonterminal with only one production"""
+    while alternative[0] in productions and len(productions[alternative[0]]) == 1:
+        alternative = productions[alternative[0]][0] + alternative[1:]
+    return alternative
+
+def prediction_table(name, productions, first):
+    """Return {kind: (routine, continuation)} for the nonterminal name.
+    routine is the method that reads the first symbol of the predicted
+    alternative. continuation is None, or the kind of token that selects
+    the longer of two alternatives that start with that symbol"""
+    table = {}
+    alternatives = [expand(alternative, productions) for alternative in productions[name]]
+    for kind in sorted(set().union(*(first_of(a, first) for a in alternatives))):
+        predicted = sorted({a for a in alternatives if kind in first_of(a, first)}, key=len)
+        routine = predicted[0][0].replace('-', '_')
+        if len(predicted) == 1 and len(predicted[0]) == 1:
+            table[kind] = (routine, None)
+        elif (len(predicted) == 2 and len(predicted[0]) == 1
+              and predicted[1][0] == predicted[0][0] and predicted[1][1] in TERMINAL_KINDS):
+            table[kind] = (routine, TERMINAL_KINDS[predicted[1][1]])
+        else:
+            raise GrammarError('<' + name + '> needs more than one token of lookahead on ' + lexer.TOKEN_NAMES[kind])
+    return table
+
+def build_tables(grammar_text, tokens_text):
+    """Return {nonterminal: prediction table} for the PREDICTED nonterminals"""
+    token_classes = {line.strip() for line in tokens_text.splitlines() if line.strip()}
+    productions = read_grammar(grammar_text, token_classes)
+    first = first_sets(productions)
+    return {name: prediction_table(name, productions, first) for name in PREDICTED}
+
+def load_tables(directory=None):
+    """Return the prediction tables for grammar.txt and tokens.txt in
+    directory (the directory of this module by default)"""
+    if directory is None:
+        directory = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(directory, GRAMMAR_FILE), 'r') as f:
+        grammar_text = f.read()
+    with open(os.path.join(directory, TOKENS_FILE), 'r') as f:
+        tokens_text = f.read()
+    return build_tables(grammar_text, tokens_text)
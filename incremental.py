@@ -0,0 +1,284 @@
+# incremental.py
+# Re-validate a program after an edit without parsing all of it again
+"""Incremental re-parsing of edited programs.
+
+A Document keeps what parsing each clause of a program gave: where the
+clause starts and ends, the line it starts on and its errors, with the
+line numbers in the errors kept relative to that line. After an edit only
+the clauses from the edit on are parsed again, and only until parsing
+reaches the start of a clause after the edit that had been parsed before:
+from there on the old results are reused, moved by the number of
+characters and lines the edit added.
+
+A clause's errors depend on its own text and, when it has single quotes in
+it, on the text up to where the characters after each quote stop (that is
+what decides whether the quote starts a <string>), so each clause also
+records how far into the program parsing it looked. The <query> and
+whatever follows it, or the clause that ends parsing early, are kept as the
+tail of the document and are parsed again after any edit that reaches them.
+
+Clauses are kept in blocks with offsets and lines relative to their block,
+so that moving the clauses after an edit only has to move the blocks."""
+import bisect
+import re
+
+import lexer
+from parser import Parser, CursorParser
+
+# clauses per block
+BLOCK_SIZE = 256
+
+_NONBLANK_RE = re.compile(r'\S')
+_LINE_RE = re.compile(r'Line (\d+): ')
+
+def _relative(errors, line_num):
+    """Return errors as (line - line_num, rest of the message) pairs, with
+    None in place of the line for messages that do not start with one"""
+    result = []
+    for error in errors:
+        m = _LINE_RE.match(error)
+        if m is None:
+            result.append((None, error))
+        else:
+            result.append((int(m.group(1)) - line_num, error[m.end():]))
+    return tuple(result)
+
+def _render(errors, line_num):
+    """Undo _relative()"""
+    return [text if line is None else "Line "+str(line + line_num)+': '+text
+            for line, text in errors]
+
+def _horizon(text, start, end):
+    """Return the offset up to which parsing the clause text[start:end] may
+    have looked at the program"""
+    horizon = end
+    q = text.find("'", start, end)
+    while q >= 0:
+        # a quote starts a <string> depending on the character after the
+        # <character>s that follow it
+        horizon = max(horizon, lexer.CHARACTERS_RE.match(text, q + 1).end() + 1)
+        q = text.find("'", q + 1, end)
+    return min(horizon, len(text))
+
+class _Clause():
+    """Result of parsing one clause. start, end and horizon are relative to
+    the start of the block and line to the line of the block"""
+    __slots__ = ('start', 'end', 'horizon', 'line', 'errors')
+
+    def __init__(self, start, end, horizon, line, errors):
+        self.start = start
+        self.end = end
+        self.horizon = horizon
+        self.line = line
+        self.errors = errors
+
+class _Block():
+    """Up to BLOCK_SIZE clauses, starting at offset start on line line.
+    horizon is the largest horizon of its clauses"""
+    __slots__ = ('start', 'line', 'horizon', 'clauses', 'faulty', 'rendered', 'rendered_line')
+
+    def __init__(self, start, line, clauses):
+        self.start = start
+        self.line = line
+        self.horizon = max(clause.horizon for clause in clauses)
+        self.clauses = clauses
+        # the clauses with errors, so that blocks without any are skipped
+        self.faulty = [clause for clause in clauses if clause.errors]
+        # their errors as of when the block was on line rendered_line
+        self.rendered = []
+        self.rendered_line = None if self.faulty else line
+
+    def errors(self):
+        """Return the errors of the clauses, rendering them again only if
+        the block has moved to another line since the last time"""
+        if self.rendered_line != self.line:
+            self.rendered = []
+            for clause in self.faulty:
+                self.rendered += _render(clause.errors, self.line + clause.line)
+            self.rendered_line = self.line
+        return self.rendered
+
+class _Tail():
+    """Result of parsing the rest of the program from offset start, on line
+    line, once the clause list is over"""
+    __slots__ = ('start', 'line', 'errors')
+
+    def __init__(self, start, line, errors):
+        self.start = start
+        self.line = line
+        self.errors = errors
+
+class Document():
+    """A program that is kept parsed while it is edited.
+    Usage:
+        doc = Document(text)
+        doc.errors()    # the same list as Parser(text).parse()
+        doc.edit(offset, deleted, inserted)
+        doc.errors()    # the same list as Parser(doc.text).parse()"""
+
+    def __init__(self, text):
+        self.text = text
+        self.blocks = []
+        records, self.tail, found = self.walk(0, 1, True, lambda pos: None)
+        self.blocks = self.make_blocks(records)
+
+    def errors(self):
+        """Return the list of errors in the program"""
+        errors = []
+        for block in self.blocks:
+            if block.faulty:
+                errors += block.errors()
+        errors += _render(self.tail.errors, self.tail.line)
+        return errors
+
+    def edit(self, offset, deleted, inserted):
+        """Replace the deleted characters at offset with the string inserted
+            and parse the clauses the edit affects.
+            Return the number of clauses that were parsed again"""
+        old_text = self.text
+        if offset < 0 or deleted < 0 or offset + deleted > len(old_text):
+            raise ValueError("edit outside of the program")
+        delta = len(inserted) - deleted
+        line_delta = inserted.count('\n') - old_text.count('\n', offset, offset + deleted)
+        self.text = old_text[:offset] + inserted + old_text[offset + deleted:]
+        blocks = self.blocks
+        # the first clause that looked at the edited text: clause i of block b
+        b = 0
+        while b < len(blocks) and blocks[b].start + blocks[b].horizon <= offset:
+            b += 1
+        i = 0
+        if b < len(blocks):
+            block = blocks[b]
+            while block.start + block.clauses[i].horizon <= offset:
+                i += 1
+        # rebuild from the block before when clause i is the first of its
+        # block, so that clauses added at the end do not make small blocks
+        first_block = b if i > 0 or b == 0 else b - 1
+        kept = []
+        for block in blocks[first_block:b]:
+            kept += self.absolute(block, block.clauses, 0, 0)
+        if b < len(blocks):
+            kept += self.absolute(blocks[b], blocks[b].clauses[:i], 0, 0)
+        # parse again from the end of the clause before, or from the start
+        pos = 0
+        line_num = 1
+        if kept:
+            start, pos, horizon, line, errors = kept[-1]
+            line_num = line + self.text.count('\n', start, pos)
+        # old clause start offsets and the blocks they are in
+        block_starts = [block.start for block in blocks]
+        limit = offset + len(inserted)
+
+        def resync(pos):
+            """Return where the results parsed before can be taken up again
+            at offset pos of the new text: (block, clause), "tail" or None"""
+            if pos < limit:
+                return None
+            old = pos - delta
+            if old == self.tail.start:
+                return 'tail'
+            j = bisect.bisect_right(block_starts, old) - 1
+            if j < 0:
+                return None
+            clauses = blocks[j].clauses
+            k = bisect.bisect_left(clauses, old - blocks[j].start, key=lambda clause: clause.start)
+            if k < len(clauses) and clauses[k].start == old - blocks[j].start:
+                return j, k
+            return None
+
+        records, tail, found = self.walk(pos, line_num, not kept, resync)
+        reparsed = len(records)
+        after = []
+        if found is None:
+            self.tail = tail
+        elif found == 'tail':
+            self.tail.start += delta
+            self.tail.line += line_delta
+        else:
+            j, k = found
+            records += self.absolute(blocks[j], blocks[j].clauses[k:], delta, line_delta)
+            after = blocks[j+1:]
+            for block in after:
+                block.start += delta
+                block.line += line_delta
+            self.tail.start += delta
+            self.tail.line += line_delta
+        self.blocks = blocks[:first_block] + self.make_blocks(kept + records) + after
+        return reparsed
+
+    @staticmethod
+    def absolute(block, clauses, delta, line_delta):
+        """Return clauses of block as (start, end, horizon, line, errors)
+        tuples with absolute offsets and lines, moved by delta characters
+        and line_delta lines"""
+        base = block.start + delta
+        line = block.line + line_delta
+        return [(base + clause.start, base + clause.end, base + clause.horizon,
+                 line + clause.line, clause.errors) for clause in clauses]
+
+    @staticmethod
+    def make_blocks(records):
+        """Group (start, end, horizon, line, errors) tuples into blocks of
+        about the same size"""
+        count = -(-len(records) // BLOCK_SIZE)
+        blocks = []
+        for n in range(count):
+            group = records[n * len(records) // count:(n + 1) * len(records) // count]
+            start = group[0][0]
+            line = group[0][3]
+            blocks.append(_Block(start, line, [
+                _Clause(s - start, e - start, h - start, l - line, errors)
+                for s, e, h, l, errors in group]))
+        return blocks
+
+    def walk(self, pos, line_num, first, resync):
+        """Parse clauses from offset pos, on line line_num, as
+            Parser.program() would once it has got there. first is True if
+            no clause comes before pos. Stop when resync(pos) gives a place
+            where results parsed before can be taken up again.
+            Return (records, tail, found) where records are the parsed
+            clauses as (start, end, horizon, line, errors) tuples, and either
+            tail is the end of the program or found is what resync() gave"""
+        text = self.text
+        records = []
+        while True:
+            m = _NONBLANK_RE.search(text, pos)
+            if m is None:
+                line_num += text.count('\n', pos)
+                if first and not records:
+                    return records, _Tail(len(text), line_num, _relative(["Error: program was the empty string"], line_num)), None
+                return records, _Tail(len(text), line_num, _relative(["Line "+str(line_num)+': reached EOF while parsing clause list'], line_num)), None
+            line_num += text.count('\n', pos, m.start())
+            pos = m.start()
+            found = resync(pos)
+            if found is not None:
+                return records, None, found
+            if text.startswith('?', pos):
+                return records, self.query(pos, line_num), None
+            # most clauses end at the next ".", so only lex up to there
+            period = text.find('.', pos)
+            window = (period if period >= 0 else len(text)) - pos + 16
+            p, err = CursorParser.run_at(text, pos, line_num, CursorParser.clause, window)
+            if err is not None:
+                return records, _Tail(pos, line_num, _relative(p.error_list + [str(err)], line_num)), None
+            end = pos + p.pos
+            records.append((pos, end, _horizon(text, pos, end), line_num, _relative(p.error_list, line_num)))
+            pos, line_num = end, p.line_num
+
+    def query(self, pos, line_num):
+        """Parse the <query> at offset pos and whatever follows it.
+        Return the tail of the document"""
+        p = CursorParser(self.text[pos:])
+        p.line_num = line_num
+        try:
+            p.query()
+        except (Parser.ParserError, StopIteration) as err:
+            return _Tail(pos, line_num, _relative(p.error_list + [str(err)], line_num))
+        errors = p.error_list
+        try:
+            p.skip_blanks()
+        except StopIteration:
+            # This is good, the file is done
+            return _Tail(pos, line_num, _relative(errors, line_num))
+        errors.append('After parsing the program, the following remained in the file:\n'+p.contents[p.pos:])
+        return _Tail(pos, line_num, _relative(errors, line_num))
@@ -0,0 +1,303 @@
+# index.py
+# Predicate index of a parsed program, stored in a binary sidecar file
+"""Index the clauses of a valid program by predicate and first argument.
+
+build_index() takes the tree.Program of a valid program and gives the
+index as bytes; index_file() parses a program file and writes its index
+next to it, to FILE.idx. PredicateIndex memory-maps an index file and
+answers lookups without reading the program again:
+    index = PredicateIndex('facts.txt.idx')
+    index.clauses('sells', 3)           # every sells/3 clause
+    index.clauses('sells', 3, 'west')   # those whose first argument can be west
+Each clause is given as (offset, line): the byte offset in the file of the
+clause's first character and the line it starts on, in program order.
+
+A first argument that is an atom (a str in a lookup) or a numeral (an int)
+is indexed. A lookup by first argument gives the clauses with that first
+argument and the clauses whose first argument is a variable, since those
+match any value; clauses with a structure there are left out.
+
+File layout, little-endian:
+    header      magic, version, SHA-256 of the program file and the counts
+                of the tables below
+    predicates  (name, name length, arity, first clause, clause count,
+                first key, key count, first variable posting, variable
+                posting count), sorted by name and arity
+    clauses     (offset, line), grouped by predicate in program order
+    keys        (kind, text, text length, first posting, posting count) of
+                each predicate's first arguments, sorted by kind and text
+    postings    clause numbers, ascending within each list
+    strings     predicate names and key texts, UTF-8
+Lookups are binary searches over the mapped tables."""
+import argparse
+import bisect
+import hashlib
+import heapq
+import mmap
+import os
+import struct
+import sys
+
+from parser import CursorParser
+from tree import Atom, Numeral, Variable
+
+MAGIC = b'PLIX'
+VERSION = 1
+SUFFIX = '.idx'
+
+KEY_ATOM = 0
+KEY_NUMERAL = 1
+
+_HEADER = struct.Struct('<4sI32sIIII')
+_PREDICATE = struct.Struct('<IIIIIIIII')
+_CLAUSE = struct.Struct('<QI')
+_KEY = struct.Struct('<BIIII')
+_POSTING = struct.Struct('<I')
+
+class IndexFileError(Exception):
+    """An index that cannot be built or read"""
+
+def _key(term):
+    """Return the (kind, text) index key of a first argument, None for a
+    variable and False for a term that is not indexed"""
+    if isinstance(term, Atom):
+        return KEY_ATOM, term.name.encode('utf-8')
+    if isinstance(term, Numeral):
+        return KEY_NUMERAL, str(term.value).encode('ascii')
+    if isinstance(term, Variable):
+        return None
+    return False
+
+def _byte_offsets(contents, offsets):
+    """Turn ascending character offsets into contents into byte offsets
+    into its UTF-8 encoding"""
+    if contents.isascii():
+        return offsets
+    result = []
+    prev = total = 0
+    for offset in offsets:
+        total += len(contents[prev:offset].encode('utf-8'))
+        prev = offset
+        result.append(total)
+    return result
+
+def build_index(program, contents='', digest=b'\0' * 32):
+    """Return the index of the tree.Program of a valid program as bytes.
+    contents is the program text, for byte offsets, and digest the
+    SHA-256 of the program file"""
+    offsets = _byte_offsets(contents, [clause.offset for clause in program.clauses])
+    # (name, arity) -> clause numbers in program order
+    groups = {}
+    for number, clause in enumerate(program.clauses):
+        head = clause.head
+        groups.setdefault((head.functor.name.encode('utf-8'), len(head.args)), []).append(number)
+
+    strings = bytearray()
+    predicates = []
+    clauses = []
+    keys = []
+    postings = []
+    for (name, arity), numbers in sorted(groups.items()):
+        name_at = len(strings)
+        strings += name
+        first_clause = len(clauses)
+        clauses += [(offsets[n], program.clauses[n].line) for n in numbers]
+        by_key = {}
+        variables = []
+        if arity > 0:
+            for i, n in enumerate(numbers):
+                key = _key(program.clauses[n].head.args[0])
+                if key is None:
+                    variables.append(first_clause + i)
+                elif key:
+                    by_key.setdefault(key, []).append(first_clause + i)
+        first_key = len(keys)
+        for (kind, text), entries in sorted(by_key.items()):
+            keys.append((kind, len(strings), len(text), len(postings), len(entries)))
+            strings += text
+            postings += entries
+        first_variable = len(postings)
+        postings += variables
+        predicates.append((name_at, len(name), arity, first_clause, len(numbers),
+                           first_key, len(keys) - first_key, first_variable, len(variables)))
+
+    out = bytearray(_HEADER.pack(MAGIC, VERSION, digest, len(predicates), len(clauses),
+                                 len(keys), len(postings)))
+    for row in predicates:
+        out += _PREDICATE.pack(*row)
+    for row in clauses:
+        out += _CLAUSE.pack(*row)
+    for row in keys:
+        out += _KEY.pack(*row)
+    out += struct.pack('<' + str(len(postings)) + 'I', *postings)
+    out += strings
+    return bytes(out)
+
+def file_digest(path):
+    """Return the SHA-256 of the file at path"""
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').digest()
+
+def index_file(path, index_path=None):
+    """Parse the program file at path and write its index to index_path
+    (path + '.idx' by default). Raise IndexFileError if the program has errors.
+    Return index_path"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    # line ends are kept as they are, so that offsets are offsets in the file
+    contents = data.decode('utf-8')
+    errors, program = CursorParser(contents).parse(tree=True)
+    if errors:
+        raise IndexFileError(path + ' is not a valid program: ' + errors[0])
+    if index_path is None:
+        index_path = path + SUFFIX
+    # written under another name and renamed, so that an interrupted build
+    # never leaves half an index behind
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(build_index(program, contents, hashlib.sha256(data).digest()))
+    os.replace(temp_path, index_path)
+    return index_path
+
+class PredicateIndex():
+    """Lookups in the index file at path, which is memory-mapped.
+    Usage: with PredicateIndex(path) as index: index.clauses(name, arity, first)"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size:
+                raise IndexFileError(path + ' is not an index file')
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.read_header(path)
+        except IndexFileError:
+            self.map.close()
+            raise
+
+    def read_header(self, path):
+        magic, version, self.digest, self.predicate_count, self.clause_count, key_count, posting_count \
+            = _HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise IndexFileError(path + ' is not an index file of version ' + str(VERSION))
+        self.predicates_at = _HEADER.size
+        self.clauses_at = self.predicates_at + self.predicate_count * _PREDICATE.size
+        self.keys_at = self.clauses_at + self.clause_count * _CLAUSE.size
+        self.postings_at = self.keys_at + key_count * _KEY.size
+        self.strings_at = self.postings_at + posting_count * _POSTING.size
+        if self.strings_at > len(self.map):
+            raise IndexFileError(path + ' is truncated')
+
+    def close(self):
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def is_current(self, path):
+        """Return whether the index is of the program file at path as it is now"""
+        return file_digest(path) == self.digest
+
+    def string(self, at, length):
+        start = self.strings_at + at
+        return self.map[start:start+length]
+
+    def predicate(self, i):
+        return _PREDICATE.unpack_from(self.map, self.predicates_at + i * _PREDICATE.size)
+
+    def predicates(self):
+        """Yield (name, arity, clause count) for each predicate, sorted"""
+        for i in range(self.predicate_count):
+            row = self.predicate(i)
+            yield self.string(row[0], row[1]).decode('utf-8'), row[2], row[4]
+
+    def find(self, name, arity):
+        """Return the table row of name/arity, or None"""
+        target = (name.encode('utf-8'), arity)
+        def sort_key(i):
+            row = self.predicate(i)
+            return self.string(row[0], row[1]), row[2]
+        i = bisect.bisect_left(range(self.predicate_count), target, key=sort_key)
+        if i < self.predicate_count and sort_key(i) == target:
+            return self.predicate(i)
+        return None
+
+    def clause(self, number):
+        return _CLAUSE.unpack_from(self.map, self.clauses_at + number * _CLAUSE.size)
+
+    def postings(self, start, count):
+        at = self.postings_at + start * _POSTING.size
+        return struct.unpack_from('<' + str(count) + 'I', self.map, at)
+
+    def clause_numbers(self, name, arity, first=None):
+        """Return the numbers of the clauses that clauses() gives"""
+        row = self.find(name, arity)
+        if row is None:
+            return []
+        first_clause, clause_count = row[3], row[4]
+        if first is None or arity == 0:
+            return range(first_clause, first_clause + clause_count)
+        if isinstance(first, bool) or not isinstance(first, (str, int)):
+            raise TypeError('first must be an atom name (str) or a numeral (int)')
+        if isinstance(first, str):
+            target = (KEY_ATOM, first.encode('utf-8'))
+        else:
+            target = (KEY_NUMERAL, str(first).encode('ascii'))
+        def sort_key(i):
+            kind, text_at, text_length = _KEY.unpack_from(self.map, self.keys_at + i * _KEY.size)[:3]
+            return kind, self.string(text_at, text_length)
+        first_key, key_count = row[5], row[6]
+        i = bisect.bisect_left(range(first_key, first_key + key_count), target, key=sort_key) + first_key
+        exact = ()
+        if i < first_key + key_count and sort_key(i) == target:
+            exact = self.postings(*_KEY.unpack_from(self.map, self.keys_at + i * _KEY.size)[3:])
+        variables = self.postings(row[7], row[8])
+        if not variables:
+            return list(exact)
+        return list(heapq.merge(exact, variables))
+
+    def clauses(self, name, arity, first=None):
+        """Return (offset, line) for the clauses of name/arity, in program
+        order; with first, only those whose first argument can be first"""
+        return [self.clause(n) for n in self.clause_numbers(name, arity, first)]
+
+def main(argv=None) -> int:
+    argparser = argparse.ArgumentParser(description="Index the clauses of programs by predicate")
+    argparser.add_argument('program', help='program file; its index is PROGRAM' + SUFFIX)
+    argparser.add_argument('predicate', nargs='?', metavar='NAME/ARITY',
+                           help='print the clauses of this predicate (the index is built if it is '
+                                'missing or out of date); without it, only build the index')
+    argparser.add_argument('first', nargs='?',
+                           help='only clauses whose first argument can be this atom or numeral')
+    args = argparser.parse_args(argv)
+    index_path = args.program + SUFFIX
+    try:
+        index = None
+        try:
+            index = PredicateIndex(index_path)
+            current = args.predicate is not None and index.is_current(args.program)
+        except (FileNotFoundError, IndexFileError):
+            current = False
+        if not current:
+            if index is not None:
+                index.close()
+            index_file(args.program, index_path)
+            index = PredicateIndex(index_path)
+    except IndexFileError as e:
+        print(e, file=sys.stderr)
+        return 1
+    with index:
+        if args.predicate is None:
+            print(index_path + ':', index.predicate_count, 'predicates,', index.clause_count, 'clauses')
+            return 0
+        name, _, arity = args.predicate.rpartition('/')
+        first = args.first
+        if first is not None and first.isdigit():
+            first = int(first)
+        for offset, line in index.clauses(name, int(arity), first):
+            print('Line', line, 'offset', offset)
+    return 0
+
+if __name__=="__main__": exit(main())
@@ -0,0 +1,204 @@
+# lexer.py
+# Tokenizer for the simplified prolog grammar
+"""Turn a program into a compact token stream.
+
+The token set is the one in tokens.txt, with runs already grouped:
+small atoms, variables, numerals and quoted strings are single tokens, and
+"?-" and ":-" are single tokens when their two characters are adjacent.
+Blank space is kept as tokens so that every character of the program
+belongs to exactly one token and a token's end is the next token's start."""
+import re
+from array import array
+from bisect import bisect_left
+
+# token kinds; the numbers are the group numbers in TOKEN_RE
+END = 0
+NEWLINE = 1
+BLANK = 2
+ATOM = 3
+VARIABLE = 4
+NUMERAL = 5
+STRING = 6
+QUERY = 7
+NECK = 8
+LPAREN = 9
+RPAREN = 10
+COMMA = 11
+PERIOD = 12
+COLON = 13
+QMARK = 14
+SPECIAL = 15
+UNTERMINATED = 16
+QUOTE = 17
+UNRECOGNIZED = 18
+
+TOKEN_NAMES = ('end', 'newline', 'blank', 'small-atom', 'variable', 'numeral',
+               'string', '?-', ':-', '(', ')', ',', '.', ':', '?', 'special',
+               'unterminated-string', "'", 'unrecognized')
+
+# tokens made of <special> characters
+SPECIAL_KINDS = frozenset((QUERY, NECK, PERIOD, COLON, QMARK, SPECIAL))
+BLANK_KINDS = frozenset((NEWLINE, BLANK))
+
+# <character> -> <alphanumeric> | <special>
+CHARACTER_CLASS = r"[a-zA-Z0-9_+\-*/\\^~:.? #$&]"
+ALPHANUMERIC_CLASS = r"[a-zA-Z0-9_]"
+
+# blank space other than newlines; str.isspace() and the str pattern
+# [^\S\n] agree on the ASCII characters, which include \x1c-\x1f
+BLANK_CLASS = r"[^\S\n]"
+ASCII_BLANK_CLASS = r"[\t\x0b\x0c\r\x1c-\x1f ]"
+
+def token_pattern(blank_class):
+    """Return the pattern of TOKEN_RE with blank_class as the class of
+    blank characters"""
+    return '|'.join((
+        r"(\n)",                                # NEWLINE
+        "(" + blank_class + "+)",               # BLANK
+        r"([a-z]" + ALPHANUMERIC_CLASS + "*)",  # ATOM
+        r"([A-Z_]" + ALPHANUMERIC_CLASS + "*)", # VARIABLE
+        r"([0-9]+)",                            # NUMERAL
+        r"('" + CHARACTER_CLASS + "+')",        # STRING
+        r"(\?-)",                               # QUERY
+        r"(:-)",                                # NECK
+        r"(\()",                                # LPAREN
+        r"(\))",                                # RPAREN
+        r"(,)",                                 # COMMA
+        r"(\.)",                                # PERIOD
+        r"(:)",                                 # COLON
+        r"(\?)",                                # QMARK
+        r"([+\-*/\\^~#$&])",                    # SPECIAL
+        r"('(?=" + CHARACTER_CLASS + r"*\Z))",  # UNTERMINATED
+        r"(')",                                 # QUOTE
+        r"(.)",                                 # UNRECOGNIZED
+    ))
+
+TOKEN_RE = re.compile(token_pattern(BLANK_CLASS), re.DOTALL)
+# the same tokens in ASCII bytes; see AsciiText
+BYTES_TOKEN_RE = re.compile(token_pattern(ASCII_BLANK_CLASS).encode('ascii'), re.DOTALL)
+
+# the characters a <string> is made of, used to find where a bad string stops
+CHARACTERS_RE = re.compile(CHARACTER_CLASS + '*')
+BYTES_CHARACTERS_RE = re.compile(CHARACTER_CLASS.encode('ascii') + b'*')
+
+NEWLINE_RE = re.compile('\n')
+BYTES_NEWLINE_RE = re.compile(b'\n')
+
+# a byte that is not ASCII
+NON_ASCII_RE = re.compile(b'[\x80-\xff]')
+
+class AsciiText():
+    """Read-only view of a program held as ASCII bytes (bytes, a memoryview
+    or an mmap) that can stand in for the program's str: indexing gives a
+    one character str and slicing decodes just the slice, so the program is
+    never copied as a whole. TokenStream lexes the bytes directly."""
+    __slots__ = ('buffer',)
+
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return str(self.buffer[index], 'ascii')
+        return chr(self.buffer[index])
+
+    def count(self, sub, start=None, end=None):
+        """Like str.count() for a single character sub"""
+        return self.buffer[start:end].tobytes().count(sub.encode('ascii'))
+
+class TokenStream():
+    """Token stream for a program.
+    Attributes:
+        contents -- the program
+        kinds -- array of token kinds, ending with END
+        starts -- array of token start offsets; starts[i+1] is where token i
+        ends, and the END token starts at len(contents)
+
+    Lexing from a given offset always gives the same token, so the stream
+    can also hand out tokens that start in the middle of one of its own
+    tokens (which can happen after error recovery skips raw characters);
+    those are lexed on demand by lex()."""
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.length = len(contents)
+        if isinstance(contents, AsciiText):
+            self.buffer = contents.buffer
+            self.token_re = BYTES_TOKEN_RE
+            self.characters_re = BYTES_CHARACTERS_RE
+            self.newline_re = BYTES_NEWLINE_RE
+        else:
+            self.buffer = contents
+            self.token_re = TOKEN_RE
+            self.characters_re = CHARACTERS_RE
+            self.newline_re = NEWLINE_RE
+        # offsets of the newlines, made by newlines() the first time a line
+        # number is needed
+        self.newline_offsets = None
+        typecode = 'I' if self.length < 2**32 else 'Q'
+        self.kinds = array('B')
+        self.starts = array(typecode)
+        add_kind = self.kinds.append
+        add_start = self.starts.append
+        for m in self.token_re.finditer(self.buffer):
+            add_kind(m.lastindex)
+            add_start(m.start())
+        self.kinds.append(END)
+        self.starts.append(self.length)
+
+    def __len__(self):
+        """Number of tokens, not counting the END token"""
+        return len(self.kinds) - 1
+
+    def index_of(self, pos):
+        """Return the index of the token starting at offset pos, or -1 if
+        pos is inside a token"""
+        i = bisect_left(self.starts, pos)
+        if i < len(self.starts) and self.starts[i] == pos:
+            return i
+        return -1
+
+    def lex(self, pos):
+        """Lex the single token starting at offset pos.
+        Return (kind, end)"""
+        if pos >= self.length:
+            return END, self.length
+        m = self.token_re.match(self.buffer, pos)
+        return m.lastindex, m.end()
+
+    def newlines(self):
+        """Return the array of the offsets of the newlines in the program"""
+        if self.newline_offsets is None:
+            self.newline_offsets = array(self.starts.typecode,
+                                         [m.start() for m in self.newline_re.finditer(self.buffer)])
+        return self.newline_offsets
+
+    def lines_before(self, pos):
+        """Return the number of newlines before offset pos"""
+        if pos == 0:
+            return 0
+        return bisect_left(self.newlines(), pos)
+
+    def line_start(self, pos):
+        """Return the offset where the line that offset pos is on starts"""
+        newlines = self.newlines()
+        i = bisect_left(newlines, pos)
+        return newlines[i-1] + 1 if i else 0
+
+    def characters_end(self, pos):
+        """Return where the run of <character>s starting at offset pos ends"""
+        return self.characters_re.match(self.buffer, pos).end()
+
+    def text(self, i):
+        """Return the text of token i"""
+        return self.contents[self.starts[i]:self.starts[i+1]]
+
+    def __iter__(self):
+        """Yield (kind, start, end) for every token, not including END"""
+        kinds = self.kinds
+        starts = self.starts
+        for i in range(len(kinds) - 1):
+            yield kinds[i], starts[i], starts[i+1]
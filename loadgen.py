@@ -0,0 +1,147 @@
+# loadgen.py
+# Load generator for the validation server
+"""Benchmark server.py with many small validation requests.
+
+Programs are made with bench.generate() (a few clauses each, some with
+errors) and sent over several connections at once, each keeping a number
+of requests in flight. The report gives the requests per second and the
+latency percentiles; --check also compares every response with
+CursorParser(program).parse() in this process.
+
+    python3 loadgen.py --spawn                  # start a server and load it
+    python3 loadgen.py --unix /tmp/parser.sock  # load a running server"""
+import argparse
+import asyncio
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+import bench
+from parser import CursorParser
+
+_LENGTH = struct.Struct('>I')
+
+def programs(count, clauses, error_rate, seed=0):
+    """Return count distinct generated programs"""
+    return [bench.generate(seed + i, clauses=clauses, error_rate=error_rate) for i in range(count)]
+
+async def connect(args):
+    if args.unix:
+        return await asyncio.open_unix_connection(args.unix)
+    return await asyncio.open_connection(args.host, args.port)
+
+async def run_connection(args, pool, count, offset, latencies, responses):
+    """Send count requests, cycling through pool from offset, keeping
+    args.depth of them in flight"""
+    reader, writer = await connect(args)
+    sent = {}
+    window = asyncio.Semaphore(args.depth)
+
+    async def send():
+        for i in range(count):
+            await window.acquire()
+            program = pool[(offset + i) % len(pool)]
+            if args.framing == 'json':
+                writer.write(json.dumps({'id': i, 'program': program}).encode('utf-8') + b'\n')
+            else:
+                data = program.encode('utf-8')
+                writer.write(_LENGTH.pack(len(data)) + data)
+            sent[i] = time.perf_counter()
+            await writer.drain()
+
+    sender = asyncio.create_task(send())
+    for i in range(count):
+        if args.framing == 'json':
+            response = json.loads(await reader.readline())
+        else:
+            length = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))[0]
+            response = json.loads(await reader.readexactly(length))
+        # responses come back in order
+        latencies.append(time.perf_counter() - sent.pop(i))
+        responses.append(((offset + i) % len(pool), response))
+        window.release()
+    await sender
+    writer.close()
+    await writer.wait_closed()
+
+async def run_load(args, pool):
+    latencies = []
+    responses = []
+    per_connection, extra = divmod(args.requests, args.connections)
+    start = time.perf_counter()
+    await asyncio.gather(*(run_connection(args, pool, per_connection + (c < extra), c * 997,
+                                          latencies, responses)
+                           for c in range(args.connections)))
+    return time.perf_counter() - start, latencies, responses
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+def check(pool, responses):
+    """Return the number of responses that differ from parsing locally"""
+    expected = [CursorParser(program).parse() for program in pool]
+    wrong = 0
+    for index, response in responses:
+        if response.get('errors') != expected[index] or response.get('valid') != (not expected[index]):
+            wrong += 1
+    return wrong
+
+def spawn(args):
+    """Start server.py on a temporary Unix socket; return the process"""
+    args.unix = os.path.join(tempfile.mkdtemp(), 'parser.sock')
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py'),
+               '--unix', args.unix]
+    if args.jobs is not None:
+        command += ['-j', str(args.jobs)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    # the server prints a line once it is listening
+    if not process.stdout.readline():
+        raise RuntimeError('server did not start')
+    return process
+
+def main(argv=None) -> int:
+    argparser = argparse.ArgumentParser(description="Load the validation server with small programs")
+    argparser.add_argument('--unix', metavar='PATH', help='Unix socket of the server')
+    argparser.add_argument('--host', default='127.0.0.1', help='TCP address of the server')
+    argparser.add_argument('--port', type=int, default=7878, help='TCP port of the server')
+    argparser.add_argument('--spawn', action='store_true',
+                           help='start a server on a temporary Unix socket for the run')
+    argparser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes of a spawned server')
+    argparser.add_argument('-n', '--requests', type=int, default=20000, help='requests to send (default: 20000)')
+    argparser.add_argument('-c', '--connections', type=int, default=8, help='connections (default: 8)')
+    argparser.add_argument('--depth', type=int, default=32,
+                           help='requests in flight per connection (default: 32)')
+    argparser.add_argument('--framing', choices=('json', 'length'), default='json',
+                           help='request framing (default: json)')
+    argparser.add_argument('--clauses', type=int, default=5, help='clauses per program (default: 5)')
+    argparser.add_argument('--error-rate', type=float, default=0.2,
+                           help='chance of an error in each clause (default: 0.2)')
+    argparser.add_argument('--programs', type=int, default=500, help='distinct programs (default: 500)')
+    argparser.add_argument('--check', action='store_true', help='compare the responses with parsing locally')
+    args = argparser.parse_args(argv)
+
+    pool = programs(args.programs, args.clauses, args.error_rate)
+    process = spawn(args) if args.spawn else None
+    try:
+        elapsed, latencies, responses = asyncio.run(run_load(args, pool))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    size = sum(len(program) for program in pool) / len(pool)
+    print(f'{len(responses)} requests of {size:.0f} bytes on average in {elapsed:.2f} s: '
+          f'{len(responses) / elapsed:.0f} validations/s')
+    print(f'latency p50 {percentile(latencies, 50) * 1000:.2f} ms, '
+          f'p99 {percentile(latencies, 99) * 1000:.2f} ms, max {max(latencies) * 1000:.2f} ms')
+    if args.check:
+        wrong = check(pool, responses)
+        print(f'{wrong} responses differ from CursorParser')
+        return 1 if wrong else 0
+    return 0
+
+if __name__=="__main__": exit(main())
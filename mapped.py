@@ -0,0 +1,118 @@
+# mapped.py
+# Validation of program files through a memory map
+"""Validate large program files without reading them into a str.
+
+The file is memory-mapped and cut into windows after a "." that is outside
+single quotes, the way streaming.read_blocks() cuts what it reads, and the
+windows are parsed with StreamParser's clause-by-clause driver. A window is
+a lexer.AsciiText over the mapped bytes: the lexer classifies the bytes
+directly and only the spans that go into error messages are decoded, so
+besides the pages of the mapping only one window's tokens are held.
+
+The grammar is ASCII. A window that has other bytes in it is decoded as
+UTF-8 and parsed as a str, so the errors are always the same as for the
+decoded file."""
+import contextlib
+import mmap
+import os
+import re
+
+import lexer
+from parser import CursorParser, limit_errors
+from streaming import StreamParser, CHUNK_SIZE
+
+# bytes that matter when looking for the end of a clause
+_CLAUSE_END_RE = re.compile(b"['.]")
+
+def block_ends(buffer, chunk_size=CHUNK_SIZE):
+    """Yield (end, final) pairs that cut buffer into blocks of about
+    chunk_size bytes or more; unless final is True, each block ends right
+    after a "." that is outside single quotes"""
+    length = len(buffer)
+    scanned = 0
+    in_quotes = False
+    cut = -1
+    while scanned < length:
+        end = min(length, scanned + chunk_size)
+        for m in _CLAUSE_END_RE.finditer(buffer, scanned, end):
+            if m.group() == b"'":
+                in_quotes = not in_quotes
+            elif not in_quotes:
+                cut = m.end()
+        scanned = end
+        if cut >= 0 and cut < length:
+            yield cut, False
+            cut = -1
+    yield length, True
+
+class MappedParser(StreamParser):
+    """StreamParser over a bytes-like buffer, usually an mmap.
+    Usage: errors = list(MappedParser(buffer).errors())"""
+
+    def __init__(self, buffer, chunk_size=CHUNK_SIZE, dedupe=False):
+        self.buffer = memoryview(buffer)
+        self.blocks = block_ends(self.buffer, chunk_size)
+        self.final = False
+        self.dedupe = dedupe
+        # offset in buffer of the start of self.parser.contents
+        self.base = 0
+        self.parser = CursorParser('')
+
+    def window(self, start, end):
+        """Return the contents to parse buffer[start:end] as"""
+        view = self.buffer[start:end]
+        if lexer.NON_ASCII_RE.search(view) is None:
+            return lexer.AsciiText(view)
+        return str(view, 'utf-8')
+
+    def offset(self):
+        """Return the offset in buffer of the cursor"""
+        parser = self.parser
+        if isinstance(parser.contents, str):
+            return self.base + len(parser.contents[:parser.pos].encode('utf-8'))
+        return self.base + parser.pos
+
+    def refill(self):
+        """Drop the text parsed so far and extend the window to the end of
+            the next block"""
+        old = self.parser
+        self.base = self.offset()
+        end, self.final = next(self.blocks)
+        self.parser = CursorParser(self.window(self.base, end), dedupe=self.dedupe)
+        self.parser.line_num = old.line_num
+
+    def rest(self):
+        """Return the text from the cursor to the end of the input"""
+        return str(self.buffer[self.offset():], 'utf-8')
+
+@contextlib.contextmanager
+def open_mapped(path):
+    """Context manager that maps the file at path read-only and gives the
+    mmap (b'' for an empty file, which cannot be mapped)"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b''
+            return
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if hasattr(mapping, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mapping.madvise(mmap.MADV_SEQUENTIAL)
+        yield mapping
+    finally:
+        try:
+            mapping.close()
+        except BufferError:
+            # views of it are still referenced, from the traceback of an
+            # exception; it is unmapped when they are freed
+            pass
+
+def validate(buffer, chunk_size=CHUNK_SIZE, max_errors=None, dedupe=False):
+    """Return the errors in the program held in buffer as UTF-8, the same
+    list CursorParser(decoded program, max_errors=max_errors,
+    dedupe=dedupe).parse() gives. Parsing stops at the max_errors-th error"""
+    return limit_errors(MappedParser(buffer, chunk_size, dedupe).errors(), max_errors)
+
+def parse_mapped(path, chunk_size=CHUNK_SIZE):
+    """Return the errors in the program file at path"""
+    with open_mapped(path) as buffer:
+        return validate(buffer, chunk_size)
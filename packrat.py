@@ -0,0 +1,107 @@
+# packrat.py
+# Optional memoization of grammar routines by position
+"""Packrat mode for CursorParser.
+
+PackratParser remembers, for <atom>, <structure>, <predicate> and whole
+<term>s, what parsing the rule at a given offset gave: the offset, token
+and line it ended at, the errors it added and whether it returned (with
+what) or raised (with which exception). Parsing the same rule at the same
+offset again replays that instead of reading the tokens again. Since the
+line number at an offset is always the same, the offset is enough to tell
+two calls apart.
+
+CursorParser never reads a <structure> again once it has its "(", so its
+running time is already linear in the length of the program; the memo
+table saves the re-reading that is left, which happens when an invalid
+<term> or <predicate> is tried against each alternative. The table holds
+at most capacity entries and makes room by the eviction policy:
+    "lru"  -- drop the least recently used entry
+    "fifo" -- drop the oldest entry
+    "none" -- add no more entries once full"""
+import collections
+
+from parser import Parser, CursorParser
+
+POLICIES = ('lru', 'fifo', 'none')
+
+class MemoTable():
+    """Bounded (rule, offset) -> outcome table"""
+
+    def __init__(self, capacity=1 << 16, policy='lru'):
+        if policy not in POLICIES:
+            raise ValueError('unknown eviction policy ' + repr(policy))
+        self.capacity = capacity
+        self.policy = policy
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the outcome stored under key, or None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.policy == 'lru':
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        """Store an outcome under key, evicting by the policy if full"""
+        if len(self.entries) >= self.capacity:
+            if self.policy == 'none' or self.capacity <= 0:
+                return
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        self.entries[key] = entry
+
+    def stats(self):
+        """Return the table's counters as a dict"""
+        return {'entries': len(self.entries), 'capacity': self.capacity, 'policy': self.policy,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+class PackratParser(CursorParser):
+    """CursorParser that memoizes its rules in a MemoTable.
+    Usage: PackratParser(contents, capacity, policy).parse()"""
+
+    def __init__(self, cont, capacity=1 << 16, policy='lru'):
+        CursorParser.__init__(self, cont)
+        self.memo = MemoTable(capacity, policy)
+
+    def memoized(self, rule, routine, *args):
+        """Call routine (a CursorParser method) at the cursor, or replay what
+            calling it at this offset did before"""
+        key = (rule, self.pos)
+        entry = self.memo.get(key)
+        if entry is not None:
+            returned, value, end, errors = entry
+            self.reset(end)
+            self.error_list += errors
+            if returned:
+                return value
+            raise value
+        nerrors = len(self.error_list)
+        try:
+            value = routine(self, *args)
+        except (Parser.ParserError, StopIteration) as err:
+            self.memo.put(key, (False, err, self.mark(), self.error_list[nerrors:]))
+            raise
+        self.memo.put(key, (True, value, self.mark(), self.error_list[nerrors:]))
+        return value
+
+    def atom(self):
+        return self.memoized('atom', CursorParser.atom)
+
+    def structure(self):
+        return self.memoized('structure', CursorParser.structure)
+
+    def predicate(self):
+        return self.memoized('predicate', CursorParser.predicate)
+
+    def term(self, structures=None):
+        if structures is not None:
+            # one step of term_list(), which pushes onto its stack
+            return CursorParser.term(self, structures)
+        return self.memoized('term', CursorParser.term)
@@ -0,0 +1,260 @@
+# parallel.py
+# Parse the clauses of one large program on several processes
+"""Intra-file parallel parsing.
+
+The program is cut into pieces after "." characters that are outside single
+quotes (the rule skip_until(..., outside_quotes=True) uses), and the pieces
+are parsed as clause lists by worker processes. The workers read their
+piece from a shared memory copy of the program, so each one only decodes
+the part it parses.
+
+A piece's first clause is only a guess at where a clause starts, so the
+results are stitched together the way Parser.parse() would have gone
+through the program: the parent walks from clause to clause, takes a
+worker's results from the first clause start it agrees with, and parses
+any clause nobody agreed on (including those that run over the end of a
+piece) itself. The error list is the same as CursorParser(program).parse().
+
+With max_errors, the parent stops walking once it has that many errors and
+the pieces not started yet are dropped; each worker stops its piece once
+the piece has that many, as the parent would stop there too if it took the
+piece's clauses from its start."""
+import bisect
+import concurrent.futures
+import os
+import re
+from multiprocessing import shared_memory
+
+import lexer
+import prescan
+from parser import Parser, CursorParser
+
+# pieces smaller than this are not worth a worker
+MIN_PIECE_SIZE = 1 << 16
+# pieces per worker, so that a slow piece does not hold up the others
+PIECES_PER_JOB = 4
+
+_NONBLANK_RE = re.compile(r'\S')
+
+def split_points(contents, pieces, clause_ends=None):
+    """Return up to pieces-1 offsets, each just after a "." outside single
+    quotes, that cut contents into pieces of about the same size.
+    clause_ends is the prescan.Scan.clause_ends of contents, if known"""
+    length = len(contents)
+    points = []
+    start = 0
+    for k in range(1, pieces):
+        target = max(start, length * k // pieces)
+        if clause_ends is not None:
+            i = bisect.bisect_right(clause_ends, target)
+            if i == len(clause_ends):
+                break
+            start = clause_ends[i]
+            points.append(start)
+            continue
+        in_quotes = contents.count("'", start, target) % 2 == 1
+        pos = target
+        while pos < length:
+            n = contents[pos]
+            if n == "'":
+                in_quotes = not in_quotes
+            elif n == '.' and not in_quotes:
+                break
+            pos += 1
+        if pos >= length:
+            break
+        start = pos + 1
+        points.append(start)
+    return points
+
+def _parse_piece(shm_name, byte_start, byte_end, char_start, line_num, final, stop_flag,
+                 max_errors=None, dedupe=False):
+    """Worker: parse the clauses of one piece of the program in shared memory.
+    Return (clauses, stop) where clauses is a list of (start, end, errors)
+    with offsets into the whole program, and stop is (reason, pos, line,
+    message) for why parsing the piece stopped: "end" (only blanks left),
+    "query" (a <query> starts at pos), "cut" (the clause at pos runs past
+    the end of the piece, the piece had max_errors errors before it, or
+    the parent set the byte at offset stop_flag because it is done),
+    "error" or "eof" (parsing the program ends with message)"""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        text = bytes(shm.buf[byte_start:byte_end]).decode('utf-8')
+        return _parse_clauses(text, char_start, line_num, final, shm.buf, stop_flag, max_errors, dedupe)
+    finally:
+        shm.close()
+
+def _parse_clauses(text, char_start, line_num, final, buf, stop_flag, max_errors, dedupe):
+    """_parse_piece() for the decoded piece text"""
+    p = CursorParser(text, dedupe=dedupe)
+    p.line_num = line_num
+    clauses = []
+    found = 0
+    while True:
+        if buf[stop_flag]:
+            return clauses, ('cut', char_start + p.pos, p.line_num, None)
+        try:
+            p.skip_blanks()
+        except StopIteration:
+            return clauses, ('end', char_start + p.pos, p.line_num, None)
+        start = p.pos
+        if p.peek_kind()[0] in (lexer.QUERY, lexer.QMARK):
+            return clauses, ('query', char_start + start, p.line_num, None)
+        if max_errors is not None and found >= max_errors:
+            return clauses, ('cut', char_start + start, p.line_num, None)
+        backup = p.mark()
+        try:
+            p.clause()
+        except Parser.ParserError as perr:
+            clauses.append((char_start + start, char_start + p.pos, p.error_list))
+            return clauses, ('error', char_start + p.pos, p.line_num, str(perr))
+        except StopIteration as si:
+            if final:
+                clauses.append((char_start + start, char_start + p.pos, p.error_list))
+                return clauses, ('eof', char_start + p.pos, p.line_num, str(si))
+            p.reset(backup)
+            return clauses, ('cut', char_start + start, p.line_num, None)
+        clauses.append((char_start + start, char_start + p.pos, p.error_list))
+        found += len(p.error_list)
+        p.error_list = []
+
+class ParallelParser():
+    """Parse one program with a pool of worker processes.
+    Usage: ParallelParser(contents, jobs).parse()
+    max_errors and dedupe are CursorParser's"""
+
+    def __init__(self, cont, jobs=None, clause_ends=None, max_errors=None, dedupe=False):
+        if max_errors is not None and max_errors < 1:
+            raise ValueError('max_errors must be at least 1')
+        self.contents = cont
+        self.jobs = jobs if jobs is not None else (os.cpu_count() or 1)
+        # the prescan.Scan.clause_ends of cont, if the caller has scanned it
+        self.clause_ends = clause_ends
+        self.max_errors = max_errors
+        self.dedupe = dedupe
+        self.error_list = []
+        # offsets where the pieces start, followed by the end of the program
+        self.points = []
+
+    def parse(self):
+        """Parse the program.
+        Output the same list of errors as CursorParser(contents,
+        max_errors=max_errors, dedupe=dedupe).parse()"""
+        pieces = min(self.jobs * PIECES_PER_JOB, len(self.contents) // MIN_PIECE_SIZE)
+        if self.jobs <= 1 or pieces <= 1:
+            return CursorParser(self.contents, max_errors=self.max_errors, dedupe=self.dedupe).parse()
+        if self.clause_ends is None:
+            self.clause_ends = prescan.scan(self.contents).clause_ends
+        self.points = [0] + split_points(self.contents, pieces, self.clause_ends) + [len(self.contents)]
+        data = self.contents.encode('utf-8')
+        # the byte after the program tells the workers to stop
+        stop_flag = len(data)
+        shm = shared_memory.SharedMemory(create=True, size=stop_flag + 1)
+        try:
+            shm.buf[:stop_flag] = data
+            shm.buf[stop_flag] = 0
+            del data
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                futures = []
+                byte_start = 0
+                line_num = 1
+                for i in range(len(self.points) - 1):
+                    piece = self.contents[self.points[i]:self.points[i+1]]
+                    byte_end = byte_start + (len(piece) if piece.isascii() else len(piece.encode('utf-8')))
+                    futures.append(executor.submit(_parse_piece, shm.name, byte_start, byte_end,
+                                                   self.points[i], line_num, i == len(self.points) - 2,
+                                                   stop_flag, self.max_errors, self.dedupe))
+                    byte_start = byte_end
+                    line_num += piece.count('\n')
+                self.stitch(futures)
+                # the pieces after where the program or max_errors ended
+                # are not needed
+                shm.buf[stop_flag] = 1
+                for future in futures:
+                    future.cancel()
+        finally:
+            shm.close()
+            shm.unlink()
+        if self.max_errors is not None:
+            del self.error_list[self.max_errors:]
+        return self.error_list
+
+    def stitch(self, futures):
+        """Walk through the program from clause to clause like
+        Parser.program(), taking the workers' results where they agree"""
+        contents = self.contents
+        m = _NONBLANK_RE.search(contents)
+        if m is None:
+            self.error_list.append("Error: program was the empty string")
+            return
+        pos = m.start()
+        line_num = 1 + contents.count('\n', 0, pos)
+        # clause start offset -> (piece, index of the clause in that piece)
+        starts = {}
+        results = []
+        while True:
+            if self.max_errors is not None and len(self.error_list) >= self.max_errors:
+                return
+            if contents.startswith('?', pos):
+                self.query(pos, line_num)
+                return
+            # collect the results of the pieces that start at or before pos
+            while len(results) < len(futures) and self.points[len(results)] <= pos:
+                clauses, stop = futures[len(results)].result()
+                for i, clause in enumerate(clauses):
+                    starts[clause[0]] = (len(results), i)
+                results.append((clauses, stop))
+            found = starts.get(pos)
+            if found is None:
+                # no worker started a clause here
+                pos, line_num = self.clause(pos, line_num)
+            else:
+                clauses, (reason, stop_pos, stop_line, message) = results[found[0]]
+                for clause in clauses[found[1]:]:
+                    self.error_list += clause[2]
+                if reason == 'error' or reason == 'eof':
+                    self.error_list.append(message)
+                    return
+                pos, line_num = stop_pos, stop_line
+                if reason == 'cut':
+                    pos, line_num = self.clause(pos, line_num)
+            if pos is None:
+                return
+            # skip the blanks before the next clause
+            m = _NONBLANK_RE.search(contents, pos)
+            if m is None:
+                line_num += contents.count('\n', pos)
+                self.error_list.append("Line "+str(line_num)+': reached EOF while parsing clause list')
+                return
+            line_num += contents.count('\n', pos, m.start())
+            pos = m.start()
+
+    def clause(self, pos, line_num):
+        """Parse the clause at offset pos in this process.
+        Return the offset and line number after it, or (None, None) if
+        parsing the program ends there"""
+        p, err = CursorParser.run_at(self.contents, pos, line_num, CursorParser.clause, MIN_PIECE_SIZE,
+                                     self.dedupe)
+        self.error_list += p.error_list
+        if err is not None:
+            self.error_list.append(str(err))
+            return None, None
+        return pos + p.pos, p.line_num
+
+    def query(self, pos, line_num):
+        """Parse the <query> at offset pos and check that nothing follows it"""
+        p = CursorParser(self.contents[pos:], dedupe=self.dedupe)
+        p.line_num = line_num
+        try:
+            p.query()
+        except (Parser.ParserError, StopIteration) as err:
+            self.error_list += p.error_list
+            self.error_list.append(str(err))
+            return
+        self.error_list += p.error_list
+        try:
+            p.skip_blanks()
+        except StopIteration:
+            # This is good, the file is done
+            return
+        self.error_list.append('After parsing the program, the following remained in the file:\n'+p.contents[p.pos:])
@@ -7,7 +7,12 @@ Joseph Press      b00095348
 Abdu Sallouh      b00087818
 
 """
+import argparse
 import itertools
+import sys
+import grammar
+import lexer
+from tree import TreeBuilder
 
 class Parser():
     """Parser class that takes a program and tells whether it is valid according
@@ -18,10 +23,15 @@ class Parser():
         Attributes:
             message -- explanation of the exception including
             the line number where this exception happened
-            line -- line number where the error was found"""
-        def __init__(self, description, ln):
-            self.message="Line " + str(ln) + ": " + description
+            line -- line number where the error was found
+            column -- column where the error was found, or None"""
+        def __init__(self, description, ln, column=None):
+            if column is None:
+                self.message="Line " + str(ln) + ": " + description
+            else:
+                self.message="Line " + str(ln) + ", column " + str(column) + ": " + description
             self.line = ln
+            self.column = column
         def __str__(self):
             return self.message
 
@@ -676,29 +686,854 @@ class Parser():
         self.program_gen = iter(remaining)
         return remaining
 
-# main function
-# reads input files numbered 1.txt and up, parses them and gives output
-# to parser_output.txt
-def main() -> int:
-    i = 1
-    outputs_lst = []
-    while True: # loop until file open fails
-        try:
-            f=open(str(i)+'.txt','r')
-        except FileNotFoundError:
-            # write the output and terminate
-            ofilename='parser_output.txt'
-            out = open(ofilename,'w')
-            out.write(ofilename + header + '\n'.join(outputs_lst))
-            return 0
-        # read and parse the contents of the file
-        contents = f.read()
-        parser = Parser(contents)
-        output = parser.parse()
-        if len(output) == 0:
-            outputs_lst.append(str(i)+".txt:\n"+"Valid program\n")
+class CursorParser(Parser):
+    """Parser that reads the program from a lexer.TokenStream with an integer
+    cursor. It accepts the same language and produces the same error list as
+    Parser, but a backtrack point is just a saved offset and token index,
+    so no characters are copied and parsing runs in linear time.
+    The grammar routines work on whole tokens; only error recovery and the
+    text of error messages look at the characters themselves. Line numbers
+    are not counted while parsing: the line of the cursor is looked up in
+    the stream's newline index when an error message needs it. With
+    columns, error messages also give the column, as "Line 3, column 7: ..."."""
+
+    # character classes, in the same order as the tests in Parser.peek_token()
+    char_classes = {}
+    for c in ['+','-','*','/',"\\",'^','~',':','.','?',' ','#','$','&']:
+        char_classes[c] = 'special'
+    for c in [str(i) for i in range(10)]:
+        char_classes[c] = 'digit'
+    for c in [chr(i) for i in range(65,91)]+['_']:
+        char_classes[c] = 'uppercase-char'
+    for c in [chr(i) for i in range(97,123)]:
+        char_classes[c] = 'lowercase-char'
+    char_classes['\n'] = 'newline'
+    for c in "(),'":
+        char_classes[c] = c
+    del c
+
+    # descriptions of the Failures, by code, as Parser words them
+    MESSAGES = {
+        'digit': 'Expected <digit>, found "{found}" instead.',
+        'small-atom': '<small_atom> must start with <lowercase-char>, not "{found}"',
+        'variable': '<variable> must start with <uppercase-char>, not "{found}"',
+        'structure': '<structure> must have <term-list> enclosed in parentheses',
+        'predicate': 'Could not parse as a predicate (atom or structure)',
+        'term': 'could not resolve to a term',
+    }
+
+    class Failure(Parser.ParserError):
+        """ParserError raised when a grammar rule does not match. Most of
+        these are caught by a rule that tries another alternative, so the
+        error is kept as a record and its message is only made if it is
+        needed, which is when it ends up in the error list
+        Attributes:
+            code -- the rule that failed, a key of CursorParser.MESSAGES
+            found -- the character the rule failed on, or None
+            offset -- offset where the rule failed
+            source -- the CursorParser, which looks up the line and column
+            of offset"""
+        def __init__(self, code, found, offset, source):
+            self.code = code
+            self.found = found
+            self.offset = offset
+            self.source = source
+            self.ln = None
+        @property
+        def description(self):
+            return CursorParser.MESSAGES[self.code].format(found=self.found)
+        @property
+        def line(self):
+            if self.ln is None:
+                self.ln = self.source.line_at(self.offset)
+            return self.ln
+        @property
+        def column(self):
+            return self.source.column_at(self.offset)
+        @property
+        def message(self):
+            column = self.column
+            if column is None:
+                return "Line " + str(self.line) + ": " + self.description
+            return "Line " + str(self.line) + ", column " + str(column) + ": " + self.description
+
+    # the alternative to take for each kind of token; see grammar.py
+    tables = grammar.load_tables()
+    predicate_table = tables['predicate']
+    term_table = tables['term']
+
+    class ErrorLimit(Exception):
+        """Raised by add_error() once max_errors errors have been added"""
+
+    def __init__(self, cont, columns=False, max_errors=None, dedupe=False):
+        if max_errors is not None and max_errors < 1:
+            raise ValueError('max_errors must be at least 1')
+        self.stream = lexer.TokenStream(cont)
+        self.kinds = self.stream.kinds
+        self.starts = self.stream.starts
+        self.length = len(cont)
+        # self.tok is the index of the token starting at self.pos, or -1 if
+        # self.pos is in the middle of one of the stream's tokens
+        self.pos = 0
+        self.tok = 0
+        self.columns = columns
+        self.max_errors = max_errors
+        # the (offset, message) pairs added so far, with dedupe
+        self.seen = set() if dedupe else None
+        # sets self.line_num, which needs the stream and the cursor
+        Parser.__init__(self, cont)
+        self.program_gen = None
+
+    @property
+    def line_num(self):
+        """Line of the cursor"""
+        return self.first_line + self.stream.lines_before(self.pos)
+
+    def line_at(self, pos):
+        """Return the line that offset pos is on"""
+        return self.first_line + self.stream.lines_before(pos)
+
+    def column_at(self, pos):
+        """Return the column of offset pos (see column), or None"""
+        if not self.columns:
+            return None
+        return pos - self.stream.line_start(pos) + 1
+
+    @line_num.setter
+    def line_num(self, line_num):
+        # contents starts on line self.first_line; run_at() and the drivers
+        # that parse part of a program set it for the part
+        self.first_line = line_num - self.stream.lines_before(self.pos)
+
+    @property
+    def column(self):
+        """Column of the cursor, counted from 1, or None without columns.
+            Columns on the first line are counted from the start of contents"""
+        return self.column_at(self.pos)
+
+    def failure(self, code, found=None):
+        """Return the Failure for the rule code failing at the cursor"""
+        return CursorParser.Failure(code, found, self.pos, self)
+
+    def where(self):
+        """Return "Line N" for the cursor, or "Line N, column C" with columns"""
+        if self.columns:
+            return "Line " + str(self.line_num) + ", column " + str(self.column)
+        return "Line " + str(self.line_num)
+
+    def parse(self, tree=False):
+        """Parse a program.
+        Output a list of descriptions of errors in the program, or with tree,
+        (errors, program) where program is the tree.Program of a valid
+        program and None if there are errors.
+        With max_errors, parsing stops once that many errors are found and
+        the list has the first max_errors errors; with dedupe, an error
+        added again at the same offset with the same message, when the
+        parser goes back over text it has already read, is left out"""
+        try:
+            errors = Parser.parse(self)
+        except CursorParser.ErrorLimit:
+            errors = self.error_list
+        if self.max_errors is not None:
+            del errors[self.max_errors:]
+        if not tree:
+            return errors
+        if errors:
+            return errors, None
+        return errors, TreeBuilder(self.stream).program()
+
+    def program(self):
+        """Subroutine for the <program> symbol.
+            Valid programs have a <query>, optionally preceded by a <clause-list>."""
+        if self.peek_kind(skip_blanks=True)[0] not in (lexer.QUERY, lexer.QMARK):
+            # looking for a clause list, then a query
+            try:
+                self.clause_list()
+            except Parser.ParserError as perr:
+                self.add_error(str(perr))
+                return
+            self.skip_blanks()
+        try:
+            self.query()
+        except Parser.ParserError as perr:
+            self.add_error(str(perr))
+            return
+
+        try:
+            self.skip_blanks()
+        except StopIteration:
+            # This is good, the file is done
+            return
+        self.add_error('After parsing the program, the following remained in the file:\n'+self.contents[self.pos:])
+
+    def clause_list(self):
+        """Subroutine for the <clause-list> symbol.
+            Valid clause lists have a <clause>, optionally followed by a <clause-list>
+            Loops over the clauses instead of recursing once per clause
+            Do not catch StopIteration in call to self.clause()"""
+        self.clause()
+        # Parser.clause_list() restores this backup (the one taken after the
+        # first clause) when any later clause fails
+        backup = self.mark()
+        while True:
+            try:
+                self.skip_blanks()
+            except StopIteration:
+                raise StopIteration(self.where()+': reached EOF while parsing clause list')
+            # this is the beginning of a query; we're done here because a clause can't start with a "?"
+            if self.peek_kind()[0] in (lexer.QUERY, lexer.QMARK):
+                return
+            try:
+                self.clause()
+            except Parser.ParserError as perr:
+                self.reset(backup)
+                raise perr
+
+    def clause(self):
+        """Subroutine for the <clause> symbol.
+            Valid clauses follow this BNF rule:
+            <clause> -> <predicate> . | <predicate> :- <predicate-list> ."""
+        backup = self.mark()
+        try:
+            self.predicate()
+        except Parser.ParserError as perr:
+            # detect, report, and recover from an invalid predicate here
+            invalid_predicate = self.skip_until('.:',outside_quotes = True)
+            self.add_error(self.where()+': invalid <predicate>: "' + invalid_predicate + '"')
+        try:
+            kind, start = self.peek_kind(skip_blanks=True)
+        except StopIteration:
+            raise StopIteration(self.where()+': reached EOF after first <predicate>')
+        if kind == lexer.NECK or kind == lexer.COLON:
+            #it should be a predicate list
+            self.skip_blanks()
+            if kind == lexer.COLON:
+                # a ":" that is not followed by "-"
+                self.consume()
+                if self.pos >= self.length:
+                    raise StopIteration(self.where()+': reached EOF after ":" after first <predicate> in <clause>')
+                raise Parser.ParserError('clause must have ":-" between predicate and predicate list', self.line_num, self.column)
+            self.consume()
+            try:
+                self.predicate_list()
+            except Parser.ParserError as perr:
+                self.reset(backup)
+                raise perr
+            except StopIteration:
+                raise StopIteration(self.where()+': reached EOF while parsing <predicate-list>')
+
+            try:
+                kind, start = self.peek_kind(skip_blanks=True)
+            except StopIteration:
+                raise StopIteration(self.where()+': reached EOF before "." found to terminate <clause>')
+        if kind == lexer.PERIOD:
+            self.skip_blanks()
+            self.consume()
+        else:
+            raise Parser.ParserError('"." must come at the end of a clause; found "'+self.contents[start]+'" after <predicate> instead', self.line_num, self.column)
+
+    def query(self):
+        """Subroutine for the <query> symbol.
+            <query> -> ?- <predicate-list> ."""
+        backup = self.mark()
+        try:
+            kind, start = self.peek_kind(skip_blanks=True)
+        except StopIteration:
+            raise StopIteration(self.where()+": reached EOF before <query>")
+        if kind != lexer.QUERY and kind != lexer.QMARK:
+            self.reset(backup)
+            raise Parser.ParserError('<query> must start with "?-", not "' + self.contents[start] + '"', self.line_num, self.column)
+        self.skip_blanks()
+        if kind == lexer.QMARK:
+            # a "?" that is not followed by "-"
+            self.consume()
+            if self.pos >= self.length:
+                raise StopIteration(self.where()+": reached EOF after '?' in <query>")
+            n = self.contents[self.pos]
+            self.reset(backup)
+            raise Parser.ParserError('<query> must start with "?-", not "?' + n + '"', self.line_num, self.column)
+        self.consume()
+        # check <predicate-list>
+        try:
+            self.predicate_list()
+        except StopIteration:
+            raise StopIteration(self.where()+": reached EOF while parsing <predicate-list> in <query>")
+        # check for period terminating <query>
+        try:
+            kind, start = self.peek_kind(skip_blanks=True)
+        except StopIteration:
+            raise StopIteration(self.where()+": no '.' found after <predicate-list>")
+        if kind != lexer.PERIOD:
+            self.reset(backup)
+            raise Parser.ParserError('<query> must end with ".", not "' + self.contents[start] + '"', self.line_num, self.column)
+        # like Parser.query(), this eats the next character even if it is a
+        # blank before the period; program() reports whatever is left over
+        self.token()
+
+    def predicate_list(self):
+        """Subroutine for the <predicate-list> symbol.
+            <predicate-list> -> <predicate> | <predicate> , <predicate-list>
+            Loops over the predicates instead of recursing once per predicate
+            No need to skip leading blanks; predicate function does this"""
+        while True:
+            try:
+                self.predicate()
+            except Parser.ParserError as perr:
+                try:
+                    invalid_predicate = self.skip_until(",.",outside_quotes=True)
+                except StopIteration:
+                    raise StopIteration(self.where()+": reached EOF while parsing <predicate-list>")
+                self.add_error(self.where()+': invalid <predicate>: "'+invalid_predicate+'"')
+                if self.peek_kind()[0] == lexer.COMMA:
+                    self.consume()
+                    continue
+            # only continue if there is a comma found
+            if self.peek_kind(skip_blanks=True)[0] != lexer.COMMA:
+                return
+            self.skip_blanks()
+            self.consume()
+
+    def predicate(self):
+        """Subroutine for <predicate>
+            <predicate> -> <structure> | <atom>
+            must skip leading blanks
+            Do not catch StopIteration
+
+            The next token picks the alternative from predicate_table, so
+            the <atom> is read once whether or not a "(" follows it"""
+        self.skip_blanks()
+        action = self.predicate_table.get(self.peek_kind()[0])
+        if action is None:
+            # no <predicate> starts with this token
+            return self.try_predicate()
+        routine, continuation = action
+        try:
+            getattr(self, routine)()
+            if continuation is not None and self.continue_with(continuation):
+                self.term_list_tail()
+        except StopIteration:
+            raise StopIteration(self.where()+": reached EOF while parsing <structure>")
+
+    def try_predicate(self):
+        """Try each alternative of <predicate> in turn, as Parser.predicate()
+            does, to report an invalid predicate the same way"""
+        backup = self.mark()
+        try:
+            self.structure()
+        except Parser.ParserError:
+            self.reset(backup)
+            try:
+                self.atom()
+            except Parser.ParserError:
+                self.reset(backup)
+                raise self.failure('predicate')
+            except StopIteration:
+                raise StopIteration(self.where()+": reached EOF while parsing <atom>")
+        except StopIteration:
+            raise StopIteration(self.where()+": reached EOF while parsing <structure>")
+
+    def term_list(self):
+        """Subroutine for <term-list>
+            <term-list> -> <term> | <term> , <term-list>
+            Do not catch StopIteration
+            leading blanks will be skipped in self.term() function
+
+            Terms are read in a loop. A <structure> term pushes its backtrack
+            point on an explicit stack and its <term-list> is read by the same
+            loop, so neither long lists nor deep nesting use Python recursion.
+            Once a <structure> has its "(", it cannot fail with a ParserError,
+            so nothing on the stack is ever needed to backtrack."""
+        structures = []
+        while True:
+            try:
+                if self.term(structures):
+                    # a nested <structure> was opened; read its <term-list>
+                    continue
+            except Parser.ParserError as perr:
+                try:
+                    invalid_term = self.skip_until(",)")
+                except StopIteration:
+                    raise StopIteration(self.where()+": reached EOF while parsing <term-list>")
+                self.add_error(self.where()+': invalid <term>: "' + invalid_term + '"')
+                if self.peek_kind()[0] == lexer.COMMA:
+                    self.consume()
+                    continue
+
+            kind, start = self.peek_kind(skip_blanks=True)
+            while kind == lexer.RPAREN:
+                if not structures:
+                    # the caller's structure() eats the ")"
+                    return
+                # close the innermost nested <structure>
+                structures.pop()
+                self.skip_blanks()
+                self.consume()
+                kind, start = self.peek_kind(skip_blanks=True)
+            while kind in lexer.SPECIAL_KINDS:
+                self.add_error(self.where()+': <special> characters like "' + self.contents[start] + '" are not allowed in non-string terms')
+                self.skip_blanks()
+                if kind == lexer.NECK or kind == lexer.QUERY:
+                    # "?-" and ":-" are two <special> characters
+                    self.add_error(self.where()+': <special> characters like "' + self.contents[start+1] + '" are not allowed in non-string terms')
+                self.consume()
+                kind, start = self.peek_kind(skip_blanks=True)
+
+            if kind != lexer.COMMA:
+                self.add_error(self.where()+": <terms> in a <term-list> must be comma-separated")
+            else:
+                self.skip_blanks()
+                self.consume()
+            # If no ')' was found, there should be another term
+
+    def term(self, structures=None):
+        """Subroutine for <term>
+            <term> -> <atom> | <variable> | <structure> | <numeral>
+            Must skip leading blanks
+            If the term is a <structure>, only read up to and including its
+            "(", push the structure's backtrack point onto the structures
+            list and return True; term_list() reads the rest
+
+            The next token picks the alternative from term_table"""
+        if structures is None:
+            # called on its own: read the whole term
+            if self.term([]):
+                self.term_list_tail()
+            return
+        blanks_backup = self.mark()
+        self.skip_blanks()
+        backup = self.mark()
+        action = self.term_table.get(self.peek_kind()[0])
+        if action is None:
+            # no <term> starts with this token
+            return self.try_term(structures, blanks_backup, backup)
+        routine, continuation = action
+        getattr(self, routine)()
+        if continuation is None or not self.continue_with(continuation):
+            return False
+        structures.append(backup)
+        return True
+
+    def try_term(self, structures, blanks_backup, backup):
+        """Try each alternative of <term> in turn, as Parser.term() does, to
+            report an invalid term the same way"""
+        try:
+            self.structure_head()
+            structures.append(backup)
+            return True
+        except Parser.ParserError:
+            self.reset(backup)
+            try:
+                self.numeral()
+            except Parser.ParserError:
+                self.reset(backup)
+                try:
+                    self.variable()
+                except Parser.ParserError:
+                    self.reset(backup)
+                    try:
+                        self.atom()
+                    except Parser.ParserError:
+                        self.reset(blanks_backup)
+                        raise self.failure('term')
+        return False
+
+    def continue_with(self, kind):
+        """After the <atom> that starts a <structure>, skip blanks and consume
+            the token of the given kind (the "(") and return True. If a
+            different token is next, go back to the end of the <atom> and
+            return False"""
+        backup = self.mark()
+        try:
+            self.skip_blanks()
+        except StopIteration:
+            raise StopIteration(self.where()+": reached EOF in <structure> after <atom> before ( <term-list> )")
+        if self.peek_kind()[0] != kind:
+            self.reset(backup)
+            return False
+        self.consume()
+        return True
+
+    def structure(self):
+        """Subroutine for <structure>
+            <structure> -> <atom> ( <term-list> )
+            Do not skip leading blanks
+            Do not catch StopIteration"""
+        # It should succeed fully and "eat" the proper tokens, or fail entirely.
+        self.structure_head()
+        self.term_list_tail()
+
+    def structure_head(self):
+        """Read the "<atom> (" that starts a <structure>, or fail entirely
+            Do not skip leading blanks
+            Do not catch StopIteration"""
+        backup = self.mark()
+
+        try:
+            self.atom()
+        except Parser.ParserError as perr:
+            self.reset(backup)
+            raise perr
+
+        try:
+            self.skip_blanks()
+        except StopIteration:
+            raise StopIteration(self.where()+": reached EOF in <structure> after <atom> before ( <term-list> )")
+        if self.peek_kind()[0] != lexer.LPAREN:
+            self.reset(backup)
+            raise self.failure('structure')
+
+        self.consume()
+
+    def term_list_tail(self):
+        """Read the "<term-list> )" that ends a <structure>
+            Do not catch StopIteration"""
+        try:
+            # do not need to skip blanks; self.term() function skips leading blanks
+            self.term_list()
+        except StopIteration as si:
+            raise StopIteration(self.where()+": reached EOF while reading <term-list>")
+        # term_list() only returns in front of a ")"
+        self.skip_blanks()
+        self.consume()
+
+    def atom(self):
+        """Subroutine for <atom>
+            <atom> -> <small-atom> | ' <string> '
+            Do not skip leading blanks
+            Do not catch StopIteration (Should not reach EOF while parsing atom)"""
+        kind = self.peek_kind()[0]
+        if kind == lexer.STRING:
+            self.consume()
+        elif kind == lexer.UNTERMINATED:
+            # the <string> runs into the end of the file
+            self.move_to(self.length)
+            raise StopIteration(self.where()+": reached eof while parsing string")
+        elif kind == lexer.QUOTE:
+            # fail the same way Parser.string() does on the first character
+            # that is not a <character>
+            self.consume()
+            string_end = self.stream.characters_end(self.pos)
+            pkch = self.contents[string_end]
+            if string_end == self.pos:
+                raise Parser.ParserError('"'+pkch+'" is not a <character> (<special> or <alphanumeric>)', self.line_num, self.column)
+            self.move_to(string_end)
+            if pkch == '\n':
+                raise Parser.ParserError("reached newline while parsing <string>", self.line_num, self.column)
+            raise Parser.ParserError('<string> must be enclosed in single quotes; "'+
+            pkch+'" not allowed in <string>', self.line_num, self.column)
+        else:
+            # we're looking to match a small-atom
+            self.small_atom()
+
+    def small_atom(self):
+        """Subroutine for <small-atom>
+            <small-atom> -> <lowercase-char> | <lowercase-char> <character-list>
+            Do not catch StopIteration
+            Do not skip leading blanks"""
+        kind, start = self.peek_kind()
+        if kind != lexer.ATOM:
+            raise self.failure('small-atom', self.contents[start])
+        self.consume()
+        if self.pos >= self.length:
+            # <character-list> reached EOF looking for more characters
+            raise StopIteration
+
+    def variable(self):
+        """Subroutine for <variable>
+            <variable> -> <uppercase-char> | <uppercase-char> <character-list>
+            Do not catch StopIteration
+            Do not skip leading blanks"""
+        kind, start = self.peek_kind()
+        if kind != lexer.VARIABLE:
+            raise self.failure('variable', self.contents[start])
+        self.consume()
+        if self.pos >= self.length:
+            # <character-list> reached EOF looking for more characters
+            raise StopIteration
+
+    def numeral(self):
+        """Subroutine for <numeral>
+            <numeral> -> <digit> | <digit> <numeral>
+            Unlike <small-atom> and <variable>, reaching EOF after the digits is fine"""
+        kind, start = self.peek_kind()
+        if kind != lexer.NUMERAL:
+            raise self.failure('digit', self.contents[start])
+        self.consume()
+
+    @classmethod
+    def run_at(cls, contents, pos, line_num, routine, window=1 << 16, dedupe=False):
+        """Run routine (a method of CursorParser, such as CursorParser.clause)
+            on contents starting at offset pos, which is on line line_num.
+            Only a window of contents after pos is lexed; the window grows
+            while the routine runs into its end. dedupe is the parser's.
+            Return (parser, error) where the parser's position is relative to
+            pos, and error is the ParserError or StopIteration that ended the
+            routine, or None"""
+        while True:
+            end = min(len(contents), pos + window)
+            p = cls(contents[pos:end], dedupe=dedupe)
+            p.line_num = line_num
+            try:
+                routine(p)
+                return p, None
+            except Parser.ParserError as perr:
+                return p, perr
+            except StopIteration as si:
+                if end == len(contents):
+                    return p, si
+            window *= 2
+
+    def mark(self):
+        """Return a backtrack point for self.reset()"""
+        return self.pos, self.tok
+
+    def reset(self, backup):
+        """Go back to a backtrack point returned by self.mark()"""
+        self.pos, self.tok = backup
+
+    def peek_kind(self, skip_blanks=False):
+        """Return (kind, start offset) of the next token without moving the
+            cursor, skipping blank tokens first if skip_blanks is set
+            Do not catch StopIteration"""
+        pos = self.pos
+        tok = self.tok
+        while True:
+            if tok >= 0:
+                kind = self.kinds[tok]
+                if kind == lexer.END:
+                    raise StopIteration
+                end = self.starts[tok+1]
+            else:
+                kind, end = self.stream.lex(pos)
+                if kind == lexer.END:
+                    raise StopIteration
+            if not skip_blanks or (kind != lexer.BLANK and kind != lexer.NEWLINE):
+                return kind, pos
+            pos = end
+            tok = tok + 1 if tok >= 0 else self.stream.index_of(end)
+
+    def consume(self):
+        """Move the cursor past the next token"""
+        if self.tok >= 0:
+            self.pos = self.starts[self.tok+1]
+            self.tok += 1
+        else:
+            self.pos = self.stream.lex(self.pos)[1]
+            self.tok = self.stream.index_of(self.pos)
+
+    def move_to(self, pos):
+        """Move the cursor forward to offset pos"""
+        self.pos = pos
+        self.tok = self.stream.index_of(pos)
+
+    def peek_token(self, skip_blanks=False):
+        """Retrieve and return the name of the next character's token without
+            moving the cursor
+            Do not catch StopIteration"""
+        return self.char_classes.get(self.peek_ch(skip_blanks), 'unrecognized')
+
+    def token(self, skip_blanks=False):
+        """Store the name of the next character's token in the self.next_tok variable
+            Return the character n that was tokenized.
+            Eat the next character, no matter what.
+            Do not catch StopIteration
+            If an unrecognized character is found, simply add an error message and return the next recognized token"""
+        if skip_blanks:
+            n=self.next_nonblank()
+        else:
+            n=self.next_ch()
+        self.next_token = self.char_classes.get(n, 'unrecognized')
+        skipped = n
+        while self.next_token == 'unrecognized':
+            self.add_error(self.where()+': Unrecognized token: "' + skipped + '"')
+            if skip_blanks:
+                skipped=self.next_nonblank()
+            else:
+                skipped=self.next_ch()
+            self.next_token = self.char_classes.get(skipped, 'unrecognized')
+        return n
+
+    def skip_blanks(self):
+        """Skip blank tokens, don't return anything
+            Do not catch StopIteration"""
+        kind = self.peek_kind()[0] if self.pos < self.length else lexer.END
+        while kind == lexer.BLANK or kind == lexer.NEWLINE:
+            self.consume()
+            if self.pos >= self.length:
+                break
+            kind = self.peek_kind()[0]
+        if self.pos >= self.length:
+            raise StopIteration
+
+    def skip_until(self, chars, outside_quotes=False):
+        """Skip until any of the characters in the string "chars"
+            if "chars" is the empty string, skip nothing
+            Return what was skipped; do not skip the ending character
+            Do not catch StopIteration
+            if outside_quotes is set to true, only stop on an item in chars if it is outside single quotes"""
+        if chars == None or chars == "":
+            return
+        contents = self.contents
+        start = pos = self.pos
+        length = self.length
+        if outside_quotes:
+            am_i_in_single_quotes = False
+            while pos < length:
+                n = contents[pos]
+                if n in chars and not am_i_in_single_quotes:
+                    break
+                if n == "'":
+                    am_i_in_single_quotes = not am_i_in_single_quotes
+                pos += 1
         else:
-            outputs_lst.append(str(i)+".txt:\n"+'\n'.join(output)+'\n')
-        i+=1
+            while pos < length and not contents[pos] in chars:
+                pos += 1
+        self.move_to(pos)
+        if pos >= length:
+            raise StopIteration
+        return contents[start:pos]
+
+    def peek_ch(self, skip_blanks=False):
+        """Peek at the next character without moving the cursor.
+            Return the peeked value
+            Do not catch StopIteration"""
+        contents = self.contents
+        pos = self.pos
+        if skip_blanks:
+            while pos < self.length and contents[pos].isspace():
+                pos += 1
+        if pos >= self.length:
+            raise StopIteration
+        return contents[pos]
+
+    def next_ch(self):
+        """Consume the character at the cursor
+            Do not catch StopIteration"""
+        pos = self.pos
+        if pos >= self.length:
+            raise StopIteration
+        n = self.contents[pos]
+        self.move_to(pos + 1)
+        return n
+
+    def add_error(self, message):
+        """Add the error message to the list of errors that will be returned by
+        this parser, unless dedupe is set and it was already added at the
+        cursor. Raise CursorParser.ErrorLimit once there are max_errors errors"""
+        if self.seen is not None:
+            key = (self.pos, message)
+            if key in self.seen:
+                return
+            self.seen.add(key)
+        self.error_list.append(message)
+        if self.max_errors is not None and len(self.error_list) >= self.max_errors:
+            raise CursorParser.ErrorLimit
+
+    def whats_left(self):
+        """debug function to see what's remaining after the cursor"""
+        return self.contents[self.pos:]
+
+def limit_errors(errors, max_errors=None):
+    """Return the list of the first max_errors messages in errors (an
+    iterable, which is read no further). This is what CursorParser's
+    max_errors does, for drivers that collect errors from several parsers"""
+    return list(itertools.islice(errors, max_errors))
+
+def format_result(name, errors):
+    """Format the errors found in the program file called name the way they
+    appear in parser_output.txt"""
+    if len(errors) == 0:
+        return name+":\n"+"Valid program\n"
+    return name+":\n"+'\n'.join(errors)+'\n'
+
+# main function
+# reads input files numbered 1.txt and up (or the files, directories and
+# glob patterns given on the command line), parses them on a pool of worker
+# processes and gives output to parser_output.txt
+# with --stream FILE, validates FILE (or stdin for "-") clause by clause and
+# prints each error as soon as it is found
+# with --profile REPORT, also writes how long each grammar routine took
+# with --mmap, parses the bytes of memory-mapped files
+# with --max-errors N (or --fail-fast for 1), stops parsing a file once N
+# errors have been found
+def main(argv=None) -> int:
+    argparser = argparse.ArgumentParser(description="Simplified Prolog parser")
+    argparser.add_argument('paths', nargs='*', metavar='PATH',
+                           help='program files, directories or glob patterns (default: 1.txt, 2.txt, ... up to the first missing number)')
+    argparser.add_argument('-j', '--jobs', type=int, default=None,
+                           help='number of worker processes (default: one per CPU)')
+    argparser.add_argument('-o', '--output', default='parser_output.txt',
+                           help='output file (default: parser_output.txt)')
+    argparser.add_argument('--pattern', default='[0-9]*.txt',
+                           help='files to parse in directories given as PATH (default: [0-9]*.txt)')
+    argparser.add_argument('--split', action='store_true',
+                           help='parse one file at a time, splitting each file at clause boundaries between the workers')
+    argparser.add_argument('--stream', metavar='FILE',
+                           help='validate FILE ("-" for stdin) in bounded memory, printing errors as they are found')
+    argparser.add_argument('--profile', metavar='REPORT',
+                           help='parse in this process with per-routine profiling and write the profile to REPORT as JSON')
+    argparser.add_argument('--cache', action='store_true',
+                           help='reuse the results of programs that have not changed since they were last parsed')
+    argparser.add_argument('--cache-db', default='.parser_cache.db', metavar='DB',
+                           help='database file for --cache (default: .parser_cache.db)')
+    argparser.add_argument('--cache-size', type=int, default=None, metavar='BYTES',
+                           help='largest size of the cache before old results are evicted (default: 64 MiB)')
+    argparser.add_argument('--mmap', action='store_true',
+                           help='memory-map each file and parse its bytes without reading it into memory; '
+                                'for very large files (line ends are read as they are, and --split is ignored)')
+    argparser.add_argument('--max-errors', type=int, default=None, metavar='N',
+                           help='stop parsing a file once N errors have been found')
+    argparser.add_argument('--fail-fast', action='store_true',
+                           help='stop parsing a file at its first error (same as --max-errors 1)')
+    argparser.add_argument('--dedupe', action='store_true',
+                           help='leave out an error reported again at the same place with the same message')
+    argparser.add_argument('--prescan', action='store_true',
+                           help='report files the pre-scan finds broken (see prescan.py) without parsing them; '
+                                'their entries give what the pre-scan found instead of the parser\'s errors')
+    argparser.add_argument('--shadow', metavar='ENGINE',
+                           choices=('cursor', 'packrat', 'stream', 'mapped', 'incremental', 'parallel'),
+                           help='parse in this process with the original parser and with ENGINE, write the '
+                                'original results and report the timings and any mismatch')
+    argparser.add_argument('--shadow-log', default='shadow_log.jsonl', metavar='FILE',
+                           help='file --shadow appends mismatches to (default: shadow_log.jsonl)')
+    argparser.add_argument('--watch', action='store_true',
+                           help='keep running and parse files again when they change, updating the output file')
+    argparser.add_argument('--interval', type=float, default=0.02, metavar='SECONDS',
+                           help='time between checks for changes with --watch (default: 0.02)')
+    argparser.add_argument('--debounce', type=float, default=0.04, metavar='SECONDS',
+                           help='time a changed file must stay unchanged before --watch parses it (default: 0.04)')
+    args = argparser.parse_args(argv)
+    if args.fail_fast:
+        args.max_errors = 1
+    if args.max_errors is not None and args.max_errors < 1:
+        argparser.error('--max-errors must be at least 1')
+    if args.stream is not None:
+        import streaming
+        return streaming.main([args.stream])
+    if args.watch:
+        import watch
+        return watch.Watcher(args.paths, args.output, args.pattern, args.interval, args.debounce,
+                             args.max_errors, args.dedupe).run()
+    import batch
+    if args.paths:
+        try:
+            paths = batch.expand_paths(args.paths, args.pattern)
+        except FileNotFoundError as e:
+            argparser.error(str(e))
+    else:
+        paths = batch.numbered_files()
+    if args.profile is not None:
+        import profiling
+        profiling.run_profiled(paths, args.output, args.profile)
+        return 0
+    if args.shadow is not None:
+        import shadow
+        result = shadow.run_shadow(paths, args.output, args.shadow, args.shadow_log)
+        print(result.summary(), file=sys.stderr)
+        return 1 if result.mismatches else 0
+    batch.run_batch(paths, args.output, args.jobs, args.split,
+                    args.cache_db if args.cache else None, args.cache_size, args.mmap,
+                    args.max_errors, args.dedupe, args.prescan)
+    return 0
 # end of main()
-if __name__=="__main__": exit(main())
\ No newline at end of file
+if __name__=="__main__": exit(main())
@@ -0,0 +1,189 @@
+# prescan.py
+# Whole-buffer checks that run before the parser
+"""Pre-scan of a program for quick rejection and clause segmentation.
+
+scan() looks at the whole program at once, without the grammar, and finds:
+    characters that are in no token of the grammar
+    whether the single quotes pair up
+    the lowest parenthesis depth and the depth at the end
+    whether there is a "?-" outside single quotes
+    the offsets just after each "." outside single quotes
+Any of the first four failing means the program has errors, so
+Scan.problems() can reject a file before it is parsed. The parser is still
+what finds the errors and their messages; the pre-scan only says that
+there are some. In a valid program every "." outside quotes ends a
+clause, so Scan.clause_ends are the clause boundaries, which
+ParallelParser uses to cut a program into pieces, and parser.py --prescan
+rejects files without parsing them.
+
+With NumPy installed, ASCII programs are scanned as a uint8 array: a
+lookup table classifies the bytes and cumulative sums give the quote
+parity and parenthesis depth at every offset. Without it, or for text
+that is not ASCII, the same results come from regular expressions and
+bytes methods."""
+import argparse
+import itertools
+import re
+import time
+from array import array
+
+import lexer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# characters that can appear in a program: <character>s, the punctuation
+# the grammar uses outside strings and blank space
+_ALLOWED = lexer.CHARACTER_CLASS[1:-1] + "(),'"
+_UNRECOGNIZED_RE = re.compile('[^\\s' + _ALLOWED + ']')
+_BYTES_UNRECOGNIZED_RE = re.compile(('[^' + lexer.ASCII_BLANK_CLASS[1:-1] + '\\n' + _ALLOWED + ']')
+                                    .encode('ascii'))
+_QUOTE_OR_PERIOD_RE = re.compile("['.]")
+_BYTES_QUOTE_OR_PERIOD_RE = re.compile(b"['.]")
+_QUERY_RE = re.compile(r'\?-')
+_BYTES_QUERY_RE = re.compile(rb'\?-')
+# "(" -> 1 and ")" -> -1 as signed bytes
+_PAREN_STEPS = bytes.maketrans(b'()', b'\x01\xff')
+
+if numpy is not None:
+    # byte -> 1 for the bytes _BYTES_UNRECOGNIZED_RE matches
+    _UNRECOGNIZED_TABLE = numpy.array([_BYTES_UNRECOGNIZED_RE.fullmatch(bytes([b])) is not None
+                                       for b in range(256)], dtype=numpy.bool_)
+    # byte -> change in parenthesis depth
+    _DEPTH_TABLE = numpy.zeros(256, dtype=numpy.int8)
+    _DEPTH_TABLE[ord('(')] = 1
+    _DEPTH_TABLE[ord(')')] = -1
+
+# most unrecognized characters a Scan keeps the offsets of
+MAX_UNRECOGNIZED = 100
+
+class Scan():
+    """Results of scan(); offsets are into the scanned text"""
+
+    def __init__(self, length):
+        self.length = length
+        # offsets of characters in no token, the first MAX_UNRECOGNIZED
+        self.unrecognized = []
+        self.quotes_balanced = True
+        self.min_depth = 0
+        self.final_depth = 0
+        self.has_query = False
+        # offsets just after each "." outside single quotes
+        self.clause_ends = array('q')
+
+    def problems(self):
+        """Return descriptions of what makes the program invalid, or an
+        empty list if the pre-scan found nothing"""
+        problems = []
+        if self.unrecognized:
+            problems.append('unrecognized character at offset ' + str(self.unrecognized[0]))
+        if not self.quotes_balanced:
+            problems.append('unbalanced single quotes')
+        if self.min_depth < 0:
+            problems.append('")" without a matching "("')
+        elif self.final_depth > 0:
+            problems.append('"(" without a matching ")"')
+        if not self.has_query:
+            problems.append('no "?-" query')
+        return problems
+
+def _ascii_bytes(contents):
+    """Return contents as ASCII bytes, or None if it is not ASCII"""
+    if isinstance(contents, str):
+        return contents.encode('ascii') if contents.isascii() else None
+    data = bytes(contents) if not isinstance(contents, bytes) else contents
+    return data if data.isascii() else None
+
+def scan(contents, vectorized=None):
+    """Return the Scan of contents, a str or bytes-like ASCII/UTF-8 text.
+    vectorized picks NumPy (True) or the fallback (False); by default
+    NumPy is used when it is installed"""
+    if vectorized is None:
+        vectorized = numpy is not None
+    data = _ascii_bytes(contents)
+    if vectorized and data is not None:
+        if numpy is None:
+            raise ImportError('the vectorized pre-scan needs NumPy')
+        return _scan_array(data)
+    if data is None and not isinstance(contents, str):
+        contents = str(contents, 'utf-8')
+    return _scan_text(data if data is not None else contents)
+
+def _scan_array(data):
+    result = Scan(len(data))
+    if not data:
+        return result
+    a = numpy.frombuffer(data, dtype=numpy.uint8)
+    result.unrecognized = numpy.flatnonzero(_UNRECOGNIZED_TABLE[a])[:MAX_UNRECOGNIZED].tolist()
+    quotes = a == ord("'")
+    # a byte is inside quotes when an odd number of quotes come before it
+    parity = numpy.cumsum(quotes, dtype=numpy.int64) & 1
+    result.quotes_balanced = not parity[-1]
+    outside = parity == 0
+    depth = numpy.cumsum(_DEPTH_TABLE[a], dtype=numpy.int64)
+    result.min_depth = min(0, int(depth.min()))
+    result.final_depth = int(depth[-1])
+    query = (a[:-1] == ord('?')) & (a[1:] == ord('-')) & outside[:-1]
+    result.has_query = bool(query.any())
+    ends = numpy.flatnonzero((a == ord('.')) & outside) + 1
+    result.clause_ends = array('q', ends.astype(numpy.int64).tobytes())
+    return result
+
+def _scan_text(text):
+    """The fallback scan, of ASCII bytes or a str"""
+    result = Scan(len(text))
+    is_bytes = isinstance(text, bytes)
+    unrecognized_re = _BYTES_UNRECOGNIZED_RE if is_bytes else _UNRECOGNIZED_RE
+    result.unrecognized = [m.start() for m in itertools.islice(unrecognized_re.finditer(text),
+                                                                 MAX_UNRECOGNIZED)]
+    quote = b"'" if is_bytes else "'"
+    result.quotes_balanced = text.count(quote) % 2 == 0
+    # the parentheses alone, in order, as 1 and -1 for their running depth
+    parens = text if is_bytes else text.encode('utf-8', 'surrogatepass')
+    parens = array('b', re.sub(rb'[^()]+', b'', parens).translate(_PAREN_STEPS))
+    result.final_depth = sum(parens)
+    if parens:
+        result.min_depth = min(0, min(itertools.accumulate(parens)))
+    pattern = _BYTES_QUOTE_OR_PERIOD_RE if is_bytes else _QUOTE_OR_PERIOD_RE
+    query_re = _BYTES_QUERY_RE if is_bytes else _QUERY_RE
+    # quotes before the "?-"s, counted from one to the next
+    counted = quotes = 0
+    for m in query_re.finditer(text):
+        quotes += text.count(quote, counted, m.start())
+        counted = m.start()
+        if quotes % 2 == 0:
+            result.has_query = True
+            break
+    ends = result.clause_ends
+    in_quotes = False
+    for m in pattern.finditer(text):
+        if m.group() == quote:
+            in_quotes = not in_quotes
+        elif not in_quotes:
+            ends.append(m.end())
+    return result
+
+def main(argv=None) -> int:
+    argparser = argparse.ArgumentParser(description="Pre-scan programs for errors found without parsing")
+    argparser.add_argument('programs', nargs='+', metavar='FILE', help='program files')
+    argparser.add_argument('--fallback', action='store_true', help='do not use NumPy')
+    args = argparser.parse_args(argv)
+    rejected = 0
+    for path in args.programs:
+        with open(path, 'rb') as f:
+            data = f.read()
+        start = time.perf_counter()
+        result = scan(data, False if args.fallback else None)
+        elapsed = time.perf_counter() - start
+        problems = result.problems()
+        per_kb = elapsed * 1e6 / max(1, len(data) / 1024)
+        if problems:
+            rejected += 1
+            print(path + ': rejected: ' + '; '.join(problems) + f' ({per_kb:.1f} us/KB)')
+        else:
+            print(path + f': {len(result.clause_ends)} clause ends ({per_kb:.1f} us/KB)')
+    return 1 if rejected else 0
+
+if __name__=="__main__": exit(main())
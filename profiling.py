@@ -0,0 +1,213 @@
+# profiling.py
+# Per-production profiling of the parsers
+"""Opt-in instrumentation of the grammar routines.
+
+instrument(cls) returns a subclass of a parser class whose grammar routines
+record, per routine: how often it was called, its total time (counted once
+for recursive calls) and self time (without the routines it called), how
+many times it backtracked, how many characters it copied to make backtrack
+points, and the deepest call depth at which it ran. The parser classes
+themselves are not touched, so parsing without the instrumentation costs
+nothing extra.
+
+Parser backtracks by copying the rest of the program into a string
+(''.join(self.program_gen)) and later restoring self.program_gen from it;
+the instrumented class sees every assignment to self.program_gen. A string
+iterator that replaces one the join has used up is a copy of the length
+operator.length_hint() gives, and any other string iterator is a restore.
+A restore made after the program was read to its end therefore counts as
+a copy. CursorParser backtracks with reset() and copies nothing."""
+import argparse
+import json
+import operator
+import time
+
+from parser import Parser, CursorParser, header, format_result
+
+# the routines that are timed, when the class has them
+GRAMMAR_ROUTINES = ('program', 'clause_list', 'clause', 'query', 'predicate_list', 'predicate',
+                    'term_list', 'term', 'structure', 'structure_head', 'term_list_tail', 'atom',
+                    'small_atom', 'variable', 'character_list', 'alphanumeric', 'lowercase_char',
+                    'uppercase_char', 'numeral', 'digit', 'string', 'character', 'special')
+
+ENGINES = {
+    'cursor': CursorParser,
+    'reference': Parser,
+}
+
+class RoutineStats():
+    """Counters for one grammar routine"""
+    __slots__ = ('calls', 'total', 'self_time', 'backtracks', 'chars_copied', 'max_depth', 'active')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.self_time = 0.0
+        self.backtracks = 0
+        self.chars_copied = 0
+        self.max_depth = 0
+        # calls of the routine that have not returned yet
+        self.active = 0
+
+    def report(self):
+        return {'calls': self.calls, 'total_seconds': self.total, 'self_seconds': self.self_time,
+                'backtracks': self.backtracks, 'chars_copied': self.chars_copied,
+                'max_depth': self.max_depth}
+
+class Profile():
+    """What an instrumented parser has recorded"""
+
+    def __init__(self):
+        self.stats = {}
+        # one [stats, time spent in callees] per running routine
+        self.stack = []
+        self.max_depth = 0
+        # the string iterator self.program_gen was last set to
+        self.base = None
+        # counts for work done outside any routine
+        self.outside = RoutineStats()
+
+    def current(self):
+        """Return the stats of the running routine"""
+        return self.stack[-1][0] if self.stack else self.outside
+
+    def report(self):
+        """Return the profile as a dict that can be written as JSON"""
+        routines = {name: stats.report() for name, stats in self.stats.items() if stats.calls}
+        return {
+            'routines': routines,
+            'max_depth': self.max_depth,
+            'backtracks': sum(r['backtracks'] for r in routines.values()) + self.outside.backtracks,
+            'chars_copied': sum(r['chars_copied'] for r in routines.values()) + self.outside.chars_copied,
+        }
+
+def _timed(name, method):
+    """Return method wrapped to record its calls in self.profile"""
+    def routine(self, *args, **kwargs):
+        profile = self.profile
+        stats = profile.stats[name]
+        stack = profile.stack
+        frame = [stats, 0.0]
+        stack.append(frame)
+        depth = len(stack)
+        if depth > stats.max_depth:
+            stats.max_depth = depth
+            if depth > profile.max_depth:
+                profile.max_depth = depth
+        stats.active += 1
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            stats.active -= 1
+            stats.calls += 1
+            stats.self_time += elapsed - frame[1]
+            if stats.active == 0:
+                stats.total += elapsed
+            if stack:
+                stack[-1][1] += elapsed
+    routine.__name__ = name
+    routine.__doc__ = method.__doc__
+    return routine
+
+def _get_program_gen(self):
+    return self.__dict__['program_gen']
+
+def _set_program_gen(self, gen):
+    self.__dict__['program_gen'] = gen
+    profile = self.__dict__.get('profile')
+    if profile is None or type(gen) is not _STR_ITERATOR:
+        return
+    # a backtrack point is made as iter(''.join(self.program_gen)), which
+    # uses up the iterator (perhaps behind itertools.chain()s of peeked
+    # characters) that the last string iterator was
+    if profile.base is not None and operator.length_hint(profile.base) == 0:
+        profile.current().chars_copied += operator.length_hint(gen)
+    else:
+        profile.current().backtracks += 1
+    profile.base = gen
+
+_STR_ITERATOR = type(iter(''))
+
+def _reset(self, backup):
+    self.profile.current().backtracks += 1
+    CursorParser.reset(self, backup)
+
+def instrument(cls):
+    """Return a subclass of the parser class cls whose grammar routines are
+    profiled. Its instances have a profile attribute (a Profile)"""
+    namespace = {'program_gen': property(_get_program_gen, _set_program_gen)}
+    routines = [name for name in GRAMMAR_ROUTINES if hasattr(cls, name)]
+    for name in routines:
+        namespace[name] = _timed(name, getattr(cls, name))
+    if issubclass(cls, CursorParser):
+        namespace['reset'] = _reset
+
+    def __init__(self, cont):
+        cls.__init__(self, cont)
+        # created after cls.__init__(), which sets self.program_gen to the
+        # whole program without copying it
+        self.profile = Profile()
+        gen = self.__dict__.get('program_gen')
+        if type(gen) is _STR_ITERATOR:
+            self.profile.base = gen
+        for name in routines:
+            self.profile.stats[name] = RoutineStats()
+    namespace['__init__'] = __init__
+    return type('Profiled' + cls.__name__, (cls,), namespace)
+
+def profile(contents, engine=CursorParser):
+    """Parse contents with an instrumented engine (a parser class).
+    Return (errors, report) where report is Profile.report() with the total
+    time added"""
+    parser = instrument(engine)(contents)
+    start = time.perf_counter()
+    errors = parser.parse()
+    report = parser.profile.report()
+    report['total_seconds'] = time.perf_counter() - start
+    report['bytes'] = len(contents)
+    return errors, report
+
+def run_profiled(paths, ofilename, report_file, engine=CursorParser):
+    """Parse the files in paths in this process with an instrumented engine,
+    write the results to ofilename as batch.run_batch() does and the
+    profiles to report_file as JSON.
+    Return the number of invalid programs"""
+    invalid = 0
+    reports = []
+    with open(ofilename, 'w') as out:
+        out.write(ofilename + header)
+        for i, path in enumerate(paths):
+            with open(path, 'r') as f:
+                contents = f.read()
+            errors, report = profile(contents, engine)
+            report['path'] = path
+            reports.append(report)
+            if i > 0:
+                out.write('\n')
+            out.write(format_result(path, errors))
+            if errors:
+                invalid += 1
+    with open(report_file, 'w') as f:
+        json.dump({'engine': engine.__name__, 'files': reports}, f, indent=1)
+        f.write('\n')
+    return invalid
+
+def main(argv=None) -> int:
+    """Profile one program and print the report"""
+    argparser = argparse.ArgumentParser(description="Profile the parser's grammar routines on a program")
+    argparser.add_argument('path', metavar='PATH')
+    argparser.add_argument('--engine', choices=sorted(ENGINES), default='cursor',
+                           help='parser to profile (default: cursor)')
+    args = argparser.parse_args(argv)
+    with open(args.path, 'r') as f:
+        contents = f.read()
+    errors, report = profile(contents, ENGINES[args.engine])
+    report['path'] = args.path
+    report['errors'] = len(errors)
+    print(json.dumps(report, indent=1))
+    return 0
+
+if __name__=="__main__": exit(main())
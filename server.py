@@ -0,0 +1,341 @@
+# server.py
+# Long-running validation server
+"""Validate programs sent over a socket by a pool of warm worker processes.
+
+The server listens on a Unix socket or on local TCP. A connection sends
+requests in one of two framings, told apart by its first byte that is
+not blank space (the length prefix of a request of at most MAX_REQUEST
+bytes starts with a byte below 5, which is never blank):
+    JSON lines -- each request is a JSON object on one line,
+        {"id": ..., "program": "...", "max_errors": N, "dedupe": true}
+        where everything but "program" may be left out, and each response
+        is a JSON object on one line,
+        {"id": ..., "valid": true/false, "errors": [...]}
+        or {"id": ..., "error": "..."} for a bad request
+    length-prefixed -- each request is a 4-byte big-endian length and that
+        many bytes of UTF-8 program text, and each response is a 4-byte
+        length and a JSON object {"valid": ..., "errors": [...]}
+A connection may send many requests without waiting for the responses;
+they come back in the order the requests were sent. "errors" is the list
+CursorParser(program).parse() gives.
+
+Parsing runs on a process pool whose workers have imported the parser and
+parsed a program once before the first request. Requests go through a
+bounded queue: while every worker is busy, the requests that arrive wait
+in the queue and the next free worker gets all of them (up to batch_size)
+as one task, so small programs cost one round trip to a worker per batch
+rather than per program. When the queue is full, the server stops reading
+from connections until there is room, which pushes back on the clients.
+If a worker dies (killed, or out of memory), the requests of the batch it
+was parsing get an "error" response and a new pool takes over."""
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import os
+import signal
+import struct
+
+from parser import CursorParser
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 7878
+BATCH_SIZE = 64
+QUEUE_SIZE = 1024
+# requests of one connection that may wait for their responses
+PIPELINE_DEPTH = 256
+# programs this big are parsed in a batch of their own
+LARGE_PROGRAM = 1 << 16
+MAX_REQUEST = 64 << 20
+
+_LENGTH = struct.Struct('>I')
+
+def _warm():
+    """Initializer of the worker processes"""
+    CursorParser('p(a).\n?- p(X).\n').parse()
+
+def parse_batch(requests):
+    """Return the error lists of the (program, max_errors, dedupe) requests.
+    Runs in a worker process"""
+    return [CursorParser(program, max_errors=max_errors, dedupe=dedupe).parse()
+            for program, max_errors, dedupe in requests]
+
+class BadRequest(Exception):
+    """A request that cannot be parsed"""
+
+def read_request(line):
+    """Return (id, (program, max_errors, dedupe)) for a JSON request line"""
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        raise BadRequest('invalid JSON: ' + str(e))
+    if not isinstance(request, dict) or not isinstance(request.get('program'), str):
+        raise BadRequest('a request is an object with a "program" string')
+    max_errors = request.get('max_errors')
+    if max_errors is not None and (not isinstance(max_errors, int) or isinstance(max_errors, bool)
+                                   or max_errors < 1):
+        raise BadRequest('"max_errors" must be a positive integer')
+    return request.get('id'), (request['program'], max_errors, bool(request.get('dedupe')))
+
+class ValidationServer():
+    """Server state: the worker pool, the request queue and counters.
+    Usage: asyncio.run(ValidationServer(jobs).serve_tcp(host, port))"""
+
+    def __init__(self, jobs=None, batch_size=BATCH_SIZE, queue_size=QUEUE_SIZE):
+        self.jobs = jobs or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.executor = None
+        self.queue = None
+        self.requests = 0
+        self.batches = 0
+        # pools started again after a worker died
+        self.restarts = 0
+
+    async def start(self):
+        """Start the workers and the dispatcher"""
+        loop = asyncio.get_running_loop()
+        self.executor = self.new_executor()
+        # start every worker now rather than on the first requests
+        await asyncio.gather(*(loop.run_in_executor(self.executor, _warm) for _ in range(self.jobs)))
+        self.queue = asyncio.Queue(self.queue_size)
+        # one batch per worker is parsed while the next ones are collected
+        self.slots = asyncio.Semaphore(self.jobs)
+        self.dispatcher = asyncio.create_task(self.dispatch())
+
+    def new_executor(self):
+        return concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs, initializer=_warm)
+
+    def replace_executor(self, broken):
+        """Start a new pool in place of broken, one whose worker died; the
+            batches it had are failed by finish()"""
+        if self.executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = self.new_executor()
+            self.restarts += 1
+
+    def close(self):
+        self.dispatcher.cancel()
+        self.executor.shutdown(cancel_futures=True)
+
+    async def submit(self, request):
+        """Queue a (program, max_errors, dedupe) request; waits while the
+        queue is full. Return a future for its error list"""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future))
+        self.requests += 1
+        return future
+
+    async def dispatch(self):
+        """Hand the queued requests to the workers in batches"""
+        loop = asyncio.get_running_loop()
+        while True:
+            # wait for a free worker first: the requests that come in
+            # meanwhile make up the next batch
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            size = len(batch[0][0][0])
+            while len(batch) < self.batch_size and size < LARGE_PROGRAM and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                size += len(batch[-1][0][0])
+            self.batches += 1
+            requests = [request for request, future in batch]
+            executor = self.executor
+            try:
+                task = loop.run_in_executor(executor, parse_batch, requests)
+            except concurrent.futures.BrokenExecutor:
+                # a worker died since the last batch was handed out; this
+                # batch never reached it, so it goes to a new pool
+                self.replace_executor(executor)
+                executor = self.executor
+                try:
+                    task = loop.run_in_executor(executor, parse_batch, requests)
+                except concurrent.futures.BrokenExecutor as e:
+                    task = loop.create_future()
+                    task.set_exception(e)
+            task.add_done_callback(lambda task, batch=batch, executor=executor: self.finish(task, batch, executor))
+
+    def finish(self, task, batch, executor):
+        """Give each request of a parsed batch its result"""
+        self.slots.release()
+        if task.cancelled():
+            return
+        error = task.exception()
+        if isinstance(error, concurrent.futures.BrokenExecutor):
+            # a worker died (killed, or out of memory) while parsing
+            self.replace_executor(executor)
+        for i, (request, future) in enumerate(batch):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(task.result()[i])
+
+    async def handle(self, reader, writer):
+        """Serve one connection"""
+        pending = asyncio.Queue(PIPELINE_DEPTH)
+        responder = None
+        try:
+            first = await reader.read(1)
+            # JSON lines may start with blank lines or spaces
+            while first.isspace():
+                first = await reader.read(1)
+            if not first:
+                return
+            if first == b'{':
+                responder = asyncio.create_task(self.respond(pending, writer, _json_line))
+                await self.read_json(first, reader, pending)
+            else:
+                responder = asyncio.create_task(self.respond(pending, writer, _length_prefixed))
+                await self.read_length_prefixed(first, reader, pending)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if responder is not None:
+                await pending.put(None)
+                try:
+                    await responder
+                except ConnectionError:
+                    pass
+            writer.close()
+
+    async def read_json(self, first, reader, pending):
+        line = await _read_line(reader)
+        if line is not None:
+            line = first + line
+        while line != b'':
+            if line is None:
+                await pending.put((None, None, 'request longer than ' + str(MAX_REQUEST) + ' bytes'))
+            elif line.strip():
+                try:
+                    rid, request = read_request(line)
+                except BadRequest as e:
+                    await pending.put((None, None, str(e)))
+                else:
+                    await pending.put((rid, await self.submit(request), None))
+            line = await _read_line(reader)
+
+    async def read_length_prefixed(self, first, reader, pending):
+        header = first + await reader.readexactly(_LENGTH.size - 1)
+        while True:
+            length = _LENGTH.unpack(header)[0]
+            if length > MAX_REQUEST:
+                await pending.put((None, None, 'request longer than ' + str(MAX_REQUEST) + ' bytes'))
+                return
+            try:
+                program = (await reader.readexactly(length)).decode('utf-8')
+            except UnicodeDecodeError as e:
+                await pending.put((None, None, 'program is not UTF-8: ' + str(e)))
+            else:
+                await pending.put((None, await self.submit((program, None, False)), None))
+            header = await reader.read(_LENGTH.size)
+            if not header:
+                return
+            if len(header) < _LENGTH.size:
+                header += await reader.readexactly(_LENGTH.size - len(header))
+
+    async def respond(self, pending, writer, encode):
+        """Write the responses of a connection in the order of its requests"""
+        while True:
+            item = await pending.get()
+            if item is None:
+                await writer.drain()
+                return
+            rid, future, problem = item
+            if future is not None:
+                try:
+                    errors = await future
+                    response = {'id': rid, 'valid': not errors, 'errors': errors}
+                except Exception as e:
+                    response = {'id': rid, 'error': 'parser failed: ' + repr(e)}
+            else:
+                response = {'id': rid, 'error': problem}
+            writer.write(encode(response))
+            if pending.empty():
+                await writer.drain()
+
+    async def serve(self, server):
+        """Run an asyncio server made with self.handle until it is stopped"""
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stop.cancel)
+            except (NotImplementedError, RuntimeError):
+                pass
+        async with server:
+            try:
+                await stop
+            except asyncio.CancelledError:
+                pass
+        self.close()
+
+    async def serve_tcp(self, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+        await self.start()
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_REQUEST)
+        if ready is not None:
+            ready(server)
+        await self.serve(server)
+
+    async def serve_unix(self, path, ready=None):
+        await self.start()
+        if os.path.exists(path):
+            os.unlink(path)
+        server = await asyncio.start_unix_server(self.handle, path, limit=MAX_REQUEST)
+        if ready is not None:
+            ready(server)
+        try:
+            await self.serve(server)
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+
+async def _read_line(reader):
+    """Return the next line of reader, b'' at the end, or None for a line
+    longer than the reader's limit, which is skipped"""
+    try:
+        return await reader.readuntil(b'\n')
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError:
+        pass
+    while True:
+        try:
+            await reader.readuntil(b'\n')
+            return None
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError as e:
+            # drop what was looked at without finding the end of the line
+            await reader.readexactly(e.consumed)
+
+def _json_line(response):
+    return json.dumps(response).encode('utf-8') + b'\n'
+
+def _length_prefixed(response):
+    body = json.dumps({key: value for key, value in response.items() if key != 'id'}).encode('utf-8')
+    return _LENGTH.pack(len(body)) + body
+
+def main(argv=None) -> int:
+    argparser = argparse.ArgumentParser(description="Serve program validation over a socket")
+    argparser.add_argument('--unix', metavar='PATH', help='listen on this Unix socket instead of TCP')
+    argparser.add_argument('--host', default=DEFAULT_HOST, help='TCP address (default: 127.0.0.1)')
+    argparser.add_argument('--port', type=int, default=DEFAULT_PORT, help='TCP port (default: 7878)')
+    argparser.add_argument('-j', '--jobs', type=int, default=None,
+                           help='number of worker processes (default: one per CPU)')
+    argparser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                           help='most requests parsed by a worker at once (default: 64)')
+    argparser.add_argument('--queue-size', type=int, default=QUEUE_SIZE,
+                           help='requests that may wait for a worker before reading stops (default: 1024)')
+    args = argparser.parse_args(argv)
+    server = ValidationServer(args.jobs, args.batch_size, args.queue_size)
+    def ready(listener):
+        print('listening on', ', '.join(str(s.getsockname()) for s in listener.sockets), flush=True)
+    if args.unix:
+        asyncio.run(server.serve_unix(args.unix, ready))
+    else:
+        asyncio.run(server.serve_tcp(args.host, args.port, ready))
+    return 0
+
+if __name__=="__main__": exit(main())
@@ -0,0 +1,294 @@
+# shadow.py
+# Run the reference parser alongside a fast engine and compare them
+"""Shadow mode and differential testing for the parsing engines.
+
+Shadow.parse() parses a program with the original Parser and with one of
+the fast engines, times both and compares the error lists. The reference
+result is the one that is used, so turning shadow mode on changes nothing
+but the time taken. A mismatch is written to the log as one JSON object
+per line, with both results and a minimized program that still shows the
+difference (see minimize()).
+
+run_shadow() does this for the files of a batch and writes the reference
+results to the output file the way batch.run_batch() does;
+`parser.py --shadow ENGINE` uses it. `python3 shadow.py --fuzz N` runs the
+same comparison over generated programs: valid ones from bench.generate(),
+ones with errors in some clauses, and ones with random edits."""
+import argparse
+import io
+import json
+import math
+import random
+import time
+
+import bench
+from parser import Parser, CursorParser, header, format_result
+
+DEFAULT_LOG = 'shadow_log.jsonl'
+# most programs minimize() parses while shrinking one
+MAX_TESTS = 2000
+
+def _cursor(text):
+    return CursorParser(text).parse()
+
+def _packrat(text):
+    from packrat import PackratParser
+    return PackratParser(text).parse()
+
+def _stream(text):
+    from streaming import StreamParser
+    return list(StreamParser(io.StringIO(text)).errors())
+
+def _mapped(text):
+    import mapped
+    return mapped.validate(text.encode('utf-8'))
+
+def _incremental(text):
+    import incremental
+    return incremental.Document(text).errors()
+
+def _parallel(text):
+    from parallel import ParallelParser
+    return ParallelParser(text, 2).parse()
+
+# name -> function from a program to its error list
+ENGINES = {
+    'cursor': _cursor,
+    'packrat': _packrat,
+    'stream': _stream,
+    'mapped': _mapped,
+    'incremental': _incremental,
+    'parallel': _parallel,
+}
+
+def reference(text):
+    return Parser(text).parse()
+
+def outcome(engine, text):
+    """Return (result, seconds): result is the error list engine gives for
+    text, or the name of the exception it raised"""
+    start = time.perf_counter()
+    try:
+        result = engine(text)
+    except Exception as e:
+        result = type(e).__name__
+    return result, time.perf_counter() - start
+
+class ShadowResult():
+    """The two outcomes for one program; reference and fast are error
+    lists or exception names"""
+
+    def __init__(self, reference, fast, reference_time, fast_time):
+        self.reference = reference
+        self.fast = fast
+        self.reference_time = reference_time
+        self.fast_time = fast_time
+
+    @property
+    def matched(self):
+        return self.reference == self.fast
+
+    @property
+    def undecided(self):
+        """The reference parser ran out of stack, so there is nothing to
+        compare with"""
+        return self.reference == 'RecursionError'
+
+def minimize(text, differs, max_tests=MAX_TESTS):
+    """Return a part of text for which differs(part) is still True, found
+    by removing lines and then characters (delta debugging) while that
+    holds, trying at most max_tests parts"""
+    tests = [0]
+    def test(items):
+        if tests[0] >= max_tests:
+            return False
+        tests[0] += 1
+        return differs(''.join(items))
+    lines = _ddmin(text.splitlines(keepends=True), test)
+    return ''.join(_ddmin(list(''.join(lines)), test))
+
+def _ddmin(items, test):
+    """Remove chunks of items while test(rest) holds, halving the chunks
+    when no chunk can go"""
+    chunks = 2
+    while len(items) >= 2:
+        size = math.ceil(len(items) / chunks)
+        for start in range(0, len(items), size):
+            rest = items[:start] + items[start+size:]
+            if test(rest):
+                items = rest
+                chunks = max(chunks - 1, 2)
+                break
+        else:
+            if chunks >= len(items):
+                break
+            chunks = min(len(items), chunks * 2)
+    if len(items) == 1 and test([]):
+        return []
+    return items
+
+class Shadow():
+    """Compares the reference parser with a fast engine and keeps the
+    timings. Mismatches are appended to the log file at log_path (no log
+    if None).
+    Usage:
+        shadow = Shadow('cursor', 'shadow_log.jsonl')
+        errors = shadow.parse(text)
+        print(shadow.summary())"""
+
+    def __init__(self, engine='cursor', log_path=DEFAULT_LOG, minimize_repros=True):
+        self.name = engine
+        self.engine = ENGINES[engine]
+        self.log_path = log_path
+        self.minimize_repros = minimize_repros
+        self.reference_times = []
+        self.fast_times = []
+        self.mismatches = 0
+        self.undecided = 0
+
+    def compare(self, text):
+        """Return the ShadowResult of text"""
+        reference_result, reference_time = outcome(reference, text)
+        fast_result, fast_time = outcome(self.engine, text)
+        return ShadowResult(reference_result, fast_result, reference_time, fast_time)
+
+    def differs(self, text):
+        result = self.compare(text)
+        return not result.matched and not result.undecided
+
+    def check(self, text, source=None):
+        """Compare the engines on text, record the timings and log a
+        mismatch; source names the program in the log. Return the
+        ShadowResult"""
+        result = self.compare(text)
+        if result.undecided:
+            self.undecided += 1
+        else:
+            self.reference_times.append(result.reference_time)
+            self.fast_times.append(result.fast_time)
+            if not result.matched:
+                self.mismatches += 1
+                self.log(text, result, source)
+        return result
+
+    def parse(self, text, source=None):
+        """Return the reference error list of text after check(). An
+        exception of the reference parser is raised again"""
+        result = self.check(text, source)
+        if isinstance(result.reference, str):
+            # the reference parser raised; do it again for the traceback
+            return reference(text)
+        return result.reference
+
+    def log(self, text, result, source):
+        if self.log_path is None:
+            return
+        record = {
+            'time': time.time(),
+            'source': source,
+            'engine': self.name,
+            'length': len(text),
+            'reference': result.reference,
+            'fast': result.fast,
+            'reference_ms': result.reference_time * 1000,
+            'fast_ms': result.fast_time * 1000,
+        }
+        if self.minimize_repros:
+            repro = minimize(text, self.differs)
+            repro_result = self.compare(repro)
+            record['repro'] = repro
+            record['repro_reference'] = repro_result.reference
+            record['repro_fast'] = repro_result.fast
+        else:
+            record['program'] = text
+        with open(self.log_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def summary(self):
+        """Return a line with the counts, the total times and the speedup"""
+        compared = len(self.reference_times)
+        reference_total = sum(self.reference_times)
+        fast_total = sum(self.fast_times)
+        speedup = reference_total / fast_total if fast_total > 0 else float('inf')
+        text = (f'{compared} programs compared with {self.name}: {self.mismatches} mismatches; '
+                f'reference {reference_total * 1000:.1f} ms, {self.name} {fast_total * 1000:.1f} ms, '
+                f'{speedup:.2f}x')
+        if compared:
+            text += (f'; {self.name} latency p50 {_percentile(self.fast_times, 50) * 1000:.2f} ms, '
+                     f'p99 {_percentile(self.fast_times, 99) * 1000:.2f} ms')
+        if self.undecided:
+            text += f'; {self.undecided} too deep for the reference parser'
+        return text
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+def run_shadow(paths, ofilename, engine='cursor', log_path=DEFAULT_LOG):
+    """Parse the files in paths in this process with the reference parser
+    and engine, write the reference results to ofilename as
+    batch.run_batch() does and log mismatches to log_path.
+    Return the Shadow, for its summary()"""
+    shadow = Shadow(engine, log_path)
+    with open(ofilename, 'w') as out:
+        out.write(ofilename + header)
+        for i, path in enumerate(paths):
+            with open(path, 'r') as f:
+                contents = f.read()
+            errors = shadow.parse(contents, path)
+            if i > 0:
+                out.write('\n')
+            out.write(format_result(path, errors))
+    return shadow
+
+# pieces of programs for the random edits
+_EDITS = ['x', 'X', '_', '0', "'", "'a b'", '(', ')', ',', '.', ':-', '?-', '?', ':', '-', ' ', '\n', '\t',
+          '[', '|', '*', '#', 'é', 'f(g(X))']
+
+def generate(rng):
+    """Return a random program: valid, with errors in some clauses, or
+    with random edits"""
+    kind = rng.random()
+    text = bench.generate(rng.randrange(1 << 30), clauses=rng.randint(0, 12), depth=rng.randint(0, 4),
+                          width=rng.randint(1, 4), string_length=rng.randint(1, 8),
+                          error_rate=0.0 if kind < 0.3 else rng.choice((0.0, 0.2, 0.5)))
+    if kind >= 0.6:
+        chars = list(text)
+        for _ in range(rng.randint(1, 6)):
+            i = rng.randint(0, len(chars))
+            r = rng.random()
+            if r < 0.4 and chars:
+                del chars[min(i, len(chars) - 1)]
+            elif r < 0.8:
+                chars.insert(i, rng.choice(_EDITS))
+            else:
+                del chars[i:]
+        text = ''.join(chars)
+    return text
+
+def fuzz(shadow, count=1000, seed=0):
+    """Compare the engines of shadow on count generated programs"""
+    rng = random.Random(seed)
+    for i in range(count):
+        shadow.check(generate(rng), 'fuzz seed ' + str(seed) + ' program ' + str(i))
+
+def main(argv=None) -> int:
+    argparser = argparse.ArgumentParser(description="Compare a fast parsing engine with the reference parser")
+    argparser.add_argument('paths', nargs='*', metavar='PATH', help='program files to compare on')
+    argparser.add_argument('--engine', choices=sorted(ENGINES), default='cursor',
+                           help='engine to compare (default: cursor)')
+    argparser.add_argument('--fuzz', type=int, default=0, metavar='N',
+                           help='also compare on N generated programs')
+    argparser.add_argument('--seed', type=int, default=0, help='seed of the generated programs')
+    argparser.add_argument('--log', default=DEFAULT_LOG,
+                           help='file to append mismatches to (default: shadow_log.jsonl)')
+    args = argparser.parse_args(argv)
+    shadow = Shadow(args.engine, args.log)
+    for path in args.paths:
+        with open(path, 'r') as f:
+            shadow.check(f.read(), path)
+    fuzz(shadow, args.fuzz, args.seed)
+    print(shadow.summary())
+    return 1 if shadow.mismatches else 0
+
+if __name__=="__main__": exit(main())
@@ -0,0 +1,470 @@
+# solve.py
+# Answer the query of a valid program by SLD resolution
+"""Query evaluation for valid programs.
+
+Solver(program) takes the tree.Program of a valid program (from
+CursorParser(text).parse(tree=True)) and Solver.solutions() answers its
+<query> the way Prolog does: goals left to right, clauses in program order,
+backtracking into the next clause when a goal fails. Solutions come from a
+generator, so the first one is found without looking for the others, and
+each is a dict from the query's variable names to the text of their values.
+
+The resolution loop does not recurse: the goals still to prove are a linked
+list of (goal, environment, rest) cells and the alternatives left to try
+are a stack of choice points, so proofs can be as deep as memory allows.
+Terms are never copied. A clause's variables are slots in an environment,
+a list made for each use of the clause, and a binding is the (term,
+environment) pair the slot is bound to; the trail records the slots bound
+since the oldest choice point so that backtracking can unbind them.
+Unification keeps its own stack too, and there is no occurs check.
+
+Clauses are selected by name/arity and then by the first argument of the
+goal: an atom, numeral or structure there only tries the clauses whose
+first argument is the same constant or functor, or a variable, and a goal
+with a single candidate clause leaves no choice point behind. A clause is
+turned into terms the first time a goal tries it, so a goal that selects
+a few clauses of a large program only pays for those; with a
+compiled.CompiledProgram the index itself is read from the compiled file.
+The number of goals resolved is kept in Solver.inferences."""
+import argparse
+import heapq
+import re
+import sys
+import time
+
+import compiled
+from tree import Atom, Numeral, Variable, Structure
+
+# atoms written without quotes
+_PLAIN_ATOM_RE = re.compile(r'[a-z][A-Za-z0-9_]*')
+
+class Slot():
+    """A variable of a clause or of the query: its index in the environment"""
+    __slots__ = ('index', 'name')
+
+    def __init__(self, index, name):
+        self.index = index
+        self.name = name
+
+class Struct():
+    """A structure or a goal with arguments; atoms are strs and numerals ints"""
+    __slots__ = ('name', 'args')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+class Clause():
+    """A clause ready for resolution: the arguments of its head, its body
+    goals and the number of variables in it"""
+    __slots__ = ('args', 'body', 'size', 'line')
+
+    def __init__(self, args, body, size, line):
+        self.args = args
+        self.body = body
+        self.size = size
+        self.line = line
+
+def _first_key(term):
+    """Index key of a first argument: the atom, the numeral, (name, arity)
+    of a structure, or None for a variable"""
+    if type(term) is Struct:
+        return term.name, len(term.args)
+    if type(term) is Slot:
+        return None
+    return term
+
+def _node_key(node):
+    """_first_key() of the tree node of a first argument"""
+    if isinstance(node, Structure):
+        return node.functor.name, len(node.args)
+    if isinstance(node, Atom):
+        return node.name
+    if isinstance(node, Numeral):
+        return node.value
+    return None
+
+class _TreeProcedure():
+    """The clause numbers of a name/arity of a tree.Program, with their
+    first-argument index; see compiled.CompiledProcedure"""
+    __slots__ = ('all', 'variable_numbers', 'by_key')
+
+    def __init__(self):
+        self.all = []
+        self.variable_numbers = []
+        # first-argument key -> numbers of the clauses with that key
+        self.by_key = {}
+
+    def add(self, number, args):
+        self.all.append(number)
+        key = _node_key(args[0]) if args else None
+        if key is None:
+            self.variable_numbers.append(number)
+        else:
+            self.by_key.setdefault(key, []).append(number)
+
+    def numbers(self):
+        return self.all
+
+    def variables(self):
+        return self.variable_numbers
+
+    def keyed(self, key):
+        return self.by_key.get(key)
+
+def _tree_procedures(clauses):
+    """Return {(name, arity): _TreeProcedure} for the clauses of a
+    tree.Program"""
+    procedures = {}
+    for number, node in enumerate(clauses):
+        head = node.head
+        procedure = procedures.get((head.functor.name, len(head.args)))
+        if procedure is None:
+            procedure = procedures[(head.functor.name, len(head.args))] = _TreeProcedure()
+        procedure.add(number, head.args)
+    return procedures
+
+class Procedure():
+    """The clauses of a name/arity. index gives their numbers and
+    first-argument index (a _TreeProcedure or compiled.CompiledProcedure)
+    and solver builds the Clauses the first time a goal selects them"""
+    __slots__ = ('index', 'solver', 'all', 'variables', 'selected')
+
+    def __init__(self, index, solver):
+        self.index = index
+        self.solver = solver
+        self.all = None
+        # the clauses whose first argument is a variable, which are all a
+        # goal tries when no clause has its first argument
+        self.variables = None
+        # first-argument key -> the clauses a goal with that key tries
+        self.selected = {}
+
+    def clauses(self):
+        """Return every clause, in program order"""
+        if self.all is None:
+            self.all = self.solver.build(self.index.numbers())
+        return self.all
+
+    def select(self, key):
+        """Return the clauses to try for a goal whose first argument has key"""
+        if key is None:
+            return self.clauses()
+        clauses = self.selected.get(key)
+        if clauses is None:
+            numbers = self.index.keyed(key)
+            if numbers is None:
+                if self.variables is None:
+                    self.variables = self.solver.build(self.index.variables())
+                return self.variables
+            variables = self.index.variables()
+            if variables:
+                numbers = heapq.merge(numbers, variables)
+            clauses = self.selected[key] = self.solver.build(numbers)
+        return clauses
+
+class _Procedures(dict):
+    """(name, arity) -> Procedure, or None when no clause has that head;
+    each is made the first time a goal looks it up"""
+
+    def __init__(self, solver, find):
+        super().__init__()
+        self.solver = solver
+        self.find = find
+
+    def __missing__(self, key):
+        index = self.find(*key)
+        procedure = self[key] = None if index is None else Procedure(index, self.solver)
+        return procedure
+
+class _Compiler():
+    """Turns tree nodes into terms, numbering the variables of one clause"""
+
+    def __init__(self):
+        self.slots = {}
+        self.size = 0
+
+    def variable(self, name):
+        if name == '_':
+            # every _ is a different variable
+            self.size += 1
+            return Slot(self.size - 1, name)
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = Slot(self.size, name)
+            self.size += 1
+        return slot
+
+    def term(self, node):
+        """Return the term for a tree node. Nested structures are kept on a
+            stack instead of recursing"""
+        # (node, args compiled so far) of the structures being compiled
+        stack = []
+        while True:
+            if isinstance(node, Structure):
+                stack.append((node, []))
+                node = node.args[0]
+                continue
+            if isinstance(node, Atom):
+                term = node.name
+            elif isinstance(node, Numeral):
+                term = node.value
+            elif isinstance(node, Variable):
+                term = self.variable(node.name)
+            else:
+                raise TypeError('not a term: ' + repr(node))
+            while stack:
+                parent, args = stack[-1]
+                args.append(term)
+                if len(args) < len(parent.args):
+                    node = parent.args[len(args)]
+                    break
+                stack.pop()
+                term = Struct(parent.functor.name, tuple(args))
+            else:
+                return term
+
+    def goal(self, predicate):
+        if not predicate.args:
+            return predicate.functor.name
+        return Struct(predicate.functor.name, tuple(self.term(arg) for arg in predicate.args))
+
+class Solver():
+    """Resolution engine for the tree.Program of a valid program.
+    Usage:
+        solver = Solver(program)
+        for solution in solver.solutions():   # {'Who': 'west'}
+            ..."""
+
+    def __init__(self, program):
+        self.program = program
+        if isinstance(program, compiled.CompiledProgram):
+            find = program.procedure
+        else:
+            indexes = _tree_procedures(program.clauses)
+            find = lambda name, arity: indexes.get((name, arity))
+        # (name, arity) -> Procedure
+        self.procedures = _Procedures(self, find)
+        # clause number -> Clause, for the clauses built so far
+        self.built = {}
+        self.inferences = 0
+
+    def build(self, numbers):
+        """Return the Clauses with these numbers, building the ones no goal
+        has tried yet"""
+        built = self.built
+        clauses = []
+        for number in numbers:
+            clause = built.get(number)
+            if clause is None:
+                node = self.program.clauses[number]
+                compiler = _Compiler()
+                head = compiler.goal(node.head)
+                body = tuple(compiler.goal(goal) for goal in node.body)
+                args = head.args if type(head) is Struct else ()
+                clause = built[number] = Clause(args, body, compiler.size, node.line)
+            clauses.append(clause)
+        return clauses
+
+    def solutions(self, query=None):
+        """Yield a dict of the values of the named variables for each
+        solution of query, a tree.Query (the program's by default)"""
+        if query is None:
+            query = self.program.query
+        compiler = _Compiler()
+        goals = [compiler.goal(goal) for goal in query.body]
+        env = [None] * compiler.size
+        names = [(name, slot) for name, slot in compiler.slots.items() if not name.startswith('_')]
+        for _ in self.run(goals, env):
+            unbound = {}
+            yield {name: self.text(slot, env, unbound) for name, slot in names}
+
+    def run(self, goals, env):
+        """Yield once for each solution of goals, whose variables are in
+        env; the bindings hold until the generator is resumed"""
+        trail = []
+        choices = []
+        procedures = self.procedures
+        unify_args = self.unify_args
+        goal = None
+        for term in reversed(goals):
+            goal = (term, env, goal)
+        while True:
+            candidates = None
+            if goal is None:
+                yield
+            else:
+                term, env, rest = goal
+                self.inferences += 1
+                if type(term) is Struct:
+                    args = term.args
+                    procedure = procedures[(term.name, len(args))]
+                    if procedure is not None:
+                        # dereference the first argument for the index
+                        first, first_env = args[0], env
+                        while type(first) is Slot:
+                            cell = first_env[first.index]
+                            if cell is None:
+                                break
+                            first, first_env = cell
+                        candidates = procedure.select(_first_key(first))
+                else:
+                    args = ()
+                    procedure = procedures[(term, 0)]
+                    if procedure is not None:
+                        candidates = procedure.clauses()
+                i = 0
+                mark = len(trail)
+            # resolve with the next candidate clause, backtracking when
+            # there is none
+            while True:
+                if candidates is None or i == len(candidates):
+                    if not choices:
+                        return
+                    args, env, rest, candidates, i, mark = choices.pop()
+                    while len(trail) > mark:
+                        bound_env, index = trail.pop()
+                        bound_env[index] = None
+                clause = candidates[i]
+                i += 1
+                clause_env = [None] * clause.size
+                alternatives = i < len(candidates)
+                if alternatives:
+                    choices.append((args, env, rest, candidates, i, mark))
+                if unify_args(clause.args, clause_env, args, env, trail, choices):
+                    goal = rest
+                    for term in reversed(clause.body):
+                        goal = (term, clause_env, goal)
+                    break
+                if alternatives:
+                    choices.pop()
+                while len(trail) > mark:
+                    bound_env, index = trail.pop()
+                    bound_env[index] = None
+
+    @staticmethod
+    def unify_args(params, param_env, args, arg_env, trail, choices):
+        """Unify the terms in params with those in args, binding slots and
+        recording them on trail when there are choices to backtrack to"""
+        # arguments of structures still to unify
+        stack = []
+        i = 0
+        while True:
+            if i < len(params):
+                a = params[i]
+                a_env = param_env
+                b = args[i]
+                b_env = arg_env
+                i += 1
+            elif stack:
+                a, a_env, b, b_env = stack.pop()
+            else:
+                return True
+            while type(a) is Slot:
+                cell = a_env[a.index]
+                if cell is None:
+                    break
+                a, a_env = cell
+            while type(b) is Slot:
+                cell = b_env[b.index]
+                if cell is None:
+                    break
+                b, b_env = cell
+            if type(a) is Slot:
+                if type(b) is Slot and b.index == a.index and b_env is a_env:
+                    continue
+                a_env[a.index] = (b, b_env)
+                if choices:
+                    trail.append((a_env, a.index))
+            elif type(b) is Slot:
+                b_env[b.index] = (a, a_env)
+                if choices:
+                    trail.append((b_env, b.index))
+            elif type(a) is Struct:
+                if type(b) is not Struct or a.name != b.name or len(a.args) != len(b.args):
+                    return False
+                for k in range(len(a.args)):
+                    stack.append((a.args[k], a_env, b.args[k], b_env))
+            elif type(a) is not type(b) or a != b:
+                return False
+
+    def text(self, term, env, unbound=None):
+        """Return the text of term with its bindings in env; unbound
+        variables are written _G0, _G1, ... in the order they appear.
+        unbound holds the names given so far, to share them between terms"""
+        pieces = []
+        if unbound is None:
+            unbound = {}
+        # terms to write, last first, and the text between them
+        stack = [(term, env)]
+        while stack:
+            item = stack.pop()
+            if type(item) is str:
+                pieces.append(item)
+                continue
+            term, env = item
+            while type(term) is Slot:
+                cell = env[term.index]
+                if cell is None:
+                    break
+                term, env = cell
+            if type(term) is Slot:
+                key = (id(env), term.index)
+                if key not in unbound:
+                    unbound[key] = '_G' + str(len(unbound))
+                pieces.append(unbound[key])
+            elif type(term) is Struct:
+                pieces.append(_atom_text(term.name) + '(')
+                stack.append(')')
+                for i in range(len(term.args) - 1, -1, -1):
+                    stack.append((term.args[i], env))
+                    if i > 0:
+                        stack.append(', ')
+            elif type(term) is str:
+                pieces.append(_atom_text(term))
+            else:
+                pieces.append(str(term))
+        return ''.join(pieces)
+
+def _atom_text(name):
+    if _PLAIN_ATOM_RE.fullmatch(name):
+        return name
+    return "'" + name + "'"
+
+def format_solution(solution):
+    """Return a solution as "X = a, Y = b", or "true" without variables"""
+    if not solution:
+        return 'true'
+    return ', '.join(name + ' = ' + value for name, value in solution.items())
+
+def main(argv=None) -> int:
+    argparser = argparse.ArgumentParser(description="Answer the query of a program")
+    argparser.add_argument('program', help='program file; its compiled form (see compiled.py) is used '
+                           'when that is up to date')
+    argparser.add_argument('-n', '--solutions', type=int, default=None, metavar='N',
+                           help='stop after N solutions (default: all)')
+    argparser.add_argument('--stats', action='store_true',
+                           help='print the inferences and inferences per second to stderr')
+    args = argparser.parse_args(argv)
+    errors, program = compiled.load_program(args.program)
+    if errors:
+        for error in errors:
+            print(error, file=sys.stderr)
+        return 1
+    solver = Solver(program)
+    found = 0
+    start = time.perf_counter()
+    for solution in solver.solutions():
+        print(format_solution(solution), flush=True)
+        found += 1
+        if args.solutions is not None and found >= args.solutions:
+            break
+    elapsed = time.perf_counter() - start
+    if not found:
+        print('false')
+    if args.stats:
+        rate = solver.inferences / elapsed if elapsed > 0 else 0.0
+        print(f'{solver.inferences} inferences in {elapsed:.3f} s, {rate:.0f} inferences/s', file=sys.stderr)
+    return 0
+
+if __name__=="__main__": exit(main())
@@ -0,0 +1,168 @@
+# streaming.py
+# Clause-by-clause validation of programs read from a file object
+"""Validate a program without holding all of it in memory.
+
+The input is read in chunks and cut after each "." that is outside single
+quotes. The clauses in the text read so far are parsed with a CursorParser
+and their errors are yielded as soon as each clause is done. Cutting at a
+"." is only a guess at where a clause ends: when a clause runs into the end
+of the text read so far, it is parsed again once more text has been read,
+so the errors are the same as Parser(whole_program).parse() would give."""
+import codecs
+import re
+import sys
+
+import lexer
+from parser import Parser, CursorParser
+
+CHUNK_SIZE = 1 << 16
+
+# characters that matter when looking for the end of a clause
+_CLAUSE_END_RE = re.compile("['.]")
+
+def read_blocks(source, chunk_size=CHUNK_SIZE):
+    """Read the file object source in chunks of chunk_size.
+    Yield (text, final) pairs; unless final is True, text ends right after
+    a "." that is outside single quotes. Binary files are decoded as UTF-8."""
+    decoder = None
+    pending = ''
+    # number of characters of pending already scanned, and whether the scan
+    # ended inside single quotes
+    scanned = 0
+    in_quotes = False
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            yield pending, True
+            return
+        if isinstance(chunk, bytes):
+            if decoder is None:
+                decoder = codecs.getincrementaldecoder('utf-8')()
+            # an incomplete UTF-8 sequence decodes to nothing until the rest
+            # of it is read
+            chunk = decoder.decode(chunk)
+        pending += chunk
+        cut = -1
+        for m in _CLAUSE_END_RE.finditer(pending, scanned):
+            if m.group() == "'":
+                in_quotes = not in_quotes
+            elif not in_quotes:
+                cut = m.end()
+        scanned = len(pending)
+        if cut >= 0:
+            yield pending[:cut], False
+            pending = pending[cut:]
+            scanned -= cut
+
+class StreamParser():
+    """Validate a program read from a file object, clause by clause.
+    Usage: for error in StreamParser(sys.stdin).errors(): ...
+    Only the clause being parsed and at most about one chunk of lookahead
+    are kept in memory. The one exception is text left over after the
+    <query>, which is reported in full as Parser.program() does."""
+
+    class EndOfInput(Exception):
+        """Raised in place of StopIteration, which cannot be raised out of a
+        generator, once the whole input has been read"""
+
+    def __init__(self, source, chunk_size=CHUNK_SIZE, dedupe=False):
+        self.blocks = read_blocks(source, chunk_size)
+        self.final = False
+        # CursorParser's; each clause is parsed by one parser, so repeats
+        # are found without carrying them from one parser to the next
+        self.dedupe = dedupe
+        self.parser = CursorParser('')
+
+    def refill(self):
+        """Drop the text parsed so far and append the next block.
+            The cursor must be where parsing should resume"""
+        old = self.parser
+        text, self.final = next(self.blocks)
+        self.parser = CursorParser(old.contents[old.pos:] + text, dedupe=self.dedupe)
+        self.parser.line_num = old.line_num
+
+    def attempt(self, routine):
+        """Call routine (a method of CursorParser) at the cursor until it
+            has not run into the end of the text read so far.
+            Return the list of errors it added; do not catch ParserError.
+            Running into the end of the input raises StreamParser.EndOfInput
+            with the message of the StopIteration"""
+        while True:
+            backup = self.parser.mark()
+            nerrors = len(self.parser.error_list)
+            try:
+                routine(self.parser)
+            except StopIteration as si:
+                if self.final:
+                    raise StreamParser.EndOfInput(str(si))
+                # try again with more text
+                self.parser.reset(backup)
+                del self.parser.error_list[nerrors:]
+                self.refill()
+                continue
+            new_errors = self.parser.error_list[nerrors:]
+            del self.parser.error_list[:]
+            return new_errors
+
+    def errors(self):
+        """Generator that yields the same error messages as Parser.parse(),
+        each one as soon as the clause it belongs to has been parsed"""
+        try:
+            self.attempt(CursorParser.skip_blanks)
+        except StreamParser.EndOfInput:
+            yield "Error: program was the empty string"
+            return
+        try:
+            if self.parser.peek_kind()[0] not in (lexer.QUERY, lexer.QMARK):
+                yield from self.clause_list()
+            yield from self.query()
+        except (Parser.ParserError, StreamParser.EndOfInput) as err:
+            # a ParserError never depends on text that has not been read yet
+            yield from self.parser.error_list
+            yield str(err)
+
+    def clause_list(self):
+        """Yield the errors of each <clause> until the <query> is reached"""
+        while True:
+            yield from self.attempt(CursorParser.clause)
+            try:
+                self.attempt(CursorParser.skip_blanks)
+            except StreamParser.EndOfInput:
+                raise StreamParser.EndOfInput("Line "+str(self.parser.line_num)+': reached EOF while parsing clause list')
+            if self.parser.peek_kind()[0] in (lexer.QUERY, lexer.QMARK):
+                return
+
+    def query(self):
+        """Yield the errors of the <query> and of anything left after it"""
+        yield from self.attempt(CursorParser.query)
+        try:
+            self.attempt(CursorParser.skip_blanks)
+        except StreamParser.EndOfInput:
+            # This is good, the file is done
+            return
+        yield 'After parsing the program, the following remained in the file:\n'+self.rest()
+
+    def rest(self):
+        """Return the text from the cursor to the end of the input"""
+        remaining = [self.parser.contents[self.parser.pos:]]
+        for text, final in self.blocks:
+            remaining.append(text)
+        return ''.join(remaining)
+
+def main(argv=None) -> int:
+    """Stream-validate the file named in argv (or stdin), printing errors
+    as they are found"""
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] == '-':
+        source = sys.stdin
+    else:
+        source = open(argv[0], 'r')
+    valid = True
+    for error in StreamParser(source).errors():
+        valid = False
+        print(error, flush=True)
+    if valid:
+        print("Valid program")
+    return 0 if valid else 1
+
+if __name__=="__main__": exit(main())
@@ -0,0 +1,222 @@
+# tree.py
+# Syntax tree for valid programs
+"""Syntax tree nodes and the builder that makes them from a token stream.
+
+The tree is only built for programs that parsed without errors, so the
+builder can read the tokens straight through without backtracking. Nodes
+use __slots__, and the leaves are shared: every occurrence of an atom (or
+functor), variable name or numeral is the same node, kept in the program's
+SymbolTable. Quoted atoms are stored without their quotes and numerals as
+ints."""
+import lexer
+
+class Node():
+    """Base class of the tree nodes"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return type(self).__name__ + '(' + ', '.join(repr(getattr(self, name)) for name in self.__slots__) + ')'
+
+class Atom(Node):
+    """<atom>; also the name of a predicate or structure"""
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+class Variable(Node):
+    """<variable>"""
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+class Numeral(Node):
+    """<numeral>, as an int"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+class Structure(Node):
+    """<structure>: functor is an Atom and args a tuple of terms"""
+    __slots__ = ('functor', 'args')
+
+    def __init__(self, functor, args):
+        self.functor = functor
+        self.args = args
+
+class Predicate(Node):
+    """<predicate>: functor is an Atom and args a tuple of terms, empty for
+    a predicate that is just an atom"""
+    __slots__ = ('functor', 'args')
+
+    def __init__(self, functor, args):
+        self.functor = functor
+        self.args = args
+
+class Clause(Node):
+    """<clause>: head is a Predicate and body a tuple of Predicates, empty
+    for a fact. line is the line the clause starts on and offset the
+    offset of its first character in the program text"""
+    __slots__ = ('head', 'body', 'line', 'offset')
+
+    def __init__(self, head, body, line, offset=None):
+        self.head = head
+        self.body = body
+        self.line = line
+        self.offset = offset
+
+class Query(Node):
+    """<query>: body is a tuple of Predicates"""
+    __slots__ = ('body', 'line')
+
+    def __init__(self, body, line):
+        self.body = body
+        self.line = line
+
+class Program(Node):
+    """<program>: clauses is a list of Clauses"""
+    __slots__ = ('clauses', 'query', 'symbols')
+
+    def __init__(self, clauses, query, symbols):
+        self.clauses = clauses
+        self.query = query
+        self.symbols = symbols
+
+class SymbolTable():
+    """The leaf nodes of a program, one per atom name, variable name and
+    numeral value"""
+
+    def __init__(self):
+        self.atoms = {}
+        self.variables = {}
+        self.numerals = {}
+
+    def atom(self, name):
+        node = self.atoms.get(name)
+        if node is None:
+            node = self.atoms[name] = Atom(name)
+        return node
+
+    def variable(self, name):
+        node = self.variables.get(name)
+        if node is None:
+            node = self.variables[name] = Variable(name)
+        return node
+
+    def numeral(self, text):
+        node = self.numerals.get(text)
+        if node is None:
+            node = self.numerals[text] = Numeral(int(text))
+        return node
+
+class TreeBuilder():
+    """Build the Program for a valid program from its lexer.TokenStream.
+    Usage: TreeBuilder(stream).program()"""
+
+    def __init__(self, stream):
+        self.contents = stream.contents
+        self.kinds = stream.kinds
+        self.starts = stream.starts
+        self.symbols = SymbolTable()
+        self.tok = 0
+        self.line_num = 1
+
+    def next_kind(self):
+        """Skip blank tokens and return the kind of the next token"""
+        kinds = self.kinds
+        tok = self.tok
+        while kinds[tok] in lexer.BLANK_KINDS:
+            if kinds[tok] == lexer.NEWLINE:
+                self.line_num += 1
+            tok += 1
+        self.tok = tok
+        return kinds[tok]
+
+    def expect(self, kind):
+        """Consume the next token, which must be of the given kind"""
+        if self.next_kind() != kind:
+            raise ValueError('expected ' + lexer.TOKEN_NAMES[kind] + ' at offset ' + str(self.starts[self.tok]))
+        self.tok += 1
+
+    def program(self):
+        clauses = []
+        while self.next_kind() != lexer.QUERY:
+            clauses.append(self.clause())
+        line_num = self.line_num
+        self.expect(lexer.QUERY)
+        query = Query(self.predicate_list(), line_num)
+        self.expect(lexer.PERIOD)
+        return Program(clauses, query, self.symbols)
+
+    def clause(self):
+        line_num = self.line_num
+        offset = self.starts[self.tok]
+        head = self.predicate()
+        body = ()
+        if self.next_kind() == lexer.NECK:
+            self.tok += 1
+            body = self.predicate_list()
+        self.expect(lexer.PERIOD)
+        return Clause(head, body, line_num, offset)
+
+    def predicate_list(self):
+        predicates = [self.predicate()]
+        while self.next_kind() == lexer.COMMA:
+            self.tok += 1
+            predicates.append(self.predicate())
+        return tuple(predicates)
+
+    def predicate(self):
+        functor = self.atom()
+        if self.next_kind() == lexer.LPAREN:
+            self.tok += 1
+            return Predicate(functor, self.term_list())
+        return Predicate(functor, ())
+
+    def atom(self):
+        kind = self.next_kind()
+        start = self.starts[self.tok]
+        end = self.starts[self.tok+1]
+        if kind == lexer.STRING:
+            start += 1
+            end -= 1
+        elif kind != lexer.ATOM:
+            raise ValueError('expected an atom at offset ' + str(start))
+        self.tok += 1
+        return self.symbols.atom(self.contents[start:end])
+
+    def term_list(self):
+        """Read terms up to and including the ")" that closes the term list.
+            Nested structures are kept on a stack instead of recursing"""
+        symbols = self.symbols
+        # (functor, args) of the structures whose term lists are open
+        structures = []
+        args = []
+        while True:
+            kind = self.next_kind()
+            if kind == lexer.ATOM or kind == lexer.STRING:
+                functor = self.atom()
+                if self.next_kind() == lexer.LPAREN:
+                    self.tok += 1
+                    structures.append((functor, args))
+                    args = []
+                    continue
+                args.append(functor)
+            elif kind == lexer.VARIABLE:
+                args.append(symbols.variable(self.contents[self.starts[self.tok]:self.starts[self.tok+1]]))
+                self.tok += 1
+            elif kind == lexer.NUMERAL:
+                args.append(symbols.numeral(self.contents[self.starts[self.tok]:self.starts[self.tok+1]]))
+                self.tok += 1
+            else:
+                raise ValueError('expected a term at offset ' + str(self.starts[self.tok]))
+            while self.next_kind() == lexer.RPAREN:
+                self.tok += 1
+                if not structures:
+                    return tuple(args)
+                functor, parent = structures.pop()
+                parent.append(Structure(functor, tuple(args)))
+                args = parent
+            self.expect(lexer.COMMA)
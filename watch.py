@@ -0,0 +1,205 @@
+# watch.py
+# Keep the output file up to date while program files are edited
+"""Watch mode for the batch runner.
+
+Watcher parses the files once, writes the output file like
+batch.run_batch(), and then polls the files with stat(): a file whose
+modification time, size or inode changed is parsed again in this process,
+and the output file is rewritten with the new entry in place of the old
+one. Glob patterns are expanded again on every poll, and a directory is
+listed again when its own stat changes (adding, removing or renaming a
+file in it changes its modification time), so files that appear or go
+away are added to or dropped from the output.
+
+Editors often save a file in several writes, or write a new file and
+rename it over the old one. A change is only parsed once the file was last
+modified at least the debounce time ago, so a burst of writes is parsed
+once, after the last of them; a file that was saved in one go is parsed on
+the first poll that sees it."""
+import fnmatch
+import glob
+import os
+import re
+import stat
+import sys
+import time
+
+from parser import header
+from batch import DIRECTORY_PATTERN, natural_key, numbered_files, parse_file
+
+# seconds between polls
+POLL_INTERVAL = 0.02
+# seconds a changed file must go unmodified before it is parsed
+DEBOUNCE = 0.04
+
+def _signature(st):
+    # st_mode too, so that a file made readable again is parsed again
+    return st.st_mtime_ns, st.st_size, st.st_ino, st.st_mode
+
+class Watcher():
+    """Keep ofilename up to date with the results of the files given by
+    specs (paths, directories and glob patterns as for
+    batch.expand_paths(); the numbered files in the current directory if
+    empty).
+    Usage: Watcher(specs).run()"""
+
+    def __init__(self, specs=(), ofilename='parser_output.txt', pattern=DIRECTORY_PATTERN,
+                 interval=POLL_INTERVAL, debounce=DEBOUNCE, max_errors=None, dedupe=False, log=sys.stderr):
+        self.specs = list(specs)
+        self.ofilename = ofilename
+        self.pattern = pattern
+        self.interval = interval
+        self.debounce = debounce
+        self.max_errors = max_errors
+        self.dedupe = dedupe
+        self.log = log
+        # path -> signature the entry was parsed from
+        self.parsed = {}
+        # path -> (entry, valid)
+        self.entries = {}
+        # path -> (signature, when it was first seen in ns) of changes not
+        # parsed yet
+        self.pending = {}
+        # the files in output order, as of the last poll
+        self.paths = []
+        self.pattern_re = re.compile(fnmatch.translate(pattern))
+        # directory -> (its signature, its files in order)
+        self.listings = {}
+
+    def list_files(self):
+        """Return the files the specs give now, in output order. A
+        directory is only listed again when its own stat changed, which
+        it does when files are added, removed or renamed in it"""
+        if not self.specs:
+            return numbered_files()
+        paths = []
+        for spec in self.specs:
+            if os.path.isdir(spec):
+                st = os.stat(spec)
+                listing = self.listings.get(spec)
+                if listing is None or listing[0] != _signature(st):
+                    with os.scandir(spec) as entries:
+                        listed = [os.path.normpath(entry.path) for entry in entries
+                                  if self.pattern_re.match(entry.name) and entry.is_file()]
+                    listing = self.listings[spec] = (_signature(st), sorted(listed, key=natural_key))
+                paths += listing[1]
+            elif glob.has_magic(spec):
+                paths += sorted(glob.glob(spec), key=natural_key)
+            else:
+                paths.append(spec)
+        return paths
+
+    def stat_files(self):
+        """Return {path: signature} for the files the specs give now, and
+        set self.paths to them in order"""
+        found = {}
+        for path in self.list_files():
+            if path in found:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                # gone, or in a directory that cannot be searched
+                continue
+            if stat.S_ISREG(st.st_mode):
+                found[path] = _signature(st)
+        self.paths = list(found)
+        return found
+
+    def parse(self, path, signature):
+        """Parse path again and record its entry; return whether it could
+        be read. A file that cannot be read (not there any more, not
+        readable or not UTF-8) is left out of the output and reported"""
+        start = time.perf_counter()
+        try:
+            self.entries[path] = parse_file(path, 1, max_errors=self.max_errors, dedupe=self.dedupe)
+        except (OSError, UnicodeDecodeError) as e:
+            self.entries.pop(path, None)
+            if isinstance(e, FileNotFoundError):
+                self.parsed.pop(path, None)
+            else:
+                # tried again once the file changes
+                self.parsed[path] = signature
+            self.report(path + ': ' + str(e))
+            return False
+        self.parsed[path] = signature
+        valid = self.entries[path][1]
+        self.report(f'{path}: {"valid" if valid else "invalid"} '
+                    f'({(time.perf_counter() - start) * 1000:.1f} ms)')
+        return True
+
+    def report(self, line):
+        if self.log is not None:
+            print(line, file=self.log, flush=True)
+
+    def write(self):
+        """Write the output file from the entries, replacing it in one step"""
+        text = self.ofilename + header + '\n'.join(self.entries[path][0] for path in self.paths
+                                                    if path in self.entries)
+        temp = self.ofilename + '.tmp'
+        with open(temp, 'w') as out:
+            out.write(text)
+        os.replace(temp, self.ofilename)
+
+    def poll(self, now=None):
+        """Look at the files once, parse the ones whose changes have
+        settled and rewrite the output file if anything changed. now is
+        the time.time_ns() of the poll. Return the paths that were parsed
+        or dropped"""
+        if now is None:
+            now = time.time_ns()
+        debounce = int(self.debounce * 1e9)
+        found = self.stat_files()
+        changed = []
+        for path in list(self.entries):
+            if path not in found:
+                # removed, or no longer matched
+                del self.entries[path]
+                self.parsed.pop(path, None)
+                self.pending.pop(path, None)
+                self.report(path + ': removed')
+                changed.append(path)
+        for path in list(self.parsed):
+            if path not in found:
+                # one that could not be read
+                del self.parsed[path]
+        for path in list(self.pending):
+            if path not in found:
+                del self.pending[path]
+        for path, signature in found.items():
+            if self.parsed.get(path) == signature:
+                self.pending.pop(path, None)
+                continue
+            waiting = self.pending.get(path)
+            if waiting is None or waiting[0] != signature:
+                # a new change, or the file is still being written
+                waiting = self.pending[path] = (signature, now)
+            # settled when it was last written long enough ago, or when
+            # its stat stayed the same that long (for clocks that disagree)
+            if now - signature[0] < debounce and now - waiting[1] < debounce:
+                continue
+            del self.pending[path]
+            self.parse(path, signature)
+            changed.append(path)
+        if changed:
+            self.write()
+        return changed
+
+    def start(self):
+        """Parse every file and write the output file"""
+        for path, signature in self.stat_files().items():
+            self.parse(path, signature)
+        self.write()
+
+    def run(self):
+        """Parse every file, then keep the output file up to date until
+        interrupted"""
+        self.start()
+        self.report(f'watching {len(self.paths)} files; ^C to stop')
+        try:
+            while True:
+                time.sleep(self.interval)
+                self.poll()
+        except KeyboardInterrupt:
+            pass
+        return 0